@@ -5,6 +5,7 @@ from sensor_msgs.msg import Image
 import torch
 import torch.nn as nn
 from torchvision import transforms
+import torchvision.transforms.functional as TF
 
 import numpy as np
 from PIL import Image as PILImage
@@ -14,6 +15,7 @@ from typing import List
 from gnm_train.models.gnm import GNM
 from gnm_train.models.stacked import StackedModel
 from gnm_train.models.siamese import SiameseModel
+from gnm_train.data.batch_transform import BatchTransform
 
 
 def load_model(
@@ -97,18 +99,11 @@ def transform_images(
     """
     assert len(image_size) == 2
     image_size = image_size[::-1] # torchvision's transforms.Resize expects [height, width]
-    transform_type = transforms.Compose(
-        [
-            transforms.ToTensor(),
-            transforms.Resize(image_size[::-1]),  
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
+    batch_transform = BatchTransform(image_size)
     if type(pil_imgs) != list:
         pil_imgs = [pil_imgs]
-    transf_imgs = []
-    for pil_img in pil_imgs:
-        transf_img = transform_type(pil_img)
-        transf_img = torch.unsqueeze(transf_img, 0)
-        transf_imgs.append(transf_img)
-    return torch.cat(transf_imgs, dim=1)
+    # stack the images as uint8 and convert, resize and normalize them at once
+    uint8_imgs = torch.cat(
+        [TF.pil_to_tensor(pil_img.convert("RGB")) for pil_img in pil_imgs], dim=0
+    )
+    return batch_transform(uint8_imgs).unsqueeze(0)
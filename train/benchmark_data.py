@@ -0,0 +1,529 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import ConcatDataset, DataLoader, Dataset, default_collate
+from torchvision import transforms
+
+from gnm_train.data.gnm_dataset import GNM_Dataset
+from gnm_train.data.pairwise_distance_dataset import PairwiseDistanceDataset
+from gnm_train.data.batch_transform import (
+    BatchTransform,
+    BatchTransformLoader,
+    get_uint8_transform,
+)
+from gnm_train.data.samplers import BlockShuffleSampler
+from stable_contrastive_rl_train.data.rl_dataset import RLDataset
+
+DATASET_TYPES = ["action", "distance", "rl", "pairwise"]
+
+
+def get_transform(args: argparse.Namespace) -> transforms:
+    if args.batch_transform:
+        return get_uint8_transform(args.image_size)
+    return transforms.Compose(
+        [
+            transforms.ToTensor(),
+            transforms.Resize((args.image_size[1], args.image_size[0])),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
+
+
+def build_dataset(
+    dataset_type: str,
+    data_split_folder: str,
+    context_size: int,
+    args: argparse.Namespace,
+) -> Dataset:
+    # the distance categories are the ones of config/defaults.yaml and the rl configs
+    kwargs = dict(
+        data_folder=args.data_dir,
+        data_split_folder=data_split_folder,
+        dataset_name=args.dataset_name,
+        transform=get_transform(args),
+        aspect_ratio=args.image_size[0] / args.image_size[1],
+        waypoint_spacing=args.waypoint_spacing,
+        context_size=context_size,
+        traj_cache_size=args.traj_cache_size,
+        packed_image_folder=args.packed_image_folder,
+        frame_cache_bytes=int(args.frame_cache_mb * 2**20),
+        viz_images=not args.no_viz_images,
+        decode_threads=args.decode_threads,
+        jpeg_draft=args.jpeg_draft,
+    )
+    if dataset_type in ["action", "distance"]:
+        return GNM_Dataset(
+            is_action=dataset_type == "action",
+            min_dist_cat=2 if dataset_type == "action" else 0,
+            max_dist_cat=10 if dataset_type == "action" else 20,
+            negative_mining=True,
+            len_traj_pred=5,
+            learn_angle=True,
+            **kwargs,
+        )
+    elif dataset_type == "rl":
+        return RLDataset(
+            min_dist_cat=2,
+            max_dist_cat=20,
+            discount=0.99,
+            len_traj_pred=5,
+            learn_angle=True,
+            **kwargs,
+        )
+    elif dataset_type == "pairwise":
+        return PairwiseDistanceDataset(
+            min_dist_cat=0,
+            max_dist_cat=20,
+            close_far_threshold=10,
+            negative_mining=True,
+            **kwargs,
+        )
+    raise ValueError(f"Invalid dataset type {dataset_type}")
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    latencies_ms = np.asarray(latencies) * 1000
+    if len(latencies_ms) == 0:
+        return {}
+    return {
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+class StageTimer:
+    def __init__(self, dataset: Dataset) -> None:
+        """
+        Times the stages of __getitem__ by wrapping the frame loading, the transform and the label lookup of a dataset
+        instance (remove restores them). Decoding is the frame loading minus the transform, so it includes reading the
+        jpgs or the packed frames and the frame cache lookups. The durations are summed per sample.
+        With decode_threads the transforms run concurrently on the decode threads, so their summed time can't be
+        taken out of the wall clock time of the frame loading: the frame loading is reported whole as "load" and
+        the transform time of the threads separately.
+
+        Args:
+            dataset (Dataset): dataset to time
+        """
+        self.dataset = dataset
+        self.durations = {"load": [], "transform": [], "labels": []}
+        # the depth of the nested load calls of each thread
+        self._local = threading.local()
+        frame_loader = dataset.frame_loader
+        self.threaded = frame_loader.decode_threads > 0
+        self._transform = frame_loader.transform
+        frame_loader.load = self._wrap("load", frame_loader.load, outer_only=True)
+        frame_loader.transform = self._wrap("transform", frame_loader.transform)
+        self._label_table = getattr(dataset, "label_table", None)
+        if getattr(dataset, "online_goals", False):
+            dataset._compute_labels = self._wrap("labels", dataset._compute_labels)
+        elif self._label_table is not None:
+            dataset.label_table = _TimedTable(self._label_table, self.durations["labels"])
+
+    def _wrap(self, stage: str, func, outer_only: bool = False):
+        def timed(*args, **kwargs):
+            # FrameLoader.load calls itself for the unique frames of a sample, only time the outer call
+            depth = getattr(self._local, "depth", 0)
+            if outer_only and depth > 0:
+                return func(*args, **kwargs)
+            self._local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.durations[stage].append(time.perf_counter() - start)
+                self._local.depth = depth
+
+        return timed
+
+    def take(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        # the wall clock time of each stage since the last take and the time summed over the decode threads, in seconds
+        stages = {stage: sum(durations) for stage, durations in self.durations.items()}
+        for durations in self.durations.values():
+            durations.clear()
+        if self.threaded:
+            return stages, {"transform": stages.pop("transform")}
+        stages["decode"] = stages.pop("load") - stages["transform"]
+        return stages, {}
+
+    def remove(self) -> None:
+        frame_loader = self.dataset.frame_loader
+        del frame_loader.load
+        frame_loader.transform = self._transform
+        if "_compute_labels" in vars(self.dataset):
+            del self.dataset._compute_labels
+        if self._label_table is not None:
+            self.dataset.label_table = self._label_table
+
+
+class _TimedTable:
+    # a label table whose lookups are timed
+    def __init__(self, table: np.ndarray, durations: List[float]) -> None:
+        self.table = table
+        self.durations = durations
+
+    def __getitem__(self, i):
+        start = time.perf_counter()
+        labels = self.table[i]
+        self.durations.append(time.perf_counter() - start)
+        return labels
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+def bench_getitem(
+    dataset: Dataset, num_samples: int, seed: int, batch_sizes: List[int], args: argparse.Namespace
+) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(dataset), min(num_samples, len(dataset)))
+    latencies = []
+    samples = []
+    timer = StageTimer(dataset)
+    if timer.threaded:
+        stage_latencies = {"load": [], "labels": [], "other": []}
+        thread_stage_latencies = {"transform": []}
+    else:
+        stage_latencies = {"decode": [], "transform": [], "labels": [], "other": []}
+        thread_stage_latencies = {}
+    try:
+        for i in indices:
+            start = time.perf_counter()
+            samples.append(dataset[int(i)])
+            latencies.append(time.perf_counter() - start)
+            stages, thread_stages = timer.take()
+            stages["other"] = latencies[-1] - sum(stages.values())
+            for stage, latency in stages.items():
+                stage_latencies[stage].append(latency)
+            for stage, latency in thread_stages.items():
+                thread_stage_latencies[stage].append(latency)
+    finally:
+        timer.remove()
+    result = latency_stats(latencies)
+    result["stages"] = {
+        stage: latency_stats(stage_latency)
+        for stage, stage_latency in stage_latencies.items()
+    }
+    result["thread_stages"] = {
+        stage: latency_stats(stage_latency)
+        for stage, stage_latency in thread_stage_latencies.items()
+    }
+    result["collate"] = {
+        batch_size: bench_collate(samples, batch_size, args) for batch_size in batch_sizes
+    }
+    return result
+
+
+def bench_collate(
+    samples: List, batch_size: int, args: argparse.Namespace
+) -> Dict[str, float]:
+    # collate the samples of bench_getitem into batches in this process, the DataLoader workers do the same
+    latencies = []
+    batch_transform_latencies = []
+    for start in range(0, len(samples) - batch_size + 1, batch_size):
+        t = time.perf_counter()
+        batch = default_collate(samples[start : start + batch_size])
+        latencies.append(time.perf_counter() - t)
+        if args.batch_transform:
+            t = time.perf_counter()
+            next(iter(BatchTransformLoader([batch], BatchTransform(args.image_size))))
+            batch_transform_latencies.append(time.perf_counter() - t)
+    result = latency_stats(latencies)
+    if args.batch_transform:
+        result["batch_transform"] = latency_stats(batch_transform_latencies)
+    return result
+
+
+def bench_loader(
+    dataset: Dataset,
+    batch_size: int,
+    num_workers: int,
+    num_batches: int,
+    args: argparse.Namespace,
+) -> Dict[str, float]:
+    dataset = ConcatDataset([dataset])
+    sampler = None
+    if args.shuffle_block_size > 0:
+        sampler = BlockShuffleSampler(dataset, args.shuffle_block_size, args.seed)
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=sampler is None,
+        sampler=sampler,
+        num_workers=num_workers,
+        drop_last=True,
+    )
+    if args.batch_transform:
+        loader = BatchTransformLoader(loader, BatchTransform(args.image_size))
+    num_batches = min(num_batches, len(loader))
+    latencies = []
+    start = time.perf_counter()
+    last = start
+    for i, _ in enumerate(loader):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        if i + 1 >= num_batches:
+            break
+    result = {"num_batches": len(latencies)}
+    if len(latencies) > 0:
+        result["first_batch_s"] = latencies[0]
+        # the first batch pays for the worker startup, leave it out of the throughput
+        steady = latencies[1:]
+        if len(steady) > 0:
+            result["samples_per_s"] = batch_size * len(steady) / sum(steady)
+            result["batch"] = latency_stats(steady)
+    if sampler is not None:
+        result["sampler_locality"] = sampler.last_locality
+    return result
+
+
+def get_git_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def main(args: argparse.Namespace):
+    results = []
+    for dataset_type in args.dataset_types:
+        for context_size in args.context_size:
+            data_split_folder = args.split_dir
+            tmp_dir = None
+            if args.cold_index:
+                # build the index from scratch in a copy of the split, without touching the cached indices
+                tmp_dir = tempfile.mkdtemp()
+                shutil.copy(os.path.join(args.split_dir, "traj_names.txt"), tmp_dir)
+                data_split_folder = tmp_dir
+            np.random.seed(args.seed)
+            start = time.perf_counter()
+            dataset = build_dataset(dataset_type, data_split_folder, context_size, args)
+            index_build_s = time.perf_counter() - start
+            print(
+                f"{dataset_type} (context_size {context_size}): {len(dataset)} samples, dataset built in {index_build_s:.2f}s"
+            )
+            getitem = bench_getitem(
+                dataset, args.num_getitem, args.seed, args.batch_size, args
+            )
+            print(
+                "  __getitem__: "
+                + ", ".join(
+                    f"{stage} {stats.get('mean_ms', 0):.2f}ms"
+                    for stage, stats in getitem["stages"].items()
+                )
+            )
+            if len(getitem["thread_stages"]) > 0:
+                print(
+                    "  summed over the decode threads: "
+                    + ", ".join(
+                        f"{stage} {stats.get('mean_ms', 0):.2f}ms"
+                        for stage, stats in getitem["thread_stages"].items()
+                    )
+                )
+            base_result = {
+                "dataset_type": dataset_type,
+                "context_size": context_size,
+                "num_samples": len(dataset),
+                "index_build_s": index_build_s,
+                "cold_index": args.cold_index,
+                "getitem": getitem,
+                "traj_cache_hit_rate": dataset.traj_data_cache.hit_rate(),
+            }
+            for num_workers in args.num_workers:
+                for batch_size in args.batch_size:
+                    result = dict(base_result)
+                    result["num_workers"] = num_workers
+                    result["batch_size"] = batch_size
+                    result["loader"] = bench_loader(
+                        dataset, batch_size, num_workers, args.num_batches, args
+                    )
+                    frame_cache = dataset.frame_loader.frame_cache
+                    if frame_cache is not None:
+                        # the frame cache lives in shared memory, so it also counts the workers' lookups
+                        result["frame_cache_hit_rate"] = frame_cache.hit_rate()
+                    print(
+                        f"  num_workers {num_workers}, batch_size {batch_size}: {result['loader'].get('samples_per_s', 0):.1f} samples/s"
+                    )
+                    results.append(result)
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir)
+
+    report = {
+        "git_commit": get_git_commit(),
+        "torch_version": torch.__version__,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "args": vars(args),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote the results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the throughput of the training datasets and dataloaders"
+    )
+    parser.add_argument(
+        "--data-dir",
+        "-i",
+        type=str,
+        help="path of the processed dataset (e.g. datasets/synthetic/ from gen_synthetic_dataset.py)",
+        required=True,
+    )
+    parser.add_argument(
+        "--split-dir",
+        "-s",
+        type=str,
+        help="path of the data split folder with traj_names.txt (e.g. datasets/synthetic/data_splits/train)",
+        required=True,
+    )
+    parser.add_argument(
+        "--dataset-name",
+        "-d",
+        default="recon",
+        type=str,
+        help="name of the dataset in data_config.yaml whose parameters to use (default: recon)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default=None,
+        type=str,
+        help="path of the json report (default: print it)",
+    )
+    parser.add_argument(
+        "--dataset-types",
+        "-t",
+        default=DATASET_TYPES,
+        nargs="+",
+        choices=DATASET_TYPES,
+        help="datasets to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        default=[0, 4],
+        nargs="+",
+        type=int,
+        help="numbers of dataloader workers to benchmark (default: 0 4)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=[64],
+        nargs="+",
+        type=int,
+        help="batch sizes to benchmark (default: 64)",
+    )
+    parser.add_argument(
+        "--context-size",
+        default=[5],
+        nargs="+",
+        type=int,
+        help="context sizes to benchmark (default: 5)",
+    )
+    parser.add_argument(
+        "--num-batches",
+        default=50,
+        type=int,
+        help="number of batches to load per configuration (default: 50)",
+    )
+    parser.add_argument(
+        "--num-getitem",
+        default=200,
+        type=int,
+        help="number of single samples to time in the main process (default: 200)",
+    )
+    parser.add_argument(
+        "--cold-index",
+        action="store_true",
+        help="time building the index from scratch instead of loading the cached one",
+    )
+    parser.add_argument(
+        "--image-size",
+        default=[85, 64],
+        nargs=2,
+        type=int,
+        help="width and height of the transformed images (default: 85 64)",
+    )
+    parser.add_argument(
+        "--waypoint-spacing",
+        default=1,
+        type=int,
+        help="waypoint spacing (default: 1)",
+    )
+    parser.add_argument(
+        "--traj-cache-size",
+        default=64,
+        type=int,
+        help="traj_cache_size of the datasets (default: 64)",
+    )
+    parser.add_argument(
+        "--frame-cache-mb",
+        default=0,
+        type=float,
+        help="frame_cache_mb of the datasets (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--packed-image-folder",
+        default=None,
+        type=str,
+        help="packed_image_folder of the datasets (default: None, decode the jpgs)",
+    )
+    parser.add_argument(
+        "--decode-threads",
+        default=0,
+        type=int,
+        help="decode_threads of the datasets (default: 0, sequential decoding)",
+    )
+    parser.add_argument(
+        "--jpeg-draft",
+        action="store_true",
+        help="build the datasets with jpeg_draft=True",
+    )
+    parser.add_argument(
+        "--no-viz-images",
+        action="store_true",
+        help="build the datasets with viz_images=False",
+    )
+    parser.add_argument(
+        "--batch-transform",
+        action="store_true",
+        help="emit uint8 images and transform them once per batch",
+    )
+    parser.add_argument(
+        "--shuffle-block-size",
+        default=0,
+        type=int,
+        help="shuffle with a BlockShuffleSampler of this block size (default: 0, plain shuffle)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="random seed (default: 0)",
+    )
+    args = parser.parse_args()
+    print("STARTING BENCHMARKING DATA PIPELINE")
+    main(args)
+    print("FINISHED BENCHMARKING DATA PIPELINE")
@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from gnm_train.data.traj_store import (
+    build_traj_store,
+    TRAJ_STORE_POSES_FILE,
+    TRAJ_STORE_OFFSETS_FILE,
+)
+
+
+def main(args: argparse.Namespace):
+    traj_names = None
+    if args.traj_names_file is not None:
+        with open(args.traj_names_file, "r") as f:
+            traj_names = [line for line in f.read().split("\n") if line != ""]
+    num_trajs, num_poses = build_traj_store(args.data_dir, traj_names)
+    print(
+        f"Wrote {num_poses} poses from {num_trajs} trajectories to "
+        f"{os.path.join(args.data_dir, TRAJ_STORE_POSES_FILE)} and "
+        f"{os.path.join(args.data_dir, TRAJ_STORE_OFFSETS_FILE)}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Consolidate the traj_data.pkl files of a processed dataset into a memory-mapped pose store"
+    )
+    parser.add_argument(
+        "--data-dir",
+        "-i",
+        type=str,
+        help="path of the processed dataset (e.g. datasets/recon/)",
+        required=True,
+    )
+    parser.add_argument(
+        "--traj-names-file",
+        "-t",
+        default=None,
+        type=str,
+        help="only include the trajectories listed in this file, e.g. a traj_names.txt (default: all)",
+    )
+    args = parser.parse_args()
+    print("STARTING BUILDING TRAJECTORY POSE STORE")
+    main(args)
+    print("FINISHED BUILDING TRAJECTORY POSE STORE")
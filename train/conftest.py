@@ -0,0 +1 @@
+# makes pytest put train/ on sys.path, so the tests import gnm_train and the scripts like python -m pytest does
@@ -6,7 +6,7 @@ import yaml
 import time
 
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torchvision import transforms
 import torch.backends.cudnn as cudnn
 
@@ -15,6 +15,11 @@ from gnm_train.models.siamese import SiameseModel
 from gnm_train.models.stacked import StackedModel
 from gnm_train.data.gnm_dataset import GNM_Dataset
 from gnm_train.data.pairwise_distance_dataset import PairwiseDistanceDataset
+from gnm_train.data.batch_transform import (
+    BatchTransform,
+    BatchTransformLoader,
+    get_uint8_transform,
+)
 from gnm_train.training.train_utils import load_model
 from gnm_train.evaluation.eval_utils import eval_loop
 
@@ -52,14 +57,21 @@ def main(config):
         cudnn.deterministic = True
 
     cudnn.benchmark = True  # good if input sizes don't vary
-    transform = [
-        transforms.ToTensor(),
-        transforms.Resize(
-            (config["image_size"][1], config["image_size"][0])
-        ),  # torch does (h, w)
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-    transform = transforms.Compose(transform)
+    if "batch_transform" not in config:
+        config["batch_transform"] = False
+    if config["batch_transform"]:
+        # the datasets emit uint8 images, they are converted and normalized once per batch
+        transform = get_uint8_transform(config["image_size"])
+        batch_transform = BatchTransform(config["image_size"])
+    else:
+        transform = [
+            transforms.ToTensor(),
+            transforms.Resize(
+                (config["image_size"][1], config["image_size"][0])
+            ),  # torch does (h, w)
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+        transform = transforms.Compose(transform)
     aspect_ratio = config["image_size"][0] / config["image_size"][1]
 
     # Load the data
@@ -71,6 +83,20 @@ def main(config):
 
     if "context_type" not in config:
         config["context_type"] = "temporal"
+    if "traj_cache_size" not in config:
+        config["traj_cache_size"] = 64
+    if "frame_cache_mb" not in config:
+        config["frame_cache_mb"] = 0
+    if "decode_threads" not in config:
+        config["decode_threads"] = 0
+    if "jpeg_draft" not in config:
+        config["jpeg_draft"] = False
+    if "index_workers" not in config:
+        config["index_workers"] = 0
+    if "eval_subset_size" not in config:
+        config["eval_subset_size"] = 0
+    if "eval_subset_seed" not in config:
+        config["eval_subset_seed"] = 0
 
     if config["model_type"] == "stable_contrastive_rl":
         output_types = ["rl", "pairwise"]
@@ -87,6 +113,8 @@ def main(config):
             data_config["end_slack"] = 0
         if "waypoint_spacing" not in data_config:
             data_config["waypoint_spacing"] = 1
+        if "packed_image_folder" not in data_config:
+            data_config["packed_image_folder"] = None
 
         for data_split_type in ["train", "test"]:
             if data_split_type in data_config:
@@ -107,6 +135,12 @@ def main(config):
                             context_size=config["context_size"],
                             context_type=config["context_type"],
                             end_slack=data_config["end_slack"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
                         )
                     elif output_type == "rl":
                         dataset = RLDataset(
@@ -123,13 +157,17 @@ def main(config):
                             discount=data_config["discount"],
                             len_traj_pred=config["len_traj_pred"],
                             learn_angle=config["learn_angle"],
-                            oracle_angles=config[output_type]["oracle_angles"],
-                            num_oracle_trajs=config[output_type]["num_oracle_trajs"],
                             context_size=config["context_size"],
                             context_type=config["context_type"],
                             end_slack=data_config["end_slack"],
                             goals_per_obs=data_config["goals_per_obs"],
                             normalize=config["normalize"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
                         )
                     else:
                         dataset = GNM_Dataset(
@@ -150,6 +188,12 @@ def main(config):
                             end_slack=data_config["end_slack"],
                             goals_per_obs=data_config["goals_per_obs"],
                             normalize=config["normalize"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
                         )
                     if data_split_type == "train":
                         if output_type == "distance":
@@ -191,13 +235,29 @@ def main(config):
 
     for dataset_type in test_dataloaders:
         for loader_type in test_dataloaders[dataset_type]:
+            dataset = test_dataloaders[dataset_type][loader_type]
+            if config["eval_subset_size"] > 0:
+                # evaluate on the same stratified subset every time, so evaluating doesn't get slower as the dataset grows
+                eval_subset = dataset.get_eval_subset(
+                    config["eval_subset_size"], config["eval_subset_seed"]
+                )
+                print(
+                    f"Evaluating on {len(eval_subset)} of the {len(dataset)} {dataset_type} {loader_type} points"
+                )
+                dataset = Subset(dataset, eval_subset)
+            # a subset is evaluated whole and in order, so every evaluation sees exactly the same points
+            use_subset = config["eval_subset_size"] > 0
             test_dataloaders[dataset_type][loader_type] = DataLoader(
-                test_dataloaders[dataset_type][loader_type],
+                dataset,
                 batch_size=config["eval_batch_size"],
-                shuffle=True,
+                shuffle=not use_subset,
                 num_workers=config["num_workers"],
-                drop_last=True,
+                drop_last=not use_subset,
             )
+            if config["batch_transform"]:
+                test_dataloaders[dataset_type][loader_type] = BatchTransformLoader(
+                    test_dataloaders[dataset_type][loader_type], batch_transform, device
+                )
 
     # Create the model
     if config["model_type"] == "gnm":
@@ -0,0 +1,137 @@
+import argparse
+import os
+import pickle
+
+import numpy as np
+from PIL import Image
+import tqdm
+
+
+def gen_image(rng: np.random.Generator, width: int, height: int) -> Image.Image:
+    # smooth color blobs plus some noise, so the jpgs are about as large and as slow to decode as camera frames
+    coarse = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    img = np.asarray(
+        Image.fromarray(coarse).resize((width, height), Image.BICUBIC), dtype=np.int16
+    )
+    img = img + rng.integers(-16, 17, img.shape, dtype=np.int16)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def gen_traj_data(rng: np.random.Generator, traj_len: int, spacing: float) -> dict:
+    # a smooth random walk with the same keys and dtypes as the processed datasets
+    yaw = np.cumsum(rng.normal(0, 0.05, traj_len))
+    steps = np.stack([np.cos(yaw), np.sin(yaw)], axis=1) * spacing
+    position = np.cumsum(steps, axis=0)
+    return {"position": position, "yaw": yaw}
+
+
+def main(args: argparse.Namespace):
+    rng = np.random.default_rng(args.seed)
+    width, height = args.image_size
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    traj_names = []
+    for i in tqdm.tqdm(range(args.num_trajs), desc="Trajectories generated"):
+        traj_name = f"synthetic_{i}"
+        traj_folder = os.path.join(args.output_dir, traj_name)
+        os.makedirs(traj_folder, exist_ok=True)
+        traj_len = int(rng.integers(args.min_traj_len, args.max_traj_len + 1))
+        with open(os.path.join(traj_folder, "traj_data.pkl"), "wb") as f:
+            pickle.dump(gen_traj_data(rng, traj_len, args.spacing), f)
+        for t in range(traj_len):
+            gen_image(rng, width, height).save(
+                os.path.join(traj_folder, f"{t}.jpg"), quality=args.jpeg_quality
+            )
+        traj_names.append(traj_name)
+
+    # same layout as data_split.py
+    split_index = int(args.split * len(traj_names))
+    splits_dir = args.splits_dir
+    if splits_dir is None:
+        splits_dir = os.path.join(args.output_dir, "data_splits")
+    for split_type, split_names in [
+        ("train", traj_names[:split_index]),
+        ("test", traj_names[split_index:]),
+    ]:
+        split_dir = os.path.join(splits_dir, split_type)
+        os.makedirs(split_dir, exist_ok=True)
+        with open(os.path.join(split_dir, "traj_names.txt"), "w") as f:
+            for traj_name in split_names:
+                f.write(traj_name + "\n")
+    print(f"Wrote {len(traj_names)} trajectories to {args.output_dir}")
+    print(f"Wrote the train and test splits to {splits_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic processed dataset to benchmark the data pipeline without the real datasets"
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        default="datasets/synthetic/",
+        type=str,
+        help="path for the synthetic dataset (default: datasets/synthetic/)",
+    )
+    parser.add_argument(
+        "--splits-dir",
+        "-s",
+        default=None,
+        type=str,
+        help="path for the train and test splits (default: {output-dir}/data_splits)",
+    )
+    parser.add_argument(
+        "--num-trajs",
+        "-n",
+        default=50,
+        type=int,
+        help="number of trajectories (default: 50)",
+    )
+    parser.add_argument(
+        "--min-traj-len",
+        default=80,
+        type=int,
+        help="minimum number of frames per trajectory (default: 80)",
+    )
+    parser.add_argument(
+        "--max-traj-len",
+        default=120,
+        type=int,
+        help="maximum number of frames per trajectory (default: 120)",
+    )
+    parser.add_argument(
+        "--image-size",
+        default=[160, 120],
+        nargs=2,
+        type=int,
+        help="width and height of the frames (default: 160 120, the size of the processed recon frames)",
+    )
+    parser.add_argument(
+        "--jpeg-quality",
+        default=95,
+        type=int,
+        help="jpeg quality of the frames (default: 95)",
+    )
+    parser.add_argument(
+        "--spacing",
+        default=0.25,
+        type=float,
+        help="distance between consecutive positions in meters (default: 0.25, recon's metric_waypoint_spacing)",
+    )
+    parser.add_argument(
+        "--split",
+        default=0.8,
+        type=float,
+        help="train/test split (default: 0.8)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="random seed (default: 0)",
+    )
+    args = parser.parse_args()
+    assert args.min_traj_len <= args.max_traj_len
+    print("STARTING GENERATING SYNTHETIC DATASET")
+    main(args)
+    print("FINISHED GENERATING SYNTHETIC DATASET")
@@ -0,0 +1,118 @@
+from typing import Iterator, Optional, Sequence
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def get_uint8_transform(image_size: Sequence[int]) -> transforms:
+    """
+    Per-sample transform of the datasets when the batch transform is used: resize the PIL image and
+    convert it to a uint8 tensor, leaving the float conversion and normalization to BatchTransform
+
+    Args:
+        image_size (Sequence[int]): output size [width, height]
+    """
+    return transforms.Compose(
+        [
+            transforms.Resize((image_size[1], image_size[0])),  # torch does (h, w)
+            transforms.PILToTensor(),
+        ]
+    )
+
+
+class BatchTransform:
+    def __init__(
+        self,
+        image_size: Sequence[int],
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+    ) -> None:
+        """
+        Vectorized version of Compose([ToTensor, Resize, Normalize]) for batches of uint8 images
+
+        Args:
+            image_size (Sequence[int]): output size [width, height]
+            mean (Sequence[float]): per channel mean to normalize with
+            std (Sequence[float]): per channel std to normalize with
+        """
+        self.image_size = (image_size[1], image_size[0])  # torch does (h, w)
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            images (torch.Tensor): uint8 tensor of shape [B, K * 3, H, W] (or [K * 3, H, W]) with K stacked RGB images
+        Returns:
+            torch.Tensor: float tensor of shape [B, K * 3, h, w] on the same device as images
+        """
+        unbatched = images.dim() == 3
+        if unbatched:
+            images = images.unsqueeze(0)
+        batch_size, channels, height, width = images.shape
+        num_channels = self.mean.shape[1]
+        # fold the stacked images into the batch dimension so every image is an RGB image
+        images = images.reshape(-1, num_channels, height, width).float().div_(255)
+        if (height, width) != self.image_size:
+            images = F.interpolate(
+                images,
+                size=self.image_size,
+                mode="bilinear",
+                align_corners=False,
+                antialias=True,
+            )
+        mean = self.mean.to(images.device)
+        std = self.std.to(images.device)
+        images = images.sub_(mean).div_(std)
+        images = images.reshape(batch_size, channels, *self.image_size)
+        if unbatched:
+            images = images.squeeze(0)
+        return images
+
+
+class BatchTransformLoader:
+    def __init__(
+        self,
+        loader: DataLoader,
+        batch_transform: BatchTransform,
+        device: Optional[torch.device] = None,
+    ) -> None:
+        """
+        Wraps a DataLoader whose datasets emit uint8 images (see get_uint8_transform). Every uint8 tensor of a
+        collated batch is moved to device and transformed there with batch_transform, so the workers only
+        resize and the float conversion and normalization run once per batch.
+
+        Args:
+            loader (DataLoader): loader to wrap
+            batch_transform (BatchTransform): transform to apply to the uint8 tensors of each batch
+            device (torch.device, optional): device to transform the images on (default: where they were collated)
+        """
+        self.loader = loader
+        self.batch_transform = batch_transform
+        self.device = device
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def _transform(self, x):
+        if isinstance(x, torch.Tensor) and x.dtype == torch.uint8:
+            if self.device is not None:
+                x = x.to(self.device, non_blocking=True)
+            return self.batch_transform(x)
+        return x
+
+    def __iter__(self) -> Iterator:
+        for batch in self.loader:
+            if isinstance(batch, (list, tuple)):
+                yield type(batch)(self._transform(x) for x in batch)
+            else:
+                yield self._transform(batch)
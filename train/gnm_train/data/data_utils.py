@@ -1,13 +1,18 @@
+import math
 import numpy as np
 import os
+import pickle
+from collections import OrderedDict
 from PIL import Image
-from typing import Any, Iterable
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
 
 import torch
 from torchvision import transforms
 import torchvision.transforms.functional as TF
 import torch.nn.functional as F
 
+from gnm_train.data.traj_store import TrajPoseStore
+
 VISUALIZATION_IMAGE_SIZE = (120, 160)
 IMAGE_ASPECT_RATIO = (
     4 / 3
@@ -18,6 +23,10 @@ def get_image_path(data_folder: str, f: str, time: int):
     return os.path.join(data_folder, f, f"{str(time)}.jpg")
 
 
+def get_traj_data_path(data_folder: str, f: str):
+    return os.path.join(data_folder, f, "traj_data.pkl")
+
+
 def yaw_rotmat(yaw: float) -> np.ndarray:
     return np.array(
         [
@@ -53,6 +62,204 @@ def to_local_coords(
     return (positions - curr_pos).dot(rotmat)
 
 
+def get_action_labels(
+    positions: np.ndarray,
+    yaws: np.ndarray,
+    curr_times: np.ndarray,
+    goal_times: np.ndarray,
+    len_traj_pred: int,
+    waypoint_spacing: int,
+    learn_angle: bool,
+    scale: float = 1.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the goal and waypoint labels of many (observation, goal) pairs of one trajectory at once,
+    the same way as GNM_Dataset did per sample with to_local_coords and calculate_sin_cos
+
+    Args:
+        positions (np.ndarray): positions of the trajectory [T, >=2]
+        yaws (np.ndarray): yaws of the trajectory [T]
+        curr_times (np.ndarray): times of the observations [N]
+        goal_times (np.ndarray): times of the goals, on the same trajectory [N]
+        len_traj_pred (int): number of waypoints
+        waypoint_spacing (int): spacing between waypoints
+        learn_angle (bool): whether to add the sin and cos of the waypoint yaws
+        scale (float): the x and y of the labels are divided by scale
+    Returns:
+        goals (np.ndarray): float32 goal positions in the frame of the observations [N, 2] or [N, 3] (if learning the angle)
+        waypoints (np.ndarray): float32 waypoints to the goals [N, len_traj_pred, 2] or [N, len_traj_pred, 4] (if learning the angle)
+    """
+    positions = np.asarray(positions)[:, :2]
+    yaws = np.asarray(yaws).reshape(len(positions))
+    curr_times = np.asarray(curr_times)
+    goal_times = np.asarray(goal_times)
+    # waypoints past the goal are padded with the goal
+    traj_lens = np.minimum(len_traj_pred, (goal_times - curr_times) // waypoint_spacing)
+    steps = np.arange(len_traj_pred + 1)
+    times = curr_times[:, None] + steps * waypoint_spacing
+    times = np.where(steps <= traj_lens[:, None], times, goal_times[:, None])
+
+    def to_local(times: np.ndarray) -> np.ndarray:
+        deltas = positions[times] - positions[curr_times].reshape(
+            (-1,) + (1,) * (times.ndim - 1) + (2,)
+        )
+        cos = np.cos(yaws[curr_times]).reshape((-1,) + (1,) * (times.ndim - 1))
+        sin = np.sin(yaws[curr_times]).reshape((-1,) + (1,) * (times.ndim - 1))
+        local = [
+            deltas[..., 0] * cos + deltas[..., 1] * sin,
+            deltas[..., 0] * -sin + deltas[..., 1] * cos,
+        ]
+        if learn_angle:
+            local.append(
+                yaws[times] - yaws[curr_times].reshape((-1,) + (1,) * (times.ndim - 1))
+            )
+        return np.stack(local, axis=-1).astype(np.float32)
+
+    waypoints = to_local(times[:, 1:])
+    goals = to_local(goal_times)
+    if learn_angle:  # localize the waypoint angles
+        angles = waypoints[:, :, 2]
+        angles[:, 1:] -= angles[:, :1]
+        waypoints = np.concatenate(
+            (waypoints[:, :, :2], np.cos(angles)[..., None], np.sin(angles)[..., None]),
+            axis=2,
+        )
+    waypoints[:, :, :2] /= scale
+    goals[:, :2] /= scale
+    return goals, waypoints
+
+
+def get_action_label_table(
+    traj_data_cache: "TrajDataCache",
+    traj_names: Sequence[str],
+    traj_ids: np.ndarray,
+    curr_times: np.ndarray,
+    goal_times: np.ndarray,
+    len_traj_pred: int,
+    waypoint_spacing: int,
+    learn_angle: bool,
+    scale: float = 1.0,
+) -> np.ndarray:
+    """
+    Compute the action labels of a whole index with get_action_labels, one trajectory at a time
+
+    Args:
+        traj_data_cache (TrajDataCache): trajectory metadata of the dataset
+        traj_names (Sequence[str]): name of each trajectory id
+        traj_ids (np.ndarray): trajectory id of the observation and the goal of each sample [N]
+        curr_times (np.ndarray): times of the observations [N]
+        goal_times (np.ndarray): times of the goals [N]
+        (see get_action_labels for the other arguments)
+    Returns:
+        np.ndarray: float32 table [N, goal_dim + len_traj_pred * waypoint_dim] with the goal and the flattened waypoints of each sample (see split_action_labels)
+    """
+    curr_times = np.asarray(curr_times, dtype=np.int64)
+    goal_times = np.asarray(goal_times, dtype=np.int64)
+    goal_dim = 3 if learn_angle else 2
+    waypoint_dim = 4 if learn_angle else 2
+    traj_ids = np.asarray(traj_ids)
+    table = np.zeros(
+        (len(traj_ids), goal_dim + len_traj_pred * waypoint_dim), dtype=np.float32
+    )
+    # group the samples by trajectory
+    order = np.argsort(traj_ids, kind="stable")
+    unique_ids, starts = np.unique(traj_ids[order], return_index=True)
+    for traj_id, traj_rows in zip(unique_ids, np.split(order, starts[1:])):
+        traj_name = traj_names[traj_id]
+        traj_data = traj_data_cache.get(traj_name)
+        assert np.all(
+            curr_times[traj_rows] <= goal_times[traj_rows]
+        ), f"goals before their observation in {traj_name}"
+        assert np.all(
+            goal_times[traj_rows] < len(traj_data["position"])
+        ), f"goals past the end of {traj_name}"
+        goals, waypoints = get_action_labels(
+            traj_data["position"],
+            traj_data["yaw"],
+            curr_times[traj_rows],
+            goal_times[traj_rows],
+            len_traj_pred,
+            waypoint_spacing,
+            learn_angle,
+            scale,
+        )
+        table[traj_rows, :goal_dim] = goals
+        table[traj_rows, goal_dim:] = waypoints.reshape(len(traj_rows), -1)
+    return table
+
+
+def get_dist_labels(
+    curr_trajs: np.ndarray,
+    goal_trajs: np.ndarray,
+    curr_times: np.ndarray,
+    goal_times: np.ndarray,
+    waypoint_spacing: int,
+    max_dist_cat: int,
+) -> np.ndarray:
+    """
+    Compute the distance labels of a whole index: the number of waypoints to the goal, or max_dist_cat for
+    goals on another trajectory (negative mining)
+
+    Args:
+        curr_trajs (np.ndarray): trajectory (id or name) of the observation of each sample [N]
+        goal_trajs (np.ndarray): trajectory (id or name) of the goal of each sample [N]
+    Returns:
+        np.ndarray: float32 distance labels [N]
+    """
+    same_traj = np.asarray(curr_trajs) == np.asarray(goal_trajs)
+    dists = (np.asarray(goal_times) - np.asarray(curr_times)) / waypoint_spacing
+    return np.where(same_traj, dists, max_dist_cat).astype(np.float32)
+
+
+def split_action_labels(
+    labels: np.ndarray, len_traj_pred: int, learn_angle: bool
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Args:
+        labels (np.ndarray): row of a table from get_action_label_table
+    Returns:
+        goal (torch.Tensor): position of the goal in the frame of the observation
+        waypoints (torch.Tensor): tensor of shape (len_traj_pred, 2) or (len_traj_pred, 4) (if learning the angle) with the waypoints to the goal
+    """
+    goal_dim = 3 if learn_angle else 2
+    labels = torch.from_numpy(np.array(labels, dtype=np.float32))
+    return labels[:goal_dim], labels[goal_dim:].reshape(len_traj_pred, -1)
+
+
+def get_label_table_path(index_to_data_path: str, normalize: bool) -> str:
+    # in the folder of the index (see get_index_to_data_path in index_sampling.py)
+    return os.path.join(
+        os.path.dirname(index_to_data_path), f"labels_normalize_{normalize}.npy"
+    )
+
+
+def load_label_table(
+    label_table_path: str,
+    index_to_data_path: str,
+    gen_label_table: Callable[[], np.ndarray],
+) -> np.ndarray:
+    """
+    Load the label table of a dataset index, generating it with gen_label_table if it doesn't exist
+    or is older than the index. The table is memory mapped, so the DataLoader workers share it.
+
+    Args:
+        label_table_path (str): path of the label table (see get_label_table_path)
+        index_to_data_path (str): path of the index the labels are computed from
+        gen_label_table (Callable[[], np.ndarray]): computes the label table of the index
+    Returns:
+        np.ndarray: read-only label table
+    """
+    if not os.path.exists(label_table_path) or os.path.getmtime(
+        label_table_path
+    ) < os.path.getmtime(index_to_data_path):
+        label_table = gen_label_table()
+        os.makedirs(os.path.dirname(label_table_path), exist_ok=True)
+        with open(label_table_path + ".tmp", "wb") as f:
+            np.save(f, label_table)
+        os.replace(label_table_path + ".tmp", label_table_path)
+    return np.load(label_table_path, mmap_mode="r")
+
+
 def calculate_deltas(waypoints: torch.Tensor) -> torch.Tensor:
     """
     Calculate deltas between waypoints
@@ -87,23 +294,80 @@ def calculate_sin_cos(waypoints: torch.Tensor) -> torch.Tensor:
     return torch.concat((waypoints[:, :2], angle_repr), axis=1)
 
 
-def img_path_to_data(path: str, transform: transforms, aspect_ratio: float = IMAGE_ASPECT_RATIO) -> torch.Tensor:
+def get_draft_size(
+    img_size: Sequence[int],
+    aspect_ratio: float,
+    output_sizes: Iterable[Sequence[int]],
+) -> Tuple[int, int]:
+    """
+    Smallest size a full image can be decoded at so that its center crop still covers every output size
+    Args:
+        img_size (Sequence[int]): size of the full image [width, height]
+        aspect_ratio (float): aspect ratio the image is cropped to
+        output_sizes (Iterable[Sequence[int]]): sizes the crop is resized to [height, width]
+    Returns:
+        Tuple[int, int]: requested decode size [width, height]
+    """
+    w, h = img_size
+    crop_w = min(w, int(h * aspect_ratio))
+    scale = max(max(out_h / h, out_w / crop_w) for out_h, out_w in output_sizes)
+    return math.ceil(w * scale), math.ceil(h * scale)
+
+
+def img_path_to_data(
+    path: str,
+    transform: transforms,
+    aspect_ratio: float = IMAGE_ASPECT_RATIO,
+    load_viz: bool = True,
+    draft_size: Optional[Sequence[int]] = None,
+) -> torch.Tensor:
     """
     Load an image from a path and transform it
     Args:
         path (str): path to the image
         transform (transforms): transform to apply to the image
         aspect_ratio (float): aspect ratio to crop the image to
+        load_viz (bool): whether to also return the visualization image (None otherwise)
+        draft_size (Sequence[int], optional): output size of transform [height, width]. If given, jpgs are decoded at the smallest 1/2, 1/4 or 1/8 scale that still covers it (and the visualization image size if load_viz).
     Returns:
         torch.Tensor: transformed image
     """
     img = Image.open(path)
+    if draft_size is not None:
+        output_sizes = [draft_size]
+        if load_viz:
+            output_sizes.append(VISUALIZATION_IMAGE_SIZE)
+        # the jpg decoder scales the image down while decoding, draft is a no-op for other formats
+        img.draft("RGB", get_draft_size(img.size, aspect_ratio, output_sizes))
     w, h = img.size
     img = TF.center_crop(
         img, (h, int(h * aspect_ratio))
     )  # crop to the right ratio
-    viz_img = TF.resize(img, VISUALIZATION_IMAGE_SIZE)
-    viz_img = TF.to_tensor(viz_img)
+    viz_img = None
+    if load_viz:
+        viz_img = TF.resize(img, VISUALIZATION_IMAGE_SIZE)
+        viz_img = TF.to_tensor(viz_img)
+    transf_img = transform(img)
+    return viz_img, transf_img
+
+
+def packed_frame_to_data(
+    frame: np.ndarray, transform: transforms, load_viz: bool = True
+) -> torch.Tensor:
+    """
+    Transform a frame that was already cropped and resized by the image packer (see image_shards.py)
+    Args:
+        frame (np.ndarray): uint8 array of shape [H, W, 3]
+        transform (transforms): transform to apply to the image
+        load_viz (bool): whether to also return the visualization image (None otherwise)
+    Returns:
+        torch.Tensor: transformed image
+    """
+    img = Image.fromarray(frame)
+    viz_img = None
+    if load_viz:
+        viz_img = TF.resize(img, VISUALIZATION_IMAGE_SIZE)
+        viz_img = TF.to_tensor(viz_img)
     transf_img = transform(img)
     return viz_img, transf_img
 
@@ -116,32 +380,122 @@ class RandomizedClassBalancer:
         Args:
             classes (Iterable): The classes to balance
         """
-        self.counts = {}
-        for c in classes:
-            self.counts[c] = 0
+        self.classes = list(classes)
+        self.counts = np.zeros(len(self.classes), dtype=np.int64)
 
-    def sample(self, class_filter_func=None) -> Any:
+    def sample_indices(
+        self, valid: np.ndarray, rng: Optional[np.random.RandomState] = None
+    ) -> np.ndarray:
+        """
+        Sample a class for each row of valid in one call, with the same result distribution as calling sample
+        once per row in order: each class is drawn with the softmax of the negative number of times it was
+        sampled, among the valid classes of the row
+
+        Args:
+            valid (np.ndarray): bool array of shape [N, len(classes)], whether each sample can take each class
+            rng (np.random.RandomState, optional): Random state to sample with. Defaults to the global numpy random state.
+        Returns:
+            np.ndarray: int64 array of shape [N] with the index in classes of the class sampled for each row (-1 if the row has no valid class)
+        """
+        if rng is None:
+            rng = np.random
+        valid = np.asarray(valid, dtype=bool)
+        choices = np.full(len(valid), -1, dtype=np.int64)
+        uniforms = rng.random_sample(len(valid))
+        for i in np.flatnonzero(valid.any(axis=1)):
+            valid_classes = np.flatnonzero(valid[i])
+            counts = self.counts[valid_classes]
+            # relative to the least sampled valid class, so its weight is 1 however far ahead the others are
+            cdf = np.cumsum(np.exp(counts.min() - counts.astype(np.float64)))
+            j = int(np.searchsorted(cdf, uniforms[i] * cdf[-1], side="right"))
+            k = valid_classes[min(j, len(valid_classes) - 1)]
+            choices[i] = k
+            self.counts[k] += 1
+        return choices
+
+    def sample(
+        self, class_filter_func=None, rng: Optional[np.random.RandomState] = None
+    ) -> Any:
         """
         Sample the softmax of the negative logits to prioritize classes that have been sampled less
 
         Args:
             class_filter_func (Callable, optional): A function that takes in a class and returns a boolean. Defaults to None.
+            rng (np.random.RandomState, optional): Random state to sample with. Defaults to the global numpy random state.
         """
         if class_filter_func is None:
-            keys = list(self.counts.keys())
+            valid = np.ones(len(self.classes), dtype=bool)
         else:
-            keys = [k for k in self.counts.keys() if class_filter_func(k)]
-        if len(keys) == 0:
+            valid = np.array([bool(class_filter_func(c)) for c in self.classes])
+        class_index = self.sample_indices(valid[None], rng)[0]
+        if class_index < 0:
             return None  # no valid classes to sample
-        values = [-(self.counts[k] - min(self.counts.values())) for k in keys]
-        p = F.softmax(torch.Tensor(values), dim=0).detach().cpu().numpy()
-        class_index = np.random.choice(list(range(len(keys))), p=p)
-        class_choice = keys[class_index]
-        self.counts[class_choice] += 1
-        return class_choice
+        return self.classes[class_index]
 
     def __str__(self) -> str:
         string = ""
-        for c in self.counts:
-            string += f"{c}: {self.counts[c]}\n"
+        for c, count in zip(self.classes, self.counts):
+            string += f"{c}: {count}\n"
         return string
+
+
+class TrajDataCache:
+    def __init__(self, data_folder: str, max_size: int = 64) -> None:
+        """
+        A bounded LRU cache of trajectory metadata (the contents of traj_data.pkl) keyed by trajectory name.
+        The cache lives on the dataset object, so every DataLoader worker ends up with its own copy.
+        If the data folder has a consolidated pose store (see traj_store.py), trajectories in the store are
+        read from it directly and only the others go through the cache.
+        Cached arrays are shared between callers and must not be modified in place.
+
+        Args:
+            data_folder (str): Directory with all the trajectory folders
+            max_size (int): Maximum number of trajectories to keep in memory (0 disables caching)
+        """
+        self.data_folder = data_folder
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.traj_store = (
+            TrajPoseStore(data_folder) if TrajPoseStore.exists(data_folder) else None
+        )
+
+    def get(self, traj_name: str) -> Dict[str, np.ndarray]:
+        """
+        Get the trajectory metadata for traj_name, loading it from disk on a cache miss
+
+        Args:
+            traj_name (str): Name of the trajectory folder
+        Returns:
+            Dict[str, np.ndarray]: dictionary with the "position" and "yaw" of the trajectory
+        """
+        if self.traj_store is not None and traj_name in self.traj_store:
+            return self.traj_store.get(traj_name)
+        if traj_name in self.cache:
+            self.cache.move_to_end(traj_name)
+            self.hits += 1
+            return self.cache[traj_name]
+        self.misses += 1
+        with open(get_traj_data_path(self.data_folder, traj_name), "rb") as f:
+            traj_data = pickle.load(f)
+        if self.max_size > 0:
+            self.cache[traj_name] = traj_data
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)  # evict the least recently used trajectory
+        return traj_data
+
+    def get_traj_len(self, traj_name: str) -> int:
+        if self.traj_store is not None and traj_name in self.traj_store:
+            return self.traj_store.get_traj_len(traj_name)
+        return len(self.get(traj_name)["position"])
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def __str__(self) -> str:
+        return f"TrajDataCache(size={len(self)}/{self.max_size}, hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate():.3f})"
@@ -0,0 +1,114 @@
+import multiprocessing
+from typing import Optional, Sequence, Tuple
+
+import torch
+
+NUM_LOCK_STRIPES = 64
+
+
+class SharedFrameCache:
+    def __init__(
+        self,
+        max_bytes: int,
+        transf_shape: Sequence[int],
+        transf_dtype: torch.dtype,
+        viz_shape: Optional[Sequence[int]] = None,
+    ) -> None:
+        """
+        A fixed-budget cache of decoded frames keyed by (trajectory index, time) that lives in shared memory.
+        It has to be created in the main process before the DataLoader workers start, so every worker sees
+        the same slots: a frame decoded by one worker is a hit for all the others.
+
+        The cache is direct-mapped: each key has exactly one slot and a new frame evicts whatever was in it.
+        Writers take a striped lock and bump the sequence number of the slot before and after writing it (a seqlock).
+        Readers are lock-free: they miss if the sequence number is odd (a write is in progress) or changed while
+        they were copying the slot, so a frame that was overwritten and written back meanwhile is not returned torn.
+        The hit/miss counters are shared but not atomic, so they are approximate.
+
+        The memory budget is for this cache alone: every dataset with a frame cache allocates its own.
+
+        Args:
+            max_bytes (int): Memory budget of the cache in bytes
+            transf_shape (Sequence[int]): Shape of a transformed frame
+            transf_dtype (torch.dtype): dtype of a transformed frame
+            viz_shape (Sequence[int], optional): Shape of a visualization frame. Visualization frames are not cached if None.
+        """
+        transf_bytes = torch.Size(transf_shape).numel() * torch.empty(
+            0, dtype=transf_dtype
+        ).element_size()
+        viz_bytes = torch.Size(viz_shape).numel() * 4 if viz_shape is not None else 0
+        self.num_slots = max(int(max_bytes) // (transf_bytes + viz_bytes), 1)
+        self.transf_images = torch.zeros(
+            (self.num_slots, *transf_shape), dtype=transf_dtype
+        ).share_memory_()
+        self.viz_images = None
+        if viz_shape is not None:
+            self.viz_images = torch.zeros(
+                (self.num_slots, *viz_shape), dtype=torch.float32
+            ).share_memory_()
+        self.keys = torch.full((self.num_slots,), -1, dtype=torch.int64).share_memory_()
+        self.seqs = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_()
+        self.stats = torch.zeros(2, dtype=torch.int64).share_memory_()  # hits, misses
+        self.locks = [multiprocessing.Lock() for _ in range(NUM_LOCK_STRIPES)]
+
+    def _slot(self, traj_index: int, time: int) -> Tuple[int, int]:
+        key = (traj_index << 32) | time
+        # consecutive times of a trajectory map to consecutive slots so a context window never collides with itself
+        slot = (traj_index * 2654435761 + time) % self.num_slots
+        return key, slot
+
+    def get(
+        self, traj_index: int, time: int
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Args:
+            traj_index (int): index of the trajectory in the dataset's traj_names
+            time (int): time of the frame in the trajectory
+        Returns:
+            Optional[Tuple[torch.Tensor, torch.Tensor]]: (visualization image or None, transformed image) or None on a miss
+        """
+        key, slot = self._slot(traj_index, time)
+        seq = self.seqs[slot].item()
+        if seq % 2 == 0 and self.keys[slot].item() == key:
+            viz_img = None
+            if self.viz_images is not None:
+                viz_img = self.viz_images[slot].clone()
+            transf_img = self.transf_images[slot].clone()
+            if self.seqs[slot].item() == seq:  # the slot was not written while copying
+                self.stats[0] += 1
+                return viz_img, transf_img
+        self.stats[1] += 1
+        return None
+
+    def put(
+        self, traj_index: int, time: int, viz_img: torch.Tensor, transf_img: torch.Tensor
+    ) -> None:
+        key, slot = self._slot(traj_index, time)
+        with self.locks[slot % NUM_LOCK_STRIPES]:
+            self.seqs[slot] += 1  # odd while the slot is being written
+            self.keys[slot] = key
+            if self.viz_images is not None:
+                self.viz_images[slot].copy_(viz_img)
+            self.transf_images[slot].copy_(transf_img)
+            self.seqs[slot] += 1
+
+    @property
+    def hits(self) -> int:
+        return self.stats[0].item()
+
+    @property
+    def misses(self) -> int:
+        return self.stats[1].item()
+
+    def reset_stats(self) -> None:
+        self.stats.zero_()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __str__(self) -> str:
+        num_bytes = self.transf_images.numel() * self.transf_images.element_size()
+        if self.viz_images is not None:
+            num_bytes += self.viz_images.numel() * self.viz_images.element_size()
+        return f"SharedFrameCache(slots={self.num_slots}, size={num_bytes / 2**20:.1f}MB, hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate():.3f})"
@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from PIL import Image
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch.utils.data import Dataset, Subset
+from torchvision import transforms
+
+from gnm_train.data.data_utils import (
+    VISUALIZATION_IMAGE_SIZE,
+    img_path_to_data,
+    packed_frame_to_data,
+    get_image_path,
+)
+from gnm_train.data.frame_cache import SharedFrameCache
+from gnm_train.data.image_shards import PackedImages
+
+
+class FrameLoader:
+    def __init__(
+        self,
+        data_folder: str,
+        transform: transforms,
+        aspect_ratio: float,
+        packed_image_folder: Optional[str] = None,
+        traj_names: Optional[List[str]] = None,
+        frame_cache_bytes: int = 0,
+        load_viz: bool = True,
+        decode_threads: int = 0,
+        jpeg_draft: bool = False,
+    ) -> None:
+        """
+        Loads the (visualization image, transformed image) pairs for the frames of a sample
+
+        Args:
+            data_folder (str): Directory with all the image data
+            transform (transforms): Transforms to apply to the image data
+            aspect_ratio (float): Aspect ratio of the images (w/h)
+            packed_image_folder (str, optional): Directory with frames packed by pack_images.py. Frames of trajectories that are not packed are decoded from their jpg.
+            traj_names (List[str], optional): Names of the trajectories of the dataset, used to key the frame cache
+            frame_cache_bytes (int): Memory budget of the frame cache of this loader, shared by all the DataLoader workers (0 disables it)
+            load_viz (bool): Whether to load the visualization images. If False, load returns None in their place and they can be loaded on demand with load_viz_images.
+            decode_threads (int): Number of threads each DataLoader worker uses to decode the jpgs of a sample concurrently (0 decodes them one after another)
+            jpeg_draft (bool): Whether to decode the jpgs at a reduced scale that still covers the output size of transform (see img_path_to_data)
+        """
+        self.data_folder = data_folder
+        self.transform = transform
+        self.aspect_ratio = aspect_ratio
+        self.load_viz = load_viz
+        self.decode_threads = decode_threads
+        self._decode_pool = None
+        self._decode_pool_pid = None
+        self.draft_size = None
+        if jpeg_draft:
+            self.draft_size = self._probe_transform().shape[-2:]
+        self.traj_names = traj_names
+        self.traj_indices = {}
+        if traj_names is not None:
+            self.traj_indices = {f: j for j, f in enumerate(traj_names)}
+        self.packed_images = None
+        if packed_image_folder is not None:
+            self.packed_images = PackedImages(
+                packed_image_folder, data_folder=data_folder
+            )
+            assert (
+                abs(self.packed_images.aspect_ratio - aspect_ratio) < 1e-6
+            ), f"{packed_image_folder} was packed with aspect ratio {self.packed_images.aspect_ratio}, not {aspect_ratio}"
+        self.frame_cache = None
+        if frame_cache_bytes > 0:
+            assert traj_names is not None, "traj_names are needed to key the frame cache"
+            # the transform must output a fixed size, probe it to size the cache slots
+            transf_probe = self._probe_transform()
+            self.frame_cache = SharedFrameCache(
+                frame_cache_bytes,
+                transf_probe.shape,
+                transf_probe.dtype,
+                (3, *VISUALIZATION_IMAGE_SIZE) if load_viz else None,
+            )
+
+    def load(
+        self, frames: List[Tuple[str, int]]
+    ) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Args:
+            frames (List[Tuple[str, int]]): list of (trajectory name, time) of the frames to load
+        Returns:
+            List[Tuple[torch.Tensor, torch.Tensor]]: (visualization image, transformed image) for each frame. The visualization image is None if load_viz is False.
+        """
+        # overlapping windows (e.g. the obs and next obs contexts) repeat frames, decode each of them once
+        unique_frames = list(dict.fromkeys(frames))
+        if len(unique_frames) < len(frames):
+            unique_data = dict(zip(unique_frames, self.load(unique_frames)))
+            return [unique_data[frame] for frame in frames]
+        data = [None] * len(frames)
+        # group the packed frames by trajectory so each context window is sliced out at once
+        packed_frames = {}
+        jpg_frames = []
+        for j, (f, t) in enumerate(frames):
+            cache_key = self._cache_key(f, t)
+            if cache_key is not None:
+                data[j] = self.frame_cache.get(*cache_key)
+                if data[j] is not None:
+                    continue
+            if self.packed_images is not None and f in self.packed_images:
+                packed_frames.setdefault(f, []).append(j)
+            else:
+                jpg_frames.append(j)
+        if self.decode_threads > 0 and len(jpg_frames) > 1:
+            # PIL releases the GIL while decoding, so the jpgs of a sample decode in parallel
+            jpg_data = self._get_decode_pool().map(
+                lambda j: self._decode_jpg(*frames[j]), jpg_frames
+            )
+        else:
+            jpg_data = [self._decode_jpg(*frames[j]) for j in jpg_frames]
+        for j, frame_data in zip(jpg_frames, jpg_data):
+            data[j] = frame_data
+            self._cache_put(*frames[j], frame_data)
+        for f, js in packed_frames.items():
+            traj_frames = self.packed_images.get_frames(f, [frames[j][1] for j in js])
+            for j, frame in zip(js, traj_frames):
+                data[j] = packed_frame_to_data(frame, self.transform, self.load_viz)
+                self._cache_put(f, frames[j][1], data[j])
+        return data
+
+    def _probe_transform(self) -> torch.Tensor:
+        return self.transform(Image.new("RGB", (160, 120)))
+
+    def _decode_jpg(self, f: str, t: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        return img_path_to_data(
+            get_image_path(self.data_folder, f, t),
+            self.transform,
+            self.aspect_ratio,
+            self.load_viz,
+            self.draft_size,
+        )
+
+    def _get_decode_pool(self) -> ThreadPoolExecutor:
+        # threads don't survive the fork of the DataLoader workers, so every process creates its own pool
+        if self._decode_pool is None or self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPoolExecutor(max_workers=self.decode_threads)
+            self._decode_pool_pid = os.getpid()
+        return self._decode_pool
+
+    def __getstate__(self) -> dict:
+        # the pool can't be pickled (e.g. with the spawn start method), the workers create their own
+        state = self.__dict__.copy()
+        state["_decode_pool"] = None
+        state["_decode_pool_pid"] = None
+        return state
+
+    def load_viz_images(self, frames: List[Tuple[str, int]]) -> torch.Tensor:
+        """
+        Decode the visualization images of frames, bypassing the frame cache. Used to log images
+        when the dataset was built without them.
+
+        Args:
+            frames (List[Tuple[str, int]]): list of (trajectory name, time) of the frames to load
+        Returns:
+            torch.Tensor: visualization images of shape [len(frames), 3, H, W]
+        """
+        viz_imgs = []
+        for f, t in frames:
+            if self.packed_images is not None and f in self.packed_images:
+                frame = self.packed_images.get_frames(f, [t])[0]
+                viz_img, _ = packed_frame_to_data(frame, self.transform)
+            else:
+                viz_img, _ = img_path_to_data(
+                    get_image_path(self.data_folder, f, t),
+                    self.transform,
+                    self.aspect_ratio,
+                )
+            viz_imgs.append(viz_img)
+        return torch.stack(viz_imgs)
+
+    def _cache_key(self, f: str, t: int) -> Optional[Tuple[int, int]]:
+        if self.frame_cache is None or f not in self.traj_indices:
+            return None
+        return self.traj_indices[f], t
+
+    def _cache_put(self, f: str, t: int, frame_data: Tuple[torch.Tensor, torch.Tensor]) -> None:
+        cache_key = self._cache_key(f, t)
+        if cache_key is not None:
+            self.frame_cache.put(*cache_key, *frame_data)
+
+
+def load_viz_images(
+    dataset: Dataset, viz_images: torch.Tensor, num_images: int
+) -> torch.Tensor:
+    """
+    Get the first num_images visualization images of a batch. Datasets built with viz_images=False
+    return [dataset_index, traj_index, time] frame keys instead of images, in which case the images
+    are decoded here, so only the logged samples pay for them.
+
+    Args:
+        dataset (Dataset): dataset of the loader the batch came from (a ConcatDataset, a ShardedDataset, a Subset or a single dataset)
+        viz_images (torch.Tensor): visualization images [B, 3, H, W] or frame keys [B, 3]
+        num_images (int): number of images to get
+    Returns:
+        torch.Tensor: visualization images of shape [min(B, num_images), 3, H, W]
+    """
+    viz_images = viz_images[:num_images]
+    if viz_images.dim() != 2:
+        return viz_images
+    if isinstance(dataset, Subset):
+        dataset = dataset.dataset  # evaluation subsets (see get_eval_subset)
+    datasets = dataset.datasets if hasattr(dataset, "datasets") else [dataset]
+    datasets = {d.dataset_index: d for d in datasets}
+    imgs = []
+    for dataset_index, traj_index, t in viz_images.tolist():
+        d = datasets[dataset_index]
+        imgs.append(d.frame_loader.load_viz_images([(d.traj_names[traj_index], t)])[0])
+    return torch.stack(imgs)
+
+
+def get_frame_caches(dataset: Dataset) -> Dict[str, SharedFrameCache]:
+    """
+    Get the frame caches of the datasets of a loader, keyed by dataset name
+
+    Args:
+        dataset (Dataset): dataset of a loader (a ConcatDataset, a ShardedDataset, a Subset or a single dataset)
+    Returns:
+        Dict[str, SharedFrameCache]: frame cache of each dataset that has one
+    """
+    if isinstance(dataset, Subset):
+        dataset = dataset.dataset
+    datasets = dataset.datasets if hasattr(dataset, "datasets") else [dataset]
+    return {
+        d.dataset_name: d.frame_loader.frame_cache
+        for d in datasets
+        if d.frame_loader.frame_cache is not None
+    }
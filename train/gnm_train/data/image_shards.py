@@ -0,0 +1,229 @@
+import numpy as np
+import os
+import pickle
+from collections import OrderedDict
+from PIL import Image
+from typing import List, Optional, Sequence, Tuple
+import tqdm
+
+import torchvision.transforms.functional as TF
+
+from gnm_train.data.data_utils import get_image_path
+
+PACKED_INDEX_FILE = "frame_index.pkl"
+
+
+def get_packed_image_folder(data_folder: str, image_size: Sequence[int]) -> str:
+    return os.path.join(data_folder, f"packed_{image_size[0]}x{image_size[1]}")
+
+
+def get_jpg_stats(data_folder: str, traj_name: str) -> Tuple[int, int, int]:
+    """
+    Summarize the jpgs of a trajectory to tell whether they changed since they were packed
+
+    Args:
+        data_folder (str): Directory with all the trajectory folders
+        traj_name (str): Name of the trajectory
+    Returns:
+        Tuple[int, int, int]: number of frames, latest modification time and total size of the jpgs
+    """
+    num_frames, mtime_ns, size = 0, 0, 0
+    while True:
+        try:
+            stat = os.stat(get_image_path(data_folder, traj_name, num_frames))
+        except FileNotFoundError:
+            return num_frames, mtime_ns, size
+        num_frames += 1
+        mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+        size += stat.st_size
+
+
+def crop_and_resize(
+    img: Image.Image, image_size: Sequence[int], aspect_ratio: float
+) -> Image.Image:
+    """
+    Center crop a PIL image to aspect_ratio and resize it to image_size, the same way img_path_to_data crops frames
+
+    Args:
+        img (Image.Image): image to crop and resize
+        image_size (Sequence[int]): output size [width, height]
+        aspect_ratio (float): aspect ratio to crop the image to (w/h)
+    Returns:
+        Image.Image: cropped and resized image
+    """
+    w, h = img.size
+    img = TF.center_crop(img, (h, int(h * aspect_ratio)))
+    return img.resize(tuple(image_size), Image.BILINEAR)
+
+
+def pack_images(
+    data_folder: str,
+    output_folder: str,
+    image_size: Sequence[int],
+    aspect_ratio: float,
+    traj_names: Optional[List[str]] = None,
+) -> int:
+    """
+    Write the frames of every trajectory, already cropped and resized to image_size, into one uint8
+    array of shape [T, H, W, 3] per trajectory (output_folder/{traj_name}.npy) and a frame index with
+    the number of frames of each trajectory. Trajectories that were already packed are skipped unless
+    their jpgs changed since, so an interrupted run can be restarted and a dataset that was processed
+    again can be repacked in place.
+
+    Args:
+        data_folder (str): Directory with all the trajectory folders
+        output_folder (str): Directory to write the packed arrays to
+        image_size (Sequence[int]): output size of the frames [width, height]
+        aspect_ratio (float): aspect ratio to crop the frames to (w/h)
+        traj_names (List[str], optional): Trajectories to pack. Defaults to every folder with a traj_data.pkl.
+    Returns:
+        int: number of packed trajectories
+    """
+    if traj_names is None:
+        traj_names = sorted(
+            f
+            for f in os.listdir(data_folder)
+            if os.path.isfile(os.path.join(data_folder, f, "traj_data.pkl"))
+        )
+    os.makedirs(output_folder, exist_ok=True)
+    index_path = os.path.join(output_folder, PACKED_INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            frame_index = pickle.load(f)
+        assert tuple(frame_index["image_size"]) == tuple(
+            image_size
+        ), f"{output_folder} was packed with image size {frame_index['image_size']}"
+    else:
+        frame_index = {
+            "image_size": tuple(image_size),
+            "aspect_ratio": aspect_ratio,
+            "num_frames": {},
+        }
+    # frame indices written before the jpg stats were recorded trust every array that is already packed
+    jpg_stats = frame_index.setdefault("jpg_stats", {})
+
+    for traj_name in tqdm.tqdm(traj_names, desc="Trajectories packed"):
+        traj_path = os.path.join(output_folder, f"{traj_name}.npy")
+        # stat before reading, jpgs rewritten in between then read as changed
+        traj_jpg_stats = get_jpg_stats(data_folder, traj_name)
+        if (
+            os.path.exists(traj_path)
+            and jpg_stats.get(traj_name, traj_jpg_stats) == traj_jpg_stats
+        ):
+            # the arrays are written atomically, one that exists is complete even if the run was interrupted
+            # before the frame index was saved, its number of frames is in the header
+            packed = np.load(traj_path, mmap_mode="r")
+            packed_shape = packed.shape
+            packed._mmap.close()
+            if (
+                packed_shape[1:3] == (image_size[1], image_size[0])
+                and packed_shape[0] == traj_jpg_stats[0]
+            ):
+                frame_index["num_frames"][traj_name] = packed_shape[0]
+                jpg_stats[traj_name] = traj_jpg_stats
+                continue
+        frames = []
+        while os.path.exists(os.path.join(data_folder, traj_name, f"{len(frames)}.jpg")):
+            img = Image.open(os.path.join(data_folder, traj_name, f"{len(frames)}.jpg"))
+            img = crop_and_resize(img.convert("RGB"), image_size, aspect_ratio)
+            frames.append(np.asarray(img, dtype=np.uint8))
+        if len(frames) == 0:
+            print(f"{traj_name} has no frames. Skipping...")
+            frame_index["num_frames"].pop(traj_name, None)
+            jpg_stats.pop(traj_name, None)
+            continue
+        with open(traj_path + ".tmp", "wb") as f:
+            np.save(f, np.stack(frames, axis=0))
+        os.replace(traj_path + ".tmp", traj_path)
+        frame_index["num_frames"][traj_name] = len(frames)
+        jpg_stats[traj_name] = traj_jpg_stats
+
+    with open(index_path + ".tmp", "wb") as f:
+        pickle.dump(frame_index, f)
+    os.replace(index_path + ".tmp", index_path)
+    return len(frame_index["num_frames"])
+
+
+class PackedImages:
+    def __init__(
+        self,
+        packed_image_folder: str,
+        max_open_arrays: int = 64,
+        data_folder: Optional[str] = None,
+    ) -> None:
+        """
+        Reader for the per-trajectory uint8 frame arrays written by pack_images. The arrays are opened with
+        np.memmap on first use, so context windows are sliced out of the page cache instead of being decoded.
+        Every open array holds a file descriptor, so only the max_open_arrays most recently used ones are kept open.
+        Given the data_folder the arrays were packed from, a trajectory whose jpgs changed since it was packed
+        is reported as not packed, so its frames are decoded from the jpgs until it is packed again.
+
+        Args:
+            packed_image_folder (str): Directory with the packed arrays and the frame index
+            max_open_arrays (int): Maximum number of arrays to keep open
+            data_folder (str, optional): Directory with the trajectory folders to check the packed arrays against. Defaults to no check.
+        """
+        self.packed_image_folder = packed_image_folder
+        self.max_open_arrays = max(max_open_arrays, 1)
+        with open(os.path.join(packed_image_folder, PACKED_INDEX_FILE), "rb") as f:
+            frame_index = pickle.load(f)
+        self.image_size = tuple(frame_index["image_size"])
+        self.aspect_ratio = frame_index["aspect_ratio"]
+        self.num_frames = frame_index["num_frames"]
+        self.jpg_stats = frame_index.get("jpg_stats", {})
+        self.data_folder = data_folder
+        if data_folder is not None and "jpg_stats" not in frame_index:
+            # packed before the jpg stats were recorded, none of it can be checked
+            self.num_frames = {}
+            print(
+                f"{packed_image_folder} was packed by an older version, rerun pack_images.py to use it"
+            )
+        # whether the jpgs of each trajectory checked so far still match its packed array, checked on first
+        # use because it stats every jpg of the trajectory
+        self.up_to_date = {}
+        self.arrays = OrderedDict()
+
+    def __contains__(self, traj_name: str) -> bool:
+        if traj_name not in self.num_frames:
+            return False
+        if self.data_folder is None:
+            return True
+        if traj_name not in self.up_to_date:
+            self.up_to_date[traj_name] = (
+                get_jpg_stats(self.data_folder, traj_name)
+                == self.jpg_stats.get(traj_name)
+            )
+            if not self.up_to_date[traj_name]:
+                print(
+                    f"The jpgs of {traj_name} changed since it was packed in {self.packed_image_folder}, "
+                    "decoding them instead. Rerun pack_images.py to update it"
+                )
+        return self.up_to_date[traj_name]
+
+    def _get_array(self, traj_name: str) -> np.ndarray:
+        # the returned array is closed once it is evicted, only get_frames uses it and it copies the frames out
+        if traj_name in self.arrays:
+            self.arrays.move_to_end(traj_name)
+            return self.arrays[traj_name]
+        array = np.load(
+            os.path.join(self.packed_image_folder, f"{traj_name}.npy"),
+            mmap_mode="r",
+        )
+        self.arrays[traj_name] = array
+        if len(self.arrays) > self.max_open_arrays:
+            # evict the least recently used array and release its file descriptor
+            _, evicted = self.arrays.popitem(last=False)
+            evicted._mmap.close()
+        return array
+
+    def get_frames(self, traj_name: str, times: Sequence[int]) -> np.ndarray:
+        """
+        Slice frames out of a packed trajectory
+
+        Args:
+            traj_name (str): Name of the trajectory
+            times (Sequence[int]): frame indices to read
+        Returns:
+            np.ndarray: uint8 array of shape [len(times), H, W, 3]
+        """
+        return np.asarray(self._get_array(traj_name)[np.asarray(times)])
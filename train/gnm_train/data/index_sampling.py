@@ -0,0 +1,699 @@
+import copy
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import tqdm
+
+from gnm_train.data.data_utils import TrajDataCache
+
+INDEX_TO_DATA_FILE = "index_to_data.npy"
+INDEX_TRAJ_NAMES_FILE = "traj_names.txt"
+
+# the trajectories are ids into the trajectory name table saved with the index, every index starts with the
+# trajectory and the time of the observation
+GOAL_INDEX_DTYPE = np.dtype(
+    [
+        ("curr_traj", np.int32),
+        ("goal_traj", np.int32),
+        ("curr_time", np.int32),
+        ("goal_time", np.int32),
+    ]
+)
+JOINT_INDEX_DTYPE = np.dtype(GOAL_INDEX_DTYPE.descr + [("action_goal_time", np.int32)])
+# observation slots of the datasets that sample the goals when the samples are loaded (see sample_online_goal)
+OBS_INDEX_DTYPE = np.dtype([("curr_traj", np.int32), ("curr_time", np.int32)])
+PAIRWISE_INDEX_DTYPE = np.dtype(
+    [
+        ("curr_traj", np.int32),
+        ("far_traj", np.int32),
+        ("curr_time", np.int32),
+        ("close_time", np.int32),
+        ("far_time", np.int32),
+    ]
+)
+
+# number of consecutive trajectories of a split sampled by one task with the same label balancers
+TRAJ_CHUNK_SIZE = 64
+
+# the state shared by every task of a pool, set once per worker by _init_worker so the tasks only carry an index
+_worker_state = {}
+
+
+def get_traj_seed(traj_name: str) -> int:
+    # only depends on the trajectory, so its samples don't change with the number of workers or the order of the split
+    return zlib.crc32(traj_name.encode())
+
+
+def _init_worker(state: Dict[str, Any]) -> None:
+    _worker_state.clear()
+    _worker_state.update(state)
+    if "data_folder" in state:
+        _worker_state["traj_data_cache"] = TrajDataCache(state["data_folder"], 0)
+
+
+def _traj_len_task(traj_index: int) -> int:
+    traj_name = _worker_state["traj_names"][traj_index]
+    return _worker_state["traj_data_cache"].get_traj_len(traj_name)
+
+
+def _sample_chunk_task(chunk_index: int) -> List[np.ndarray]:
+    traj_names = _worker_state["traj_names"]
+    # the label balancers in sample_traj are shared by the trajectories of the chunk, so the distances
+    # that can't be sampled near the end of a trajectory are made up for in the next one
+    sample_traj = copy.deepcopy(_worker_state["sample_traj"])
+    chunk_start = chunk_index * TRAJ_CHUNK_SIZE
+    traj_samples = []
+    for traj_index in _worker_state["traj_indices"][
+        chunk_start : chunk_start + TRAJ_CHUNK_SIZE
+    ]:
+        rng = np.random.RandomState(get_traj_seed(traj_names[traj_index]))
+        traj_samples.append(
+            sample_traj(traj_index, traj_names, _worker_state["traj_lens"], rng)
+        )
+    return traj_samples
+
+
+def _run_tasks(
+    task: Callable[[int], Any],
+    num_tasks: int,
+    state: Dict[str, Any],
+    num_workers: int,
+    desc: str,
+) -> List[Any]:
+    if num_workers <= 0:
+        _init_worker(state)
+        try:
+            return [task(i) for i in tqdm.tqdm(range(num_tasks), desc=desc)]
+        finally:
+            _worker_state.clear()
+    with multiprocessing.Pool(
+        num_workers, initializer=_init_worker, initargs=(state,)
+    ) as pool:
+        chunksize = max(1, min(64, num_tasks // (4 * num_workers)))
+        return list(
+            tqdm.tqdm(
+                pool.imap(task, range(num_tasks), chunksize=chunksize),
+                total=num_tasks,
+                desc=desc,
+            )
+        )
+
+
+def get_traj_lens(
+    data_folder: str, traj_names: Sequence[str], num_workers: int = 0
+) -> np.ndarray:
+    """
+    Get the number of frames of every trajectory, reading each traj_data.pkl once (or none if the data folder has a pose store)
+
+    Returns:
+        np.ndarray: int64 array with the length of each trajectory of traj_names
+    """
+    traj_lens = _run_tasks(
+        _traj_len_task,
+        len(traj_names),
+        {"data_folder": data_folder, "traj_names": traj_names},
+        num_workers,
+        "Trajectory lengths read",
+    )
+    return np.array(traj_lens, dtype=np.int64)
+
+
+def get_index_to_data_path(data_split_folder: str, index_name: str) -> str:
+    # one folder per index for the index, its trajectory names and what is derived from it (labels, shards),
+    # the index names are already close to the file name length limit
+    return os.path.join(data_split_folder, index_name, INDEX_TO_DATA_FILE)
+
+
+def save_index_to_data(
+    index_to_data_path: str, index_to_data: np.ndarray, traj_names: Sequence[str]
+) -> None:
+    """
+    Save an index and the names of the trajectory ids it refers to
+    """
+    index_folder = os.path.dirname(index_to_data_path)
+    os.makedirs(index_folder, exist_ok=True)
+    traj_names_path = os.path.join(index_folder, INDEX_TRAJ_NAMES_FILE)
+    with open(traj_names_path + ".tmp", "w") as f:
+        f.write("\n".join(traj_names) + "\n")
+    os.replace(traj_names_path + ".tmp", traj_names_path)
+    # the index is written last so that it only exists once its trajectory names do
+    with open(index_to_data_path + ".tmp", "wb") as f:
+        np.save(f, index_to_data)
+    os.replace(index_to_data_path + ".tmp", index_to_data_path)
+
+
+def load_index_to_data(index_to_data_path: str) -> Tuple[np.ndarray, List[str]]:
+    """
+    Load an index saved by save_index_to_data. The index is memory mapped, so the DataLoader workers share it
+    through the page cache instead of each copying it.
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: read-only index and the name of each trajectory id
+    """
+    with open(
+        os.path.join(os.path.dirname(index_to_data_path), INDEX_TRAJ_NAMES_FILE), "r"
+    ) as f:
+        traj_names = f.read().split("\n")[:-1]
+    return np.load(index_to_data_path, mmap_mode="r"), traj_names
+
+
+def convert_pickled_index_to_data(index_to_data_path: str, dtype: np.dtype) -> bool:
+    """
+    Convert the index of the same configuration pickled as a list of tuples of trajectory names and times
+    (index_name.pkl in the split folder), if there is one, instead of sampling it again
+
+    Returns:
+        bool: whether an index was converted
+    """
+    pickle_path = os.path.dirname(index_to_data_path) + ".pkl"
+    if not os.path.exists(pickle_path):
+        return False
+    print(f"Converting the index {pickle_path}...")
+    with open(pickle_path, "rb") as f:
+        entries = pickle.load(f)
+    # the first two fields of the entries are trajectory names, the others are times
+    traj_names = list(dict.fromkeys(name for entry in entries for name in entry[:2]))
+    traj_ids = {traj_name: j for j, traj_name in enumerate(traj_names)}
+    index_to_data = np.zeros(len(entries), dtype=dtype)
+    for k, field in enumerate(dtype.names):
+        if k < 2:
+            index_to_data[field] = [traj_ids[entry[k]] for entry in entries]
+        else:
+            index_to_data[field] = [entry[k] for entry in entries]
+    save_index_to_data(index_to_data_path, index_to_data, traj_names)
+    return True
+
+
+def get_eval_subset_path(
+    index_to_data_path: str, subset_size: float, seed: int
+) -> str:
+    return os.path.join(
+        os.path.dirname(index_to_data_path),
+        f"eval_subset_size_{subset_size}_seed_{seed}.npy",
+    )
+
+
+def sample_eval_subset(
+    strata: np.ndarray, subset_size: float, seed: int = 0
+) -> np.ndarray:
+    """
+    Sample a subset of the samples of an index, stratified by strata: every stratum gets its share of the subset
+    (rounded by the largest remainders) and its samples are picked at random without replacement
+
+    Args:
+        strata (np.ndarray): stratum of each sample of the index, such as the distance category of its goal
+        subset_size (float): number of samples of the subset, or fraction of the samples if it is less than 1
+        seed (int): seed of the random state picking the samples
+    Returns:
+        np.ndarray: sorted int64 indices of the samples of the subset
+    """
+    if subset_size < 1:
+        num_samples = int(round(subset_size * len(strata)))
+    else:
+        num_samples = min(int(subset_size), len(strata))
+    _, stratum_indices, stratum_counts = np.unique(
+        strata, return_inverse=True, return_counts=True
+    )
+    shares = stratum_counts * num_samples / max(len(strata), 1)
+    stratum_sizes = np.floor(shares).astype(np.int64)
+    # the samples left by rounding down go to the strata with the largest remainders
+    remainders = np.argsort(stratum_sizes - shares, kind="stable")
+    stratum_sizes[remainders[: num_samples - stratum_sizes.sum()]] += 1
+    rng = np.random.RandomState(seed)
+    order = np.argsort(stratum_indices, kind="stable")
+    subset = [
+        rng.choice(samples, size, replace=False)
+        for samples, size in zip(
+            np.split(order, np.cumsum(stratum_counts)[:-1]), stratum_sizes
+        )
+    ]
+    return np.sort(np.concatenate([np.zeros(0, dtype=np.int64)] + subset))
+
+
+def load_eval_subset(
+    index_to_data_path: str,
+    get_strata: Callable[[], np.ndarray],
+    subset_size: float,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Load the evaluation subset of an index, sampling it with sample_eval_subset if it doesn't exist or the index changed since
+
+    Args:
+        index_to_data_path (str): path of the index
+        get_strata (Callable[[], np.ndarray]): computes the stratum of each sample of the index
+        (see sample_eval_subset for the other arguments)
+    Returns:
+        np.ndarray: sorted int64 indices of the samples of the subset
+    """
+    eval_subset_path = get_eval_subset_path(index_to_data_path, subset_size, seed)
+    if not os.path.exists(eval_subset_path) or os.path.getmtime(
+        eval_subset_path
+    ) < os.path.getmtime(index_to_data_path):
+        eval_subset = sample_eval_subset(get_strata(), subset_size, seed)
+        with open(eval_subset_path + ".tmp", "wb") as f:
+            np.save(f, eval_subset)
+        os.replace(eval_subset_path + ".tmp", eval_subset_path)
+    return np.load(eval_subset_path)
+
+
+def gen_index_to_data(
+    sample_traj: Callable,
+    data_folder: str,
+    traj_names: Sequence[str],
+    dtype: np.dtype,
+    num_workers: int = 0,
+    desc: str = "",
+    traj_indices: Optional[Sequence[int]] = None,
+    traj_lens: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Sample the index of a dataset in a pool of num_workers processes. The trajectories are sampled in fixed chunks
+    of TRAJ_CHUNK_SIZE trajectories that each start from a fresh copy of the label balancers, and each trajectory
+    with its own random state seeded from its name (see get_traj_seed), so the index is the same for any number of workers.
+
+    Args:
+        sample_traj (Callable): picklable function (traj_index, traj_names, traj_lens, rng) -> array of the samples of the trajectory, such as a functools.partial of sample_traj_goals (its label balancers are copied for each chunk of trajectories)
+        data_folder (str): Directory with all the trajectory folders
+        traj_names (Sequence[str]): Trajectories of the dataset split
+        dtype (np.dtype): dtype of the samples returned by sample_traj
+        num_workers (int): Number of processes sampling the trajectories (0 to sample them in this process)
+        desc (str): Name of the dataset for the progress bars
+        traj_indices (Sequence[int], optional): Indices in traj_names of the trajectories to sample. Defaults to all of them.
+        traj_lens (np.ndarray, optional): Length of each trajectory of traj_names, if already read (see get_traj_lens)
+    Returns:
+        np.ndarray: samples of the trajectories, in the order of traj_indices, with trajectory ids into traj_names
+    """
+    start_time = time.time()
+    if traj_indices is None:
+        traj_indices = range(len(traj_names))
+    traj_indices = list(traj_indices)
+    if traj_lens is None:
+        traj_lens = get_traj_lens(data_folder, traj_names, num_workers)
+    chunk_samples = _run_tasks(
+        _sample_chunk_task,
+        -(-len(traj_indices) // TRAJ_CHUNK_SIZE),
+        {
+            "traj_names": traj_names,
+            "traj_indices": traj_indices,
+            "traj_lens": traj_lens,
+            "sample_traj": sample_traj,
+        },
+        num_workers,
+        f"{desc} trajectory chunks sampled",
+    )
+    index_to_data = np.concatenate(
+        [np.zeros(0, dtype=dtype)]
+        + [samples for traj_samples in chunk_samples for samples in traj_samples]
+    )
+    print(
+        f"Sampled {len(index_to_data)} samples from {len(traj_indices)} trajectories of the {desc} dataset in {time.time() - start_time:.1f}s ({max(num_workers, 1)} processes)"
+    )
+    return index_to_data
+
+
+def update_index_to_data(
+    index_to_data_path: str,
+    sample_traj: Callable,
+    data_folder: str,
+    traj_names: Sequence[str],
+    dtype: np.dtype,
+    goal_traj_field: Optional[str],
+    num_workers: int = 0,
+    desc: str = "",
+) -> bool:
+    """
+    Bring an index saved by save_index_to_data up to date with the trajectories of the split: the samples of the
+    trajectories removed from the split are dropped, the trajectories added to it are sampled with gen_index_to_data
+    and appended, and the samples of the other trajectories are kept. The negative goals that were on a removed
+    trajectory are the only kept samples that change, they are sampled again on the trajectories of the split.
+
+    Args:
+        index_to_data_path (str): Path of the saved index
+        goal_traj_field (str, optional): field of dtype with the trajectory of the goal that can be on another
+            trajectory, its time is in the matching _time field (None if the index has no goals, like OBS_INDEX_DTYPE)
+        (see gen_index_to_data for the other arguments)
+    Returns:
+        bool: whether the index was updated
+    """
+    index_to_data, index_traj_names = load_index_to_data(index_to_data_path)
+    covered = set(index_traj_names)
+    new_traj_indices = [j for j, f in enumerate(traj_names) if f not in covered]
+    traj_ids = {f: j for j, f in enumerate(traj_names)}
+    removed_traj_names = [f for f in index_traj_names if f not in traj_ids]
+    if len(new_traj_indices) == 0 and len(removed_traj_names) == 0:
+        return False
+    print(
+        f"Updating the {desc} index for {len(new_traj_indices)} added and {len(removed_traj_names)} removed trajectories..."
+    )
+
+    # map the trajectory ids of the index to ids into traj_names (-1 for the removed trajectories)
+    id_map = np.array(
+        [traj_ids.get(f, -1) for f in index_traj_names] + [-1], dtype=np.int32
+    )
+    index_to_data = np.array(index_to_data)  # copy it out of the memory map
+    index_to_data["curr_traj"] = id_map[index_to_data["curr_traj"]]
+    if goal_traj_field is not None:
+        index_to_data[goal_traj_field] = id_map[index_to_data[goal_traj_field]]
+    index_to_data = index_to_data[index_to_data["curr_traj"] >= 0]
+
+    lost_goals = np.zeros(0, dtype=np.int64)
+    if goal_traj_field is not None:
+        goal_time_field = goal_traj_field.replace("_traj", "_time")
+        lost_goals = np.flatnonzero(index_to_data[goal_traj_field] < 0)
+    traj_lens = None
+    if len(new_traj_indices) > 0 or len(lost_goals) > 0:
+        traj_lens = get_traj_lens(data_folder, traj_names, num_workers)
+    if len(lost_goals) > 0:
+        rng = np.random.RandomState(get_traj_seed("\n".join(removed_traj_names)))
+        (
+            index_to_data[goal_traj_field][lost_goals],
+            index_to_data[goal_time_field][lost_goals],
+        ) = sample_negatives(
+            index_to_data["curr_traj"][lost_goals], traj_lens, len(lost_goals), rng
+        )
+    if len(new_traj_indices) > 0:
+        index_to_data = np.concatenate(
+            [
+                index_to_data,
+                gen_index_to_data(
+                    sample_traj,
+                    data_folder,
+                    traj_names,
+                    dtype,
+                    num_workers,
+                    desc,
+                    new_traj_indices,
+                    traj_lens,
+                ),
+            ]
+        )
+    save_index_to_data(index_to_data_path, index_to_data, traj_names)
+    return True
+
+
+def sample_goal_classes(
+    label_balancers: List[Any],
+    valid: List[np.ndarray],
+    goals_per_obs: int,
+    rng: np.random.RandomState,
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Sample up to goals_per_obs goals per observation, one goal of every observation at a time with a single
+    sample_indices call per balancer. The first balancer decides how many goals an observation gets: it samples distinct
+    classes until it has no valid class left for the observation. The other balancers also sample distinct classes, and
+    repeat them once an observation took all of its valid ones instead of dropping its goals. Observations that have no
+    valid class in one of the balancers get no goals, and nothing is drawn for them, so the counts of the balancers
+    only have the returned goals.
+
+    Args:
+        label_balancers (List): balancers with a sample_indices method (RandomizedClassBalancer or GeometricClassBalancer)
+        valid (List[np.ndarray]): bool array of shape [num_obs, num_classes] of the classes each observation can take, for each balancer
+        goals_per_obs (int): Number of goals to sample per observation
+        rng (np.random.RandomState): Random state to sample with
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray]]: observation of each goal (grouped by observation) and the index of its class in each balancer
+    """
+    active = np.all([v.any(axis=1) for v in valid], axis=0)
+    taken = [np.zeros_like(v) for v in valid]
+    goal_obs = []
+    goal_classes = [[] for _ in label_balancers]
+    for _ in range(goals_per_obs):
+        rows = np.flatnonzero(active)
+        choice = label_balancers[0].sample_indices(valid[0][rows] & ~taken[0][rows], rng)
+        found = choice >= 0
+        # break the loop of an observation if there are no more valid distances to sample
+        active[rows[~found]] = False
+        rows = rows[found]
+        goal_obs.append(rows)
+        taken[0][rows, choice[found]] = True
+        goal_classes[0].append(choice[found])
+        for j in range(1, len(label_balancers)):
+            # start over on the classes of the observations that took all of them
+            exhausted = ~np.any(valid[j][rows] & ~taken[j][rows], axis=1)
+            taken[j][rows[exhausted]] = False
+            choice = label_balancers[j].sample_indices(
+                valid[j][rows] & ~taken[j][rows], rng
+            )
+            taken[j][rows, choice] = True
+            goal_classes[j].append(choice)
+    goal_obs = np.concatenate(goal_obs)
+    order = np.argsort(goal_obs, kind="stable")
+    return goal_obs[order], [np.concatenate(c)[order] for c in goal_classes]
+
+
+def sample_negatives(
+    traj_index: Any,
+    traj_lens: np.ndarray,
+    num_negatives: int,
+    rng: np.random.RandomState,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample num_negatives goals on other trajectories than traj_index (negative mining)
+
+    Args:
+        traj_index (int or np.ndarray): trajectory of the observations, or the trajectory of each observation
+        traj_lens (np.ndarray): length of each trajectory of the split
+        num_negatives (int): number of goals to sample
+        rng (np.random.RandomState): Random state to sample with
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: trajectory index and time of each goal
+    """
+    new = rng.randint(1, len(traj_lens), size=num_negatives)
+    rand_indices = (traj_index + new) % len(traj_lens)
+    return rand_indices, rng.randint(traj_lens[rand_indices])
+
+
+def sample_traj_goals(
+    traj_index: int,
+    traj_names: Sequence[str],
+    traj_lens: np.ndarray,
+    rng: np.random.RandomState,
+    label_balancer: Any,
+    waypoint_spacing: int,
+    max_dist_cat: int,
+    context_size: int,
+    end_slack: int,
+    goals_per_obs: int,
+) -> np.ndarray:
+    """
+    Sample the GOAL_INDEX_DTYPE (obs_traj, goal_traj, obs_time, goal_time) samples of the observations of a trajectory for
+    GNM_Dataset and RLDataset. A -1 distance category from label_balancer samples a goal on another trajectory (negative mining).
+    """
+    traj_len = int(traj_lens[traj_index])
+    # start sampling a little bit into the trajectory to give enought time to generate context
+    curr_times = np.arange(context_size * waypoint_spacing, traj_len - end_slack)
+    max_lens = np.minimum(
+        int(max_dist_cat * waypoint_spacing), traj_len - curr_times - 1
+    )
+    # sample a distance from the distance categories as long as it is less than the trajectory length
+    dists = np.array(label_balancer.classes)
+    goal_offsets = np.array([int(dist * waypoint_spacing) for dist in dists])
+    valid = goal_offsets[None] <= max_lens[:, None]
+    obs, (dist_indices,) = sample_goal_classes(
+        [label_balancer], [valid], goals_per_obs, rng
+    )
+
+    curr_times = curr_times[obs]
+    goal_times = curr_times + goal_offsets[dist_indices]
+    goal_traj_indices = np.full(len(obs), traj_index)
+    # if the length to the goal is negative, then we are using negative mining (sample an goal from another trajectory)
+    negative = dists[dist_indices] == -1
+    goal_traj_indices[negative], goal_times[negative] = sample_negatives(
+        traj_index, traj_lens, int(negative.sum()), rng
+    )
+    samples = np.zeros(len(obs), dtype=GOAL_INDEX_DTYPE)
+    samples["curr_traj"] = traj_index
+    samples["goal_traj"] = goal_traj_indices
+    samples["curr_time"] = curr_times
+    samples["goal_time"] = goal_times
+    return samples
+
+
+def sample_traj_joint_goals(
+    traj_index: int,
+    traj_names: Sequence[str],
+    traj_lens: np.ndarray,
+    rng: np.random.RandomState,
+    dist_label_balancer: Any,
+    action_label_balancer: Any,
+    waypoint_spacing: int,
+    max_dist_cat: int,
+    action_max_dist_cat: int,
+    context_size: int,
+    end_slack: int,
+    goals_per_obs: int,
+) -> np.ndarray:
+    """
+    Sample the JOINT_INDEX_DTYPE (obs_traj, dist_goal_traj, obs_time, dist_goal_time, action_goal_time) samples of the observations of a trajectory for JointGNM_Dataset
+    """
+    traj_len = int(traj_lens[traj_index])
+    # start sampling a little bit into the trajectory to give enought time to generate context
+    curr_times = np.arange(context_size * waypoint_spacing, traj_len - end_slack)
+    max_lens = np.minimum(
+        int(max_dist_cat * waypoint_spacing), traj_len - curr_times - 1
+    )
+    action_max_lens = np.minimum(
+        int(action_max_dist_cat * waypoint_spacing), traj_len - curr_times - 1
+    )
+    dists = np.array(dist_label_balancer.classes)
+    goal_offsets = np.array([int(dist * waypoint_spacing) for dist in dists])
+    action_goal_offsets = np.array(
+        [int(dist * waypoint_spacing) for dist in action_label_balancer.classes]
+    )
+    # sample goals_per_obs pairs of goals per observation
+    obs, (dist_indices, action_dist_indices) = sample_goal_classes(
+        [dist_label_balancer, action_label_balancer],
+        [
+            goal_offsets[None] <= max_lens[:, None],
+            action_goal_offsets[None] <= action_max_lens[:, None],
+        ],
+        goals_per_obs,
+        rng,
+    )
+
+    curr_times = curr_times[obs]
+    goal_times = curr_times + goal_offsets[dist_indices]
+    action_goal_times = curr_times + action_goal_offsets[action_dist_indices]
+    goal_traj_indices = np.full(len(obs), traj_index)
+    # if the length to the goal is negative, then we are using negative mining (sample an goal from another trajectory)
+    negative = dists[dist_indices] == -1
+    goal_traj_indices[negative], goal_times[negative] = sample_negatives(
+        traj_index, traj_lens, int(negative.sum()), rng
+    )
+    samples = np.zeros(len(obs), dtype=JOINT_INDEX_DTYPE)
+    samples["curr_traj"] = traj_index
+    samples["goal_traj"] = goal_traj_indices
+    samples["curr_time"] = curr_times
+    samples["goal_time"] = goal_times
+    samples["action_goal_time"] = action_goal_times
+    return samples
+
+
+def sample_traj_pairs(
+    traj_index: int,
+    traj_names: Sequence[str],
+    traj_lens: np.ndarray,
+    rng: np.random.RandomState,
+    label_balancer: Any,
+    waypoint_spacing: int,
+    max_dist_cat: int,
+    context_size: int,
+    end_slack: int,
+) -> np.ndarray:
+    """
+    Sample the PAIRWISE_INDEX_DTYPE (obs_traj, far_traj, obs_time, close_time, far_time) samples of the observations of a trajectory for
+    PairwiseDistanceDataset. The close goal is always on the trajectory of the observation.
+    """
+    traj_len = int(traj_lens[traj_index])
+    curr_times = np.arange(context_size * waypoint_spacing, traj_len - end_slack)
+    max_lens = np.minimum(
+        int(max_dist_cat * waypoint_spacing), traj_len - curr_times - 1
+    )
+    pairs = np.array(label_balancer.classes).reshape(-1, 2)
+    valid = (pairs.max(axis=1) * waypoint_spacing)[None] <= max_lens[:, None]
+    # stop at the first observation without a valid pair, the ones after it are closer to the end of the trajectory
+    has_pair = valid.any(axis=1)
+    num_obs = len(valid) if has_pair.all() else int(np.argmin(has_pair))
+    curr_times = curr_times[:num_obs]
+    pair_indices = label_balancer.sample_indices(valid[:num_obs], rng)
+    close_lens_to_goal, far_lens_to_goal = pairs[pair_indices].T
+
+    close_times = curr_times + (close_lens_to_goal * waypoint_spacing).astype(int)
+    far_times = curr_times + (far_lens_to_goal * waypoint_spacing).astype(int)
+    far_traj_indices = np.full(num_obs, traj_index)
+    negative = far_lens_to_goal == -1  # negative mining
+    far_traj_indices[negative], far_times[negative] = sample_negatives(
+        traj_index, traj_lens, int(negative.sum()), rng
+    )
+    assert np.all(close_times < traj_len), f"{close_times.max()}, {traj_len}"
+    assert np.all(
+        far_times < traj_lens[far_traj_indices]
+    ), f"{far_times}, {traj_lens[far_traj_indices]}"
+    samples = np.zeros(num_obs, dtype=PAIRWISE_INDEX_DTYPE)
+    samples["curr_traj"] = traj_index
+    samples["far_traj"] = far_traj_indices
+    samples["curr_time"] = curr_times
+    samples["close_time"] = close_times
+    samples["far_time"] = far_times
+    return samples
+
+
+def sample_traj_obs(
+    traj_index: int,
+    traj_names: Sequence[str],
+    traj_lens: np.ndarray,
+    rng: np.random.RandomState,
+    distance_categories: Sequence[int],
+    waypoint_spacing: int,
+    max_dist_cat: int,
+    context_size: int,
+    end_slack: int,
+    goals_per_obs: int,
+) -> np.ndarray:
+    """
+    Get the OBS_INDEX_DTYPE (obs_traj, obs_time) observation slots of a trajectory, goals_per_obs slots for each observation
+    that has a valid distance category (the same observations that sample_traj_goals samples goals for). Nothing is sampled.
+    """
+    traj_len = int(traj_lens[traj_index])
+    curr_times = np.arange(context_size * waypoint_spacing, traj_len - end_slack)
+    max_lens = np.minimum(
+        int(max_dist_cat * waypoint_spacing), traj_len - curr_times - 1
+    )
+    min_goal_offset = min(
+        int(dist * waypoint_spacing) for dist in distance_categories
+    )
+    curr_times = np.repeat(curr_times[min_goal_offset <= max_lens], goals_per_obs)
+    slots = np.zeros(len(curr_times), dtype=OBS_INDEX_DTYPE)
+    slots["curr_traj"] = traj_index
+    slots["curr_time"] = curr_times
+    return slots
+
+
+def sample_online_goal(
+    label_balancer: Any,
+    traj_index: int,
+    curr_time: int,
+    traj_len: int,
+    num_trajs: int,
+    get_traj_len: Callable[[int], int],
+    waypoint_spacing: int,
+    max_dist_cat: int,
+    rng: Optional[np.random.RandomState] = None,
+) -> Tuple[int, int]:
+    """
+    Sample the goal of an observation slot from sample_traj_obs when the sample is loaded, the same way sample_traj_goals
+    samples the goal of an observation. A -1 distance category from label_balancer samples a goal on another trajectory (negative mining).
+
+    Args:
+        label_balancer: RandomizedClassBalancer or GeometricClassBalancer of the distance categories
+        traj_index (int): trajectory of the observation
+        curr_time (int): time of the observation
+        traj_len (int): length of the trajectory of the observation
+        num_trajs (int): number of trajectories of the split
+        get_traj_len (Callable[[int], int]): length of a trajectory of the split, only called for negative goals
+        waypoint_spacing (int): Spacing between waypoints
+        max_dist_cat (int): Maximum distance category
+        rng (np.random.RandomState, optional): Random state to sample with. Defaults to the global numpy random state, which the DataLoader seeds differently in each worker.
+    Returns:
+        Tuple[int, int]: trajectory and time of the goal
+    """
+    if rng is None:
+        rng = np.random
+    max_len = min(int(max_dist_cat * waypoint_spacing), traj_len - curr_time - 1)
+    dists = label_balancer.classes
+    goal_offsets = np.array([int(dist * waypoint_spacing) for dist in dists])
+    dist_index = label_balancer.sample_indices(
+        (goal_offsets <= max_len)[None], rng
+    )[0]
+    assert (
+        dist_index >= 0
+    ), f"No valid distance category at time {curr_time} of a trajectory of length {traj_len}"
+    if dists[dist_index] == -1:
+        goal_traj = (traj_index + rng.randint(1, num_trajs)) % num_trajs
+        return goal_traj, rng.randint(get_traj_len(goal_traj))
+    return traj_index, curr_time + int(goal_offsets[dist_index])
@@ -0,0 +1,290 @@
+from functools import partial
+import numpy as np
+import os
+from typing import Optional, Tuple
+
+import torch
+from torchvision import transforms
+
+from gnm_train.data.data_utils import (
+    get_action_label_table,
+    get_dist_labels,
+    RandomizedClassBalancer,
+    split_action_labels,
+)
+from gnm_train.data.gnm_dataset import GNM_Dataset
+from gnm_train.data.index_sampling import (
+    JOINT_INDEX_DTYPE,
+    convert_pickled_index_to_data,
+    gen_index_to_data,
+    get_index_to_data_path,
+    load_index_to_data,
+    sample_traj_joint_goals,
+    save_index_to_data,
+    update_index_to_data,
+)
+
+
+class JointGNM_Dataset(GNM_Dataset):
+    def __init__(
+        self,
+        data_folder: str,
+        data_split_folder: str,
+        dataset_name: str,
+        transform: transforms,
+        aspect_ratio: float,
+        waypoint_spacing: int,
+        dist_min_dist_cat: int,
+        dist_max_dist_cat: int,
+        action_min_dist_cat: int,
+        action_max_dist_cat: int,
+        negative_mining: bool,
+        len_traj_pred: int,
+        learn_angle: bool,
+        context_size: int,
+        context_type: str = "temporal",
+        end_slack: int = 0,
+        goals_per_obs: int = 1,
+        normalize: bool = True,
+        traj_cache_size: int = 64,
+        packed_image_folder: Optional[str] = None,
+        frame_cache_bytes: int = 0,
+        viz_images: bool = True,
+        decode_threads: int = 0,
+        jpeg_draft: bool = False,
+        index_workers: int = 0,
+    ):
+        """
+        GNM dataset that samples both a distance goal and an action goal for each observation, so the
+        distance and the action losses are trained on the same decoded context instead of two datasets
+
+        Args:
+            dist_min_dist_cat (int): Minimum distance category of the distance goals
+            dist_max_dist_cat (int): Maximum distance category of the distance goals
+            action_min_dist_cat (int): Minimum distance category of the action goals
+            action_max_dist_cat (int): Maximum distance category of the action goals
+            negative_mining (bool): Whether to use negative mining for the distance goals (action goals are always on the same trajectory)
+            (see GNM_Dataset for the other arguments)
+        """
+        self.action_distance_categories = list(
+            range(action_min_dist_cat, action_max_dist_cat + 1, waypoint_spacing)
+        )
+        self.action_min_dist_cat = self.action_distance_categories[0]
+        self.action_max_dist_cat = self.action_distance_categories[-1]
+        super().__init__(
+            data_folder=data_folder,
+            data_split_folder=data_split_folder,
+            dataset_name=dataset_name,
+            is_action=False,
+            transform=transform,
+            aspect_ratio=aspect_ratio,
+            waypoint_spacing=waypoint_spacing,
+            min_dist_cat=dist_min_dist_cat,
+            max_dist_cat=dist_max_dist_cat,
+            negative_mining=negative_mining,
+            len_traj_pred=len_traj_pred,
+            learn_angle=learn_angle,
+            context_size=context_size,
+            context_type=context_type,
+            end_slack=end_slack,
+            goals_per_obs=goals_per_obs,
+            normalize=normalize,
+            traj_cache_size=traj_cache_size,
+            packed_image_folder=packed_image_folder,
+            frame_cache_bytes=frame_cache_bytes,
+            viz_images=viz_images,
+            decode_threads=decode_threads,
+            jpeg_draft=jpeg_draft,
+            index_workers=index_workers,
+        )
+
+    def _gen_index_to_data(self) -> None:
+        """
+        Generates a JOINT_INDEX_DTYPE array of (obs_traj, dist_goal_traj, obs_time, dist_goal_time, action_goal_time) for each observation in the dataset, with trajectory ids into self.index_traj_names
+        """
+        dist_label_balancer = RandomizedClassBalancer(self.distance_categories)
+        action_label_balancer = RandomizedClassBalancer(
+            self.action_distance_categories
+        )
+
+        # v2: the observations keep all their distance goals when they run out of action goals (see sample_goal_classes)
+        index_to_data_path = get_index_to_data_path(
+            self.data_split_folder,
+            f"dataset_type_joint_v2_waypoint_spacing_{self.waypoint_spacing}_min_dist_cat_{self.min_dist_cat}_max_dist_cat_{self.max_dist_cat}_action_min_dist_cat_{self.action_min_dist_cat}_action_max_dist_cat_{self.action_max_dist_cat}_negative_mining_{self.negative_mining}_len_traj_pred_{self.len_traj_pred}_learn_angle_{self.learn_angle}_context_size_{self.context_size}_context_type_{self.context_type}_end_slack_{self.end_slack}_goals_per_obs_{self.goals_per_obs}",
+        )
+        self.index_to_data_path = index_to_data_path
+        sample_traj = partial(
+            sample_traj_joint_goals,
+            dist_label_balancer=dist_label_balancer,
+            action_label_balancer=action_label_balancer,
+            waypoint_spacing=self.waypoint_spacing,
+            max_dist_cat=self.max_dist_cat,
+            action_max_dist_cat=self.action_max_dist_cat,
+            context_size=self.context_size,
+            end_slack=self.end_slack,
+            goals_per_obs=self.goals_per_obs,
+        )
+        desc = f"{self.dataset_name} joint"
+        if os.path.exists(index_to_data_path) or convert_pickled_index_to_data(
+            index_to_data_path, JOINT_INDEX_DTYPE
+        ):
+            # sample the trajectories added to the split since the index was saved and drop the removed ones
+            update_index_to_data(
+                index_to_data_path,
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                JOINT_INDEX_DTYPE,
+                "goal_traj",
+                self.index_workers,
+                desc,
+            )
+        else:
+            # if the index_to_data file doesn't exist, create it
+            print(
+                f"Sampling subgoals for each observation in the {self.dataset_name} joint distance and action dataset..."
+            )
+            print(
+                "This will take a while, but it will only be done once for each configuration per dataset."
+            )
+            index_to_data = gen_index_to_data(
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                JOINT_INDEX_DTYPE,
+                self.index_workers,
+                desc,
+            )
+            save_index_to_data(index_to_data_path, index_to_data, self.traj_names)
+        self.index_to_data, self.index_traj_names = load_index_to_data(
+            index_to_data_path
+        )
+
+    def _compute_label_table(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float32 table with the distance label followed by the action goal and waypoint labels (see split_action_labels) of each sample
+        """
+        curr_trajs = self.index_to_data["curr_traj"]
+        curr_times = self.index_to_data["curr_time"]
+        dist_labels = get_dist_labels(
+            curr_trajs,
+            self.index_to_data["goal_traj"],
+            curr_times,
+            self.index_to_data["goal_time"],
+            self.waypoint_spacing,
+            self.max_dist_cat,
+        )
+        action_labels = get_action_label_table(
+            self.traj_data_cache,
+            self.index_traj_names,
+            curr_trajs,
+            curr_times,
+            self.index_to_data["action_goal_time"],
+            self.len_traj_pred,
+            self.waypoint_spacing,
+            self.learn_angle,
+            self._get_label_scale(),
+        )
+        return np.concatenate((dist_labels[:, None], action_labels), axis=1)
+
+    def __getitem__(self, i: int) -> Tuple[torch.Tensor]:
+        """
+        Args:
+            i (int): index to ith datapoint
+        Returns:
+            Tuple of tensors (see split_joint_batch for how a batch maps to the distance and action batches of GNM_Dataset)
+                obs_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the robot's observation for visualization
+                dist_goal_image (torch.Tensor): tensor of shape [3, H, W] containing the distance subgoal image for visualization
+                action_goal_image (torch.Tensor): tensor of shape [3, H, W] containing the action subgoal image for visualization
+                transf_obs_image (torch.Tensor): tensor of shape [(context_size + 1) * 3, H, W] containing the images of the context and the observation after transformation for training
+                transf_dist_goal_image (torch.Tensor): tensor of shape [3, H, W] containing the distance subgoal image after transformation for training
+                transf_action_goal_image (torch.Tensor): tensor of shape [3, H, W] containing the action subgoal image after transformation for training
+                dist_label (torch.Tensor): tensor of shape (1,) containing the distance label from the observation to the distance goal
+                action_goal_pos (torch.Tensor): position of the action goal in the frame of the observation
+                action_label (torch.Tensor): tensor of shape (5, 2) or (5, 4) (if training with angle) containing the action labels from the observation to the action goal
+                dataset_index (torch.Tensor): index of the datapoint in the dataset [for identifying the dataset for visualization when using multiple datasets]
+        """
+        (
+            curr_traj,
+            goal_traj,
+            curr_time,
+            goal_time,
+            action_goal_time,
+        ) = self.index_to_data[i].tolist()
+        f_curr = self.index_traj_names[curr_traj]
+        f_goal = self.index_traj_names[goal_traj]
+
+        # the context is decoded once and shared by the distance and the action goals
+        context = self._sample_context(f_curr, curr_time)
+        frame_data = self.frame_loader.load(
+            context + [(f_goal, goal_time), (f_curr, action_goal_time)]
+        )
+        action_goal_image, transf_action_goal_image = frame_data.pop()
+        dist_goal_image, transf_dist_goal_image = frame_data.pop()
+        obs_image = frame_data[-1][0]
+        if not self.viz_images:
+            obs_image = self._get_viz_key(*context[-1])
+            dist_goal_image = self._get_viz_key(f_goal, goal_time)
+            action_goal_image = self._get_viz_key(f_curr, action_goal_time)
+        transf_obs_images = [transf_obs_image for _, transf_obs_image in frame_data]
+        transf_obs_image = torch.cat(transf_obs_images, dim=0)
+
+        labels = self.label_table[i]
+        dist_label = torch.from_numpy(np.array(labels[:1]))
+        action_goal_pos, action_label = split_action_labels(
+            labels[1:], self.len_traj_pred, self.learn_angle
+        )
+        return (
+            obs_image,
+            dist_goal_image,
+            action_goal_image,
+            transf_obs_image,
+            transf_dist_goal_image,
+            transf_action_goal_image,
+            dist_label,
+            action_goal_pos,
+            action_label,
+            torch.LongTensor([self.dataset_index]),
+        )
+
+
+def split_joint_batch(vals: Tuple[torch.Tensor]) -> Tuple[Tuple[torch.Tensor], Tuple[torch.Tensor]]:
+    """
+    Split a batch of a JointGNM_Dataset into a distance batch and an action batch laid out like the batches of GNM_Dataset
+
+    Args:
+        vals (Tuple[torch.Tensor]): collated batch of a JointGNM_Dataset
+    Returns:
+        Tuple[Tuple[torch.Tensor], Tuple[torch.Tensor]]: distance batch and action batch
+    """
+    (
+        obs_image,
+        dist_goal_image,
+        action_goal_image,
+        transf_obs_image,
+        transf_dist_goal_image,
+        transf_action_goal_image,
+        dist_label,
+        action_goal_pos,
+        action_label,
+        dataset_index,
+    ) = vals
+    dist_vals = (
+        obs_image,
+        dist_goal_image,
+        transf_obs_image,
+        transf_dist_goal_image,
+        dist_label,
+        dataset_index,
+    )
+    action_vals = (
+        obs_image,
+        action_goal_image,
+        transf_obs_image,
+        transf_action_goal_image,
+        action_goal_pos,
+        action_label,
+        dataset_index,
+    )
+    return dist_vals, action_vals
@@ -1,7 +1,9 @@
+from functools import partial
 import numpy as np
 import os
 import pickle
-import tqdm
+from typing import Optional
+import yaml
 
 from torchvision import transforms
 import torch
@@ -9,9 +11,21 @@ import torchvision.transforms.functional as TF
 from torch.utils.data import Dataset
 
 from gnm_train.data.data_utils import (
-    img_path_to_data,
-    get_image_path,
+    get_dist_labels,
     RandomizedClassBalancer,
+    TrajDataCache,
+)
+from gnm_train.data.frame_loader import FrameLoader
+from gnm_train.data.index_sampling import (
+    PAIRWISE_INDEX_DTYPE,
+    convert_pickled_index_to_data,
+    gen_index_to_data,
+    get_index_to_data_path,
+    load_eval_subset,
+    load_index_to_data,
+    sample_traj_pairs,
+    save_index_to_data,
+    update_index_to_data,
 )
 
 
@@ -31,6 +45,13 @@ class PairwiseDistanceDataset(Dataset):
         context_size: int,
         context_type: str = "temporal",
         end_slack: int = 0,
+        traj_cache_size: int = 64,
+        packed_image_folder: Optional[str] = None,
+        frame_cache_bytes: int = 0,
+        viz_images: bool = True,
+        decode_threads: int = 0,
+        jpeg_draft: bool = False,
+        index_workers: int = 0,
     ):
         """
         A dataset that contains a single observation and two subgoals. The task is to predict which subgoal is closer to the observation. This dataset is only used for evaluation.
@@ -50,6 +71,13 @@ class PairwiseDistanceDataset(Dataset):
             context_size (int): Number of previous observations to use as context
             context_type (str): Whether to use temporal, randomized, or randomized temporal context
             end_slack (int): Number of timesteps to ignore at the end of the trajectory
+            traj_cache_size (int): Number of trajectories whose traj_data.pkl is kept in memory by each worker
+            packed_image_folder (string): Directory with pre-cropped, pre-resized frames written by pack_images.py (optional)
+            frame_cache_bytes (int): Memory budget of the decoded frame cache of this dataset, shared by all the DataLoader workers (0 disables it)
+            viz_images (bool): Whether to load the visualization images. If False, samples hold [dataset_index, traj_index, time] frame keys in their place (see load_viz_images in frame_loader.py).
+            decode_threads (int): Number of threads each DataLoader worker uses to decode the frames of a sample concurrently (0 to decode them sequentially)
+            jpeg_draft (bool): Whether to decode the jpgs at a reduced 1/2, 1/4 or 1/8 scale that still covers the transformed image size
+            index_workers (int): Number of processes sampling the index of the dataset when it isn't cached yet (0 to sample it in this process)
         """
         self.data_folder = data_folder
         self.data_split_folder = data_split_folder
@@ -62,8 +90,22 @@ class PairwiseDistanceDataset(Dataset):
         if "" in self.traj_names:
             self.traj_names.remove("")
 
+        self.traj_data_cache = TrajDataCache(data_folder, traj_cache_size)
+
         self.transform = transform
         self.aspect_ratio = aspect_ratio
+        self.viz_images = viz_images
+        self.frame_loader = FrameLoader(
+            data_folder,
+            transform,
+            aspect_ratio,
+            packed_image_folder,
+            self.traj_names,
+            frame_cache_bytes,
+            viz_images,
+            decode_threads,
+            jpeg_draft,
+        )
         self.waypoint_spacing = waypoint_spacing
         self.distance_categories = list(
             range(min_dist_cat, max_dist_cat + 1, waypoint_spacing)
@@ -97,84 +139,103 @@ class PairwiseDistanceDataset(Dataset):
         }, "context_type must be one of temporal, randomized, randomized_temporal"
         self.context_type = context_type
         self.end_slack = end_slack
+
+        # load data/data_config.yaml
+        with open(
+            os.path.join(os.path.dirname(__file__), "data_config.yaml"), "r"
+        ) as f:
+            all_data_config = yaml.safe_load(f)
+        dataset_names = list(all_data_config.keys())
+        dataset_names.sort()
+        # use this index to find the dataset of the visualization frame keys
+        self.dataset_index = (
+            dataset_names.index(self.dataset_name)
+            if self.dataset_name in dataset_names
+            else -1
+        )
+        self.index_workers = index_workers
         self._gen_index_to_data()
 
     def _gen_index_to_data(self):
-        self.index_to_data = []
         label_balancer = RandomizedClassBalancer(self.pairwise_categories)
-        index_to_data_path = os.path.join(
+        index_to_data_path = get_index_to_data_path(
             self.data_split_folder,
-            f"pairwise_waypoint_spacing_{self.waypoint_spacing}_{self.min_dist_cat}_{self.max_dist_cat}_close_far_threshold_{self.close_far_threshold}_negative_mining_{int(self.negative_mining)}_context_size_{self.context_size}_end_slack_{self.end_slack}.pkl",
+            f"pairwise_waypoint_spacing_{self.waypoint_spacing}_{self.min_dist_cat}_{self.max_dist_cat}_close_far_threshold_{self.close_far_threshold}_negative_mining_{int(self.negative_mining)}_context_size_{self.context_size}_end_slack_{self.end_slack}",
+        )
+        self.index_to_data_path = index_to_data_path
+        sample_traj = partial(
+            sample_traj_pairs,
+            label_balancer=label_balancer,
+            waypoint_spacing=self.waypoint_spacing,
+            max_dist_cat=self.max_dist_cat,
+            context_size=self.context_size,
+            end_slack=self.end_slack,
         )
-        try:
-            with open(index_to_data_path, "rb") as f1:
-                self.index_to_data = pickle.load(f1)
-        except:
+        desc = f"{self.dataset_name} pairwise"
+        if os.path.exists(index_to_data_path) or convert_pickled_index_to_data(
+            index_to_data_path, PAIRWISE_INDEX_DTYPE
+        ):
+            # sample the trajectories added to the split since the index was saved and drop the removed ones
+            update_index_to_data(
+                index_to_data_path,
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                PAIRWISE_INDEX_DTYPE,
+                "far_traj",
+                self.index_workers,
+                desc,
+            )
+        else:
+            # if the index_to_data file doesn't exist, create it
             print(
                 f"Sampling subgoals for each observation in the {self.dataset_name} pairwise distance dataset..."
             )
             print(
                 "This will take a while, but it will only be done once for each configuration per dataset."
             )
-            for i in tqdm.tqdm(range(len(self.traj_names))):
-                f_close = self.traj_names[i]
-                with open(
-                    os.path.join(self.data_folder, f_close, "traj_data.pkl"), "rb"
-                ) as f3:
-                    close_traj_data = pickle.load(f3)
-                traj_len = len(close_traj_data["position"])
-                for curr_time in range(
-                    self.context_size * self.waypoint_spacing,
-                    traj_len - self.end_slack,
-                ):
-                    max_len = min(
-                        int(self.max_dist_cat * self.waypoint_spacing),
-                        traj_len - curr_time - 1,
-                    )
-                    filter_func = (
-                        lambda tup: max(tup) * self.waypoint_spacing <= max_len
-                    )
-                    choice = label_balancer.sample(filter_func)
-                    if choice is None:
-                        break
-                    close_len_to_goal, far_len_to_goal = choice
+            index_to_data = gen_index_to_data(
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                PAIRWISE_INDEX_DTYPE,
+                self.index_workers,
+                desc,
+            )
+            save_index_to_data(index_to_data_path, index_to_data, self.traj_names)
+        self.index_to_data, self.index_traj_names = load_index_to_data(
+            index_to_data_path
+        )
+
+    def _get_viz_key(self, f: str, time: int) -> torch.Tensor:
+        return torch.LongTensor(
+            [self.dataset_index, self.frame_loader.traj_indices[f], time]
+        )
 
-                    if far_len_to_goal == -1:  # negative mining
-                        new = np.random.randint(1, len(self.traj_names))
-                        f_rand = self.traj_names[(i + new) % len(self.traj_names)]
-                        with open(
-                            os.path.join(
-                                os.path.join(self.data_folder, f_rand), "traj_data.pkl"
-                            ),
-                            "rb",
-                        ) as f4:
-                            rand_traj_data = pickle.load(f4)
-                        rand_traj_len = len(rand_traj_data["position"])
-                        far_time = np.random.randint(rand_traj_len)
-                        f_far = f_rand
-                    else:
-                        far_time = curr_time + int(
-                            far_len_to_goal * self.waypoint_spacing
-                        )
-                        f_far = f_close
+    def get_eval_subset(self, subset_size: float, seed: int = 0) -> np.ndarray:
+        """
+        Get a fixed subset of the samples to evaluate on, stratified by the distance category of their far goal
+        (-1 for goals on another trajectory) and cached next to the index (see load_eval_subset)
 
-                    close_time = curr_time + int(
-                        close_len_to_goal * self.waypoint_spacing
-                    )
-                    assert (
-                        close_time < traj_len
-                    ), f"{curr_time}, {close_len_to_goal}, {traj_len}"
-                    if f_close != f_far:
-                        assert far_time < rand_traj_len, f"{far_time}, {rand_traj_len}"
-                    else:
-                        assert (
-                            far_time < traj_len
-                        ), f"{curr_time}, {far_len_to_goal}, {traj_len}"
-                    self.index_to_data += [
-                        (f_close, f_far, curr_time, close_time, far_time)
-                    ]
-            with open(index_to_data_path, "wb") as f2:
-                pickle.dump(self.index_to_data, f2)
+        Args:
+            subset_size (float): number of samples of the subset, or fraction of the samples if it is less than 1
+            seed (int): seed of the subset
+        Returns:
+            np.ndarray: sorted indices of the samples of the subset
+        """
+        return load_eval_subset(
+            self.index_to_data_path,
+            lambda: get_dist_labels(
+                self.index_to_data["curr_traj"],
+                self.index_to_data["far_traj"],
+                self.index_to_data["curr_time"],
+                self.index_to_data["far_time"],
+                self.waypoint_spacing,
+                -1,
+            ),
+            subset_size,
+            seed,
+        )
 
     def __len__(self) -> int:
         return len(self.index_to_data)
@@ -184,7 +245,7 @@ class PairwiseDistanceDataset(Dataset):
         Args:
             i (int): index to ith datapoint
         Returns:
-            obs_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the observation for visualization
+            obs_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the observation for visualization (visualization images are [dataset_index, traj_index, time] frame keys if viz_images is False)
             close_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the closer subgoal out of the 2 sampled for visualization
             far_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the farther subgoal out of the 2 sampled for visualization
             transf_obs_images (torch.Tensor): tensor of shape [(context_size) * 3, H, W] containing the images of the context and the observation after transformation for training
@@ -193,11 +254,14 @@ class PairwiseDistanceDataset(Dataset):
             close_dist_label (torch.Tensor): tensor of shape [1] containing the distance label of the closer subgoal
             far_dist_label (torch.Tensor): tensor of shape [1] containing the label for the farther subgoal
         """
-        f_close, f_far, curr_time, close_time, far_time = self.index_to_data[i]
+        close_traj, far_traj, curr_time, close_time, far_time = self.index_to_data[
+            i
+        ].tolist()
+        f_close = self.index_traj_names[close_traj]
+        f_far = self.index_traj_names[far_traj]
         assert curr_time <= close_time
         assert f_close != f_far or close_time < far_time
 
-        transf_obs_images = []
         context = []
         if self.context_type == "randomized":
             # sample self.context_size random times from interval [0, curr_time) with no replacement
@@ -207,9 +271,9 @@ class PairwiseDistanceDataset(Dataset):
             context_times.append(curr_time)
             context = [(f_close, t) for t in context_times]
         elif self.context_type == "randomized_temporal":
-            f_rand_close, _, rand_curr_time, _, _ = self.index_to_data[
-                np.random.randint(0, len(self))
-            ]
+            rand_data = self.index_to_data[np.random.randint(0, len(self))]
+            f_rand_close = self.index_traj_names[rand_data["curr_traj"]]
+            rand_curr_time = int(rand_data["curr_time"])
             context_times = list(
                 range(
                     rand_curr_time + -self.context_size * self.waypoint_spacing,
@@ -230,29 +294,19 @@ class PairwiseDistanceDataset(Dataset):
             context = [(f_close, t) for t in context_times]
         else:
             raise ValueError(f"Invalid type {self.context_type}")
-        for f, t in context:
-            obs_image_path = get_image_path(self.data_folder, f, t)
-            obs_image, transf_obs_image = img_path_to_data(
-                obs_image_path,
-                self.transform,
-                self.aspect_ratio,
-            )
-            transf_obs_images.append(transf_obs_image)
-        transf_obs_image = torch.cat(transf_obs_images, dim=0)
-
-        close_image_path = get_image_path(self.data_folder, f_close, close_time)
-        close_image, transf_close_image = img_path_to_data(
-            close_image_path,
-            self.transform,
-            self.aspect_ratio,
-        )
-
-        far_image_path = get_image_path(self.data_folder, f_far, far_time)
-        far_image, transf_far_image = img_path_to_data(
-            far_image_path,
-            self.transform,
-            self.aspect_ratio,
+        # load the context and both goals together so frames of the same trajectory are read at once
+        frame_data = self.frame_loader.load(
+            context + [(f_close, close_time), (f_far, far_time)]
         )
+        far_image, transf_far_image = frame_data.pop()
+        close_image, transf_close_image = frame_data.pop()
+        obs_image = frame_data[-1][0]
+        if not self.viz_images:
+            obs_image = self._get_viz_key(*context[-1])
+            close_image = self._get_viz_key(f_close, close_time)
+            far_image = self._get_viz_key(f_far, far_time)
+        transf_obs_images = [transf_obs_image for _, transf_obs_image in frame_data]
+        transf_obs_image = torch.cat(transf_obs_images, dim=0)
 
         close_dist_label = torch.FloatTensor(
             [(close_time - curr_time) / self.waypoint_spacing]
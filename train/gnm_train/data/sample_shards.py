@@ -0,0 +1,330 @@
+import copy
+import io
+import numpy as np
+import os
+import pickle
+import tarfile
+from typing import Dict, Iterator, List, Tuple
+import tqdm
+
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from gnm_train.data.data_utils import (
+    VISUALIZATION_IMAGE_SIZE,
+    get_image_path,
+    img_path_to_data,
+    packed_frame_to_data,
+)
+from gnm_train.data.frame_loader import FrameLoader
+
+SHARD_INDEX_FILE = "shard_index.pkl"
+SHARD_SAMPLES_FILE = "samples.pkl"
+
+
+def get_sample_shard_folder(dataset: Dataset) -> str:
+    # in the folder of the index the shards were written from, so every dataset configuration gets its own shards
+    return os.path.join(os.path.dirname(dataset.index_to_data_path), "shards")
+
+
+class FrameRecorder:
+    def __init__(self, frame_loader: FrameLoader) -> None:
+        """
+        Stands in for the FrameLoader of a dataset to record the frames __getitem__ loads, without decoding them
+
+        Args:
+            frame_loader (FrameLoader): frame loader of the dataset
+        """
+        self.frame_loader = frame_loader
+        self.frames = []
+        viz_img = None
+        if frame_loader.load_viz:
+            viz_img = torch.zeros(3, *VISUALIZATION_IMAGE_SIZE)
+        self.placeholder = (viz_img, frame_loader._probe_transform())
+
+    def load(
+        self, frames: List[Tuple[str, int]]
+    ) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        self.frames.extend(frames)
+        return [self.placeholder] * len(frames)
+
+    def __getattr__(self, name: str):
+        if name == "frame_loader":
+            raise AttributeError(name)
+        return getattr(self.frame_loader, name)
+
+
+class ShardFrameLoader:
+    def __init__(self, frame_loader: FrameLoader) -> None:
+        """
+        Stands in for the FrameLoader of a dataset to decode the frames of a sample from the bytes read out
+        of its shard, with the transform and the settings of frame_loader
+
+        Args:
+            frame_loader (FrameLoader): frame loader of the dataset
+        """
+        self.frame_loader = frame_loader
+        self.frames = {}
+
+    def load(
+        self, frames: List[Tuple[str, int]]
+    ) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        fl = self.frame_loader
+        unique_frames = list(dict.fromkeys(frames))
+        unique_data = {}
+        for frame in unique_frames:
+            ext, payload = self.frames[frame]
+            if ext == "npy":
+                unique_data[frame] = packed_frame_to_data(
+                    np.load(io.BytesIO(payload)), fl.transform, fl.load_viz
+                )
+            else:
+                unique_data[frame] = img_path_to_data(
+                    io.BytesIO(payload),
+                    fl.transform,
+                    fl.aspect_ratio,
+                    fl.load_viz,
+                    fl.draft_size,
+                )
+        return [unique_data[frame] for frame in frames]
+
+    def __getattr__(self, name: str):
+        if name == "frame_loader":
+            raise AttributeError(name)
+        return getattr(self.frame_loader, name)
+
+
+def read_frame(frame_loader: FrameLoader, f: str, t: int) -> Tuple[str, bytes]:
+    """
+    Read the encoded bytes of a frame the way frame_loader would find it (packed array or jpg)
+
+    Returns:
+        Tuple[str, bytes]: file extension ("npy" or "jpg") and contents of the frame
+    """
+    if frame_loader.packed_images is not None and f in frame_loader.packed_images:
+        buffer = io.BytesIO()
+        np.save(buffer, frame_loader.packed_images.get_frames(f, [t])[0])
+        return "npy", buffer.getvalue()
+    with open(get_image_path(frame_loader.data_folder, f, t), "rb") as img_file:
+        return "jpg", img_file.read()
+
+
+def write_shard(
+    path: str,
+    samples: List[Tuple[int, List[Tuple[str, int]]]],
+    frames: Dict[Tuple[str, int], Tuple[str, bytes]],
+) -> None:
+    def add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    with tarfile.open(path + ".tmp", "w") as tar:
+        # the sample list goes first so a reader knows the samples before their frames stream in
+        add_member(tar, SHARD_SAMPLES_FILE, pickle.dumps(samples))
+        for (f, t), (ext, payload) in frames.items():
+            add_member(tar, f"{f}/{t}.{ext}", payload)
+    os.replace(path + ".tmp", path)
+
+
+def read_shard(
+    path: str,
+) -> Tuple[List[Tuple[int, List[Tuple[str, int]]]], Dict[Tuple[str, int], Tuple[str, bytes]]]:
+    """
+    Read a shard written by write_sample_shards in one sequential pass
+
+    Returns:
+        Tuple: list of (dataset index, frames) of the samples and the (extension, bytes) of each frame
+    """
+    samples = None
+    frames = {}
+    with tarfile.open(path, "r|") as tar:
+        for member in tar:
+            data = tar.extractfile(member).read()
+            if member.name == SHARD_SAMPLES_FILE:
+                samples = pickle.loads(data)
+                continue
+            traj_name, file_name = member.name.rsplit("/", 1)
+            t, ext = file_name.split(".")
+            frames[(traj_name, int(t))] = (ext, data)
+    assert samples is not None, f"{path} has no {SHARD_SAMPLES_FILE}"
+    return samples, frames
+
+
+def write_sample_shards(
+    dataset: Dataset, output_folder: str, samples_per_shard: int = 500
+) -> int:
+    """
+    Write the frames of every sample of a dataset, in index order, into tar shards of samples_per_shard
+    samples each (output_folder/shard_{k}.tar), so ShardedDataset can stream the samples with sequential
+    reads instead of opening every jpg. Each shard holds the list of (index, frames) of its samples and the
+    encoded frames they load, stored once per shard. The labels are not stored: ShardedDataset gets them
+    from __getitem__ of the dataset, which slices them out of its label table.
+
+    Args:
+        dataset (Dataset): GNM_Dataset, JointGNM_Dataset, RLDataset or PairwiseDistanceDataset with temporal context
+        output_folder (str): Directory to write the shards and their index to
+        samples_per_shard (int): Number of samples per shard
+    Returns:
+        int: number of shards written
+    """
+    # the other context types sample the context at random in __getitem__, so it can't be written ahead of time
+    assert (
+        dataset.context_type == "temporal"
+    ), f"Only datasets with temporal context can be sharded, not {dataset.context_type}"
+    assert not getattr(
+        dataset, "online_goals", False
+    ), "Datasets that sample their goals when loading them can't be sharded"
+    os.makedirs(output_folder, exist_ok=True)
+    frame_loader = dataset.frame_loader
+    recorder = FrameRecorder(frame_loader)
+    shard_names = []
+    samples = []
+    frames = {}
+    dataset.frame_loader = recorder
+    try:
+        for i in tqdm.tqdm(range(len(dataset)), desc="Samples sharded"):
+            recorder.frames = []
+            dataset[i]
+            sample_frames = list(dict.fromkeys(recorder.frames))
+            for f, t in sample_frames:
+                if (f, t) not in frames:
+                    frames[(f, t)] = read_frame(frame_loader, f, t)
+            samples.append((i, sample_frames))
+            if len(samples) == samples_per_shard or i == len(dataset) - 1:
+                shard_name = f"shard_{len(shard_names):06d}.tar"
+                write_shard(os.path.join(output_folder, shard_name), samples, frames)
+                shard_names.append(shard_name)
+                samples = []
+                frames = {}
+    finally:
+        dataset.frame_loader = frame_loader
+
+    index_path = os.path.join(output_folder, SHARD_INDEX_FILE)
+    with open(index_path + ".tmp", "wb") as f:
+        pickle.dump({"num_samples": len(dataset), "shards": shard_names}, f)
+    os.replace(index_path + ".tmp", index_path)
+    return len(shard_names)
+
+
+class ShardedDataset(IterableDataset):
+    def __init__(
+        self,
+        datasets: List[Dataset],
+        shard_folders: List[str],
+        shuffle_buffer_size: int = 5000,
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        """
+        Streams the samples of datasets from the shards written by write_sample_shards. The shards of all
+        the datasets are shuffled together and split between the ranks and the DataLoader workers, every
+        worker reads its shards sequentially and shuffles their samples in a buffer of shuffle_buffer_size
+        samples. The samples are the same as the ones of the datasets' __getitem__.
+
+        The shard order is drawn from the torch seed of the DataLoader, so it changes every epoch and is
+        the same on every rank if torch is seeded the same way. Use at least num_workers * world_size
+        shards per dataset, workers without shards return no samples.
+
+        Args:
+            datasets (List[Dataset]): datasets the shards were written from
+            shard_folders (List[str]): shard folder of each dataset
+            shuffle_buffer_size (int): Number of samples each worker shuffles at once (0 or 1 disables shuffling)
+            rank (int): Rank of this process when training on several processes
+            world_size (int): Number of training processes
+        """
+        assert len(datasets) == len(shard_folders)
+        self.datasets = datasets
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.rank = rank
+        self.world_size = world_size
+        self.shards = []
+        self.shard_datasets = []
+        for j, (dataset, shard_folder) in enumerate(zip(datasets, shard_folders)):
+            with open(os.path.join(shard_folder, SHARD_INDEX_FILE), "rb") as f:
+                shard_index = pickle.load(f)
+            assert shard_index["num_samples"] == len(
+                dataset
+            ), f"{shard_folder} was written for {shard_index['num_samples']} samples, not {len(dataset)}. Delete it to rewrite the shards."
+            self.shards.extend(
+                (j, os.path.join(shard_folder, shard_name))
+                for shard_name in shard_index["shards"]
+            )
+            # a shallow copy shares the index and the trajectory metadata, only the frames come from the shards
+            shard_dataset = copy.copy(dataset)
+            shard_dataset.frame_loader = ShardFrameLoader(dataset.frame_loader)
+            self.shard_datasets.append(shard_dataset)
+
+    def __len__(self) -> int:
+        return sum(len(dataset) for dataset in self.datasets) // self.world_size
+
+    def _get_sample(self, record: Tuple[int, int, Dict]) -> Tuple[torch.Tensor]:
+        j, i, frames = record
+        dataset = self.shard_datasets[j]
+        dataset.frame_loader.frames = frames
+        return dataset[i]
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor]]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        else:
+            # the workers of a DataLoader iterator share its base seed
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            seed = worker_info.seed - worker_info.id
+        shard_order = np.random.default_rng(seed).permutation(len(self.shards))
+        shard_order = shard_order[
+            self.rank * num_workers + worker_id :: self.world_size * num_workers
+        ]
+        rng = np.random.default_rng([seed, self.rank, worker_id])
+
+        buffer = []
+        for k in shard_order:
+            j, shard_path = self.shards[k]
+            samples, frames = read_shard(shard_path)
+            for i, _ in samples:
+                record = (j, i, frames)
+                if self.shuffle_buffer_size <= 1:
+                    yield self._get_sample(record)
+                elif len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(record)
+                else:
+                    # replace a random sample of the full buffer with the new one
+                    b = rng.integers(len(buffer))
+                    yield self._get_sample(buffer[b])
+                    buffer[b] = record
+        rng.shuffle(buffer)
+        for record in buffer:
+            yield self._get_sample(record)
+
+
+def load_sharded_dataset(
+    datasets: List[Dataset],
+    samples_per_shard: int = 500,
+    shuffle_buffer_size: int = 5000,
+    rank: int = 0,
+    world_size: int = 1,
+) -> ShardedDataset:
+    """
+    Build a ShardedDataset over datasets, writing the shards of the datasets that don't have them yet or whose index changed since (see get_sample_shard_folder)
+    """
+    shard_folders = []
+    for dataset in datasets:
+        shard_folder = get_sample_shard_folder(dataset)
+        shard_index_path = os.path.join(shard_folder, SHARD_INDEX_FILE)
+        # the shards are written again when the index was updated after them (see update_index_to_data)
+        if not os.path.exists(shard_index_path) or os.path.getmtime(
+            shard_index_path
+        ) < os.path.getmtime(dataset.index_to_data_path):
+            print(
+                f"Writing the samples of the {dataset.dataset_name} dataset into shards in {shard_folder}..."
+            )
+            print(
+                "This will take a while, but it will only be done once for each configuration per dataset."
+            )
+            write_sample_shards(dataset, shard_folder, samples_per_shard)
+        shard_folders.append(shard_folder)
+    return ShardedDataset(
+        datasets, shard_folders, shuffle_buffer_size, rank, world_size
+    )
@@ -0,0 +1,94 @@
+import numpy as np
+from typing import Iterator, List
+
+from torch.utils.data import ConcatDataset, Dataset, Sampler
+
+
+def get_traj_ids(dataset: Dataset) -> np.ndarray:
+    """
+    Label every index of a dataset (or a ConcatDataset of them) with an id of the trajectory of its observation
+
+    Args:
+        dataset (Dataset): a dataset with an index_to_data with the trajectory id of the observation of each index in its "curr_traj" field
+    Returns:
+        np.ndarray: int64 array of length len(dataset) with one id per (dataset, trajectory)
+    """
+    datasets = dataset.datasets if isinstance(dataset, ConcatDataset) else [dataset]
+    traj_ids = [np.zeros(0, dtype=np.int64)]
+    num_trajs = 0
+    for d in datasets:
+        # the trajectory ids of each dataset are offset past the ones of the datasets before it
+        traj_ids.append(d.index_to_data["curr_traj"].astype(np.int64) + num_trajs)
+        num_trajs += len(d.index_traj_names)
+    return np.concatenate(traj_ids)
+
+
+class BlockShuffleSampler(Sampler):
+    def __init__(self, dataset: Dataset, block_size: int, seed: int = 0) -> None:
+        """
+        Shuffles blocks of up to block_size consecutive indices that share the trajectory of their observation
+        instead of single indices. A batch (which is loaded by a single DataLoader worker) then reads a few
+        trajectories at a time, so the trajectory data and frame caches keep hitting. The order of the blocks
+        and the order within each block are reshuffled every epoch. block_size trades randomness for locality:
+        block_size = 1 is a plain shuffle.
+
+        Args:
+            dataset (Dataset): a dataset with an index_to_data (or a ConcatDataset of them)
+            block_size (int): maximum number of indices per block
+            seed (int): seed of the shuffles, the shuffle of epoch e uses seed + e
+        """
+        assert block_size >= 1, "block_size must be at least 1"
+        self.block_size = block_size
+        self.seed = seed
+        self.epoch = 0
+        self.traj_ids = get_traj_ids(dataset)
+        self.blocks = self._gen_blocks()
+        self.last_locality = None
+
+    def _gen_blocks(self) -> List[np.ndarray]:
+        # split the indices into runs of the same trajectory, then split each run into blocks
+        run_starts = np.flatnonzero(np.diff(self.traj_ids)) + 1
+        runs = np.split(np.arange(len(self.traj_ids)), run_starts)
+        blocks = []
+        for run in runs:
+            for start in range(0, len(run), self.block_size):
+                blocks.append(run[start : start + self.block_size])
+        return blocks
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _get_order(self, epoch: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed + epoch)
+        order = [
+            rng.permutation(self.blocks[j]) for j in rng.permutation(len(self.blocks))
+        ]
+        return np.concatenate(order) if len(order) > 0 else np.zeros(0, dtype=np.int64)
+
+    def locality(self, order: np.ndarray) -> float:
+        """
+        Args:
+            order (np.ndarray): order of the indices
+        Returns:
+            float: fraction of consecutive indices in order that share a trajectory (about 0 for a plain shuffle)
+        """
+        if len(order) < 2:
+            return 1.0
+        traj_ids = self.traj_ids[order]
+        return float(np.mean(traj_ids[1:] == traj_ids[:-1]))
+
+    def __iter__(self) -> Iterator[int]:
+        order = self._get_order(self.epoch)
+        self.last_locality = self.locality(order)
+        # the train loops don't call set_epoch, so move on to the next shuffle by default
+        self.epoch += 1
+        return iter(order.tolist())
+
+    def __len__(self) -> int:
+        return len(self.traj_ids)
+
+    def __str__(self) -> str:
+        locality = self.last_locality
+        if locality is None:
+            locality = self.locality(self._get_order(self.epoch))
+        return f"BlockShuffleSampler(block_size={self.block_size}, blocks={len(self.blocks)}, trajectories={len(np.unique(self.traj_ids))}, locality={locality:.3f})"
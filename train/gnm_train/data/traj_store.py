@@ -0,0 +1,140 @@
+import numpy as np
+import os
+import pickle
+from typing import Dict, List, Optional, Tuple
+import tqdm
+
+TRAJ_STORE_POSES_FILE = "traj_poses.npy"
+TRAJ_STORE_OFFSETS_FILE = "traj_offsets.pkl"
+
+
+def get_traj_data_stat(data_folder: str, traj_name: str) -> Optional[Tuple[int, int]]:
+    # (modification time, size) of the traj_data.pkl of a trajectory, None if it has none
+    try:
+        stat = os.stat(os.path.join(data_folder, traj_name, "traj_data.pkl"))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TrajPoseStore:
+    def __init__(self, data_folder: str) -> None:
+        """
+        Read-only view of the consolidated pose store of a processed dataset. All the poses live in one
+        contiguous [N, 3] float64 array of (x, y, yaw) that is opened with np.memmap, so the DataLoader
+        workers share it through the page cache instead of each holding private unpickled copies.
+        Trajectories whose traj_data.pkl changed since the store was built (e.g. they were processed again)
+        are left out, so they are read from their traj_data.pkl until the store is rebuilt.
+
+        Args:
+            data_folder (str): Directory with all the trajectory folders and the store files
+        """
+        self.data_folder = data_folder
+        with open(os.path.join(data_folder, TRAJ_STORE_OFFSETS_FILE), "rb") as f:
+            store_index = pickle.load(f)
+        if "traj_data_stats" not in store_index:
+            # written before the stats of the traj_data.pkl files were recorded, none of it can be checked
+            store_index = {"offsets": {}, "traj_data_stats": {}}
+            print(
+                f"The pose store of {data_folder} is from an older version, rerun build_traj_store.py to use it"
+            )
+        self.offsets = {}
+        num_stale = 0
+        for traj_name, offsets in store_index["offsets"].items():
+            if (
+                get_traj_data_stat(data_folder, traj_name)
+                == store_index["traj_data_stats"][traj_name]
+            ):
+                self.offsets[traj_name] = offsets
+            else:
+                num_stale += 1
+        if num_stale > 0:
+            print(
+                f"{num_stale} trajectories of {data_folder} changed since its pose store was built, "
+                "reading them from their traj_data.pkl. Rerun build_traj_store.py to update the store"
+            )
+        self.poses = np.load(
+            os.path.join(data_folder, TRAJ_STORE_POSES_FILE), mmap_mode="r"
+        )
+
+    @staticmethod
+    def exists(data_folder: str) -> bool:
+        return os.path.exists(
+            os.path.join(data_folder, TRAJ_STORE_POSES_FILE)
+        ) and os.path.exists(os.path.join(data_folder, TRAJ_STORE_OFFSETS_FILE))
+
+    def __contains__(self, traj_name: str) -> bool:
+        return traj_name in self.offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, traj_name: str) -> Dict[str, np.ndarray]:
+        """
+        Get the trajectory metadata for traj_name in the same format as traj_data.pkl
+
+        Args:
+            traj_name (str): Name of the trajectory folder
+        Returns:
+            Dict[str, np.ndarray]: dictionary with read-only views of the "position" and "yaw" of the trajectory
+        """
+        start, end = self.offsets[traj_name]
+        traj_poses = self.poses[start:end]
+        return {"position": traj_poses[:, :2], "yaw": traj_poses[:, 2]}
+
+    def get_traj_len(self, traj_name: str) -> int:
+        start, end = self.offsets[traj_name]
+        return end - start
+
+
+def build_traj_store(
+    data_folder: str, traj_names: Optional[List[str]] = None
+) -> Tuple[int, int]:
+    """
+    Consolidate the traj_data.pkl files of a processed dataset into a single pose store
+
+    Args:
+        data_folder (str): Directory with all the trajectory folders
+        traj_names (List[str], optional): Trajectories to include. Defaults to every folder with a traj_data.pkl.
+    Returns:
+        Tuple[int, int]: number of trajectories and number of poses in the store
+    """
+    if traj_names is None:
+        traj_names = sorted(
+            f
+            for f in os.listdir(data_folder)
+            if os.path.isfile(os.path.join(data_folder, f, "traj_data.pkl"))
+        )
+    offsets = {}
+    traj_data_stats = {}
+    all_poses = []
+    num_poses = 0
+    for traj_name in tqdm.tqdm(traj_names, desc="Trajectories consolidated"):
+        # stat before reading, a traj_data.pkl rewritten in between then reads as changed
+        traj_data_stats[traj_name] = get_traj_data_stat(data_folder, traj_name)
+        with open(os.path.join(data_folder, traj_name, "traj_data.pkl"), "rb") as f:
+            traj_data = pickle.load(f)
+        position = np.asarray(traj_data["position"], dtype=np.float64)[:, :2]
+        yaw = np.asarray(traj_data["yaw"], dtype=np.float64).reshape(-1, 1)
+        assert len(position) == len(
+            yaw
+        ), f"{traj_name} has {len(position)} positions but {len(yaw)} yaws"
+        all_poses.append(np.concatenate((position, yaw), axis=1))
+        offsets[traj_name] = (num_poses, num_poses + len(position))
+        num_poses += len(position)
+    poses = (
+        np.concatenate(all_poses, axis=0)
+        if len(all_poses) > 0
+        else np.zeros((0, 3), dtype=np.float64)
+    )
+
+    # write to temporary files first so that readers never see a half written store
+    poses_path = os.path.join(data_folder, TRAJ_STORE_POSES_FILE)
+    offsets_path = os.path.join(data_folder, TRAJ_STORE_OFFSETS_FILE)
+    with open(poses_path + ".tmp", "wb") as f:
+        np.save(f, poses)
+    with open(offsets_path + ".tmp", "wb") as f:
+        pickle.dump({"offsets": offsets, "traj_data_stats": traj_data_stats}, f)
+    os.replace(poses_path + ".tmp", poses_path)
+    os.replace(offsets_path + ".tmp", offsets_path)
+    return len(offsets), num_poses
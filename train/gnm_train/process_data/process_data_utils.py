@@ -1,10 +1,14 @@
 import numpy as np
+import heapq
 import io
 import os
+import pickle
+import shutil
 import rosbag
+from collections import deque
 from PIL import Image
 import cv2
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional
 import torchvision.transforms.functional as TF
 
 IMAGE_SIZE = (160, 120)
@@ -96,31 +100,18 @@ def nav_to_xy_yaw(odom_msg, ang_offset: float) -> tuple[list[float], float]:
 #######################################################################
 
 
-def get_images_and_odom(
+def get_bag_topics(
     bag: rosbag.Bag,
     imtopics: list[str] or str,
     odomtopics: list[str] or str,
-    img_process_func: Any,
-    odom_process_func: Any,
-    rate: float = 4.0,
-    ang_offset: float = 0.0,
-):
+) -> tuple[Optional[str], Optional[str]]:
     """
-    Get image and odom data from a bag file
+    Get the image and odom topics of a bag: the topic if a single one is given, or the first one with messages
 
-    Args:
-        bag (rosbag.Bag): bag file
-        imtopics (list[str] or str): topic name(s) for image data
-        odomtopics (list[str] or str): topic name(s) for odom data
-        img_process_func (Any): function to process image data
-        odom_process_func (Any): function to process odom data
-        rate (float, optional): rate to sample data. Defaults to 4.0.
-        ang_offset (float, optional): angle offset to add to odom data. Defaults to 0.0.
     Returns:
-        img_data (list): list of PIL images
-        traj_data (list): list of odom data
+        imtopic (str): image topic (None if the bag has none of imtopics)
+        odomtopic (str): odom topic (None if the bag has none of odomtopics)
     """
-    # check if bag has both topics
     odomtopic = None
     imtopic = None
     if type(imtopics) == str:
@@ -137,31 +128,187 @@ def get_images_and_odom(
             if bag.get_message_count(ot) > 0:
                 odomtopic = ot
                 break
-    if not (imtopic and odomtopic):
-        # bag doesn't have both topics
-        return None, None
+    return imtopic, odomtopic
 
-    synced_imdata = []
-    synced_odomdata = []
-    # get start time of bag in seconds
-    currtime = bag.get_start_time()
-    starttime = currtime
+
+def sync_latest(
+    stream: Iterable[tuple[str, Any, float]],
+    imtopic: str,
+    odomtopic: str,
+    start_time: float,
+    rate: float = 4.0,
+) -> Iterator[tuple[Any, Any]]:
+    """
+    Keep the latest image and odom items of a time ordered stream and yield them every 1 / rate seconds
+
+    Args:
+        stream (Iterable): (topic, item, time in seconds) in the order of the bag
+        imtopic (str): topic name for image data
+        odomtopic (str): topic name for odom data
+        start_time (float): start time of the bag in seconds
+        rate (float, optional): rate to sample data. Defaults to 4.0.
+    Returns:
+        Iterator of (image item, odom item)
+    """
+    currtime = start_time
 
     curr_imdata = None
     curr_odomdata = None
-    times = []
 
-    for topic, msg, t in bag.read_messages(topics=[imtopic, odomtopic]):
+    for topic, item, t in stream:
         if topic == imtopic:
-            curr_imdata = msg
+            curr_imdata = item
         elif topic == odomtopic:
-            curr_odomdata = msg
-        if (t.to_sec() - currtime) >= 1.0 / rate:
+            curr_odomdata = item
+        if (t - currtime) >= 1.0 / rate:
             if curr_imdata is not None and curr_odomdata is not None:
-                synced_imdata.append(curr_imdata)
-                synced_odomdata.append(curr_odomdata)
-            currtime = t.to_sec()
-            times.append(currtime - starttime)
+                yield curr_imdata, curr_odomdata
+            currtime = t
+
+
+def get_synced_positions(
+    bag: rosbag.Bag,
+    imtopic: str,
+    odomtopic: str,
+    rate: float = 4.0,
+) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    """
+    Sync the image and odom topics like iter_synced_messages from the index of the bag alone, without reading any message.
+    The bag must be a version 2.0 bag.
+
+    Args:
+        bag (rosbag.Bag): bag file
+        imtopic (str): topic name for image data
+        odomtopic (str): topic name for odom data
+        rate (float, optional): rate to sample data. Defaults to 4.0.
+    Returns:
+        list of the (image message, odom message) positions in the bag, to read with bag._read_message
+    """
+    # rosbag has no public API for the index, these are the calls read_messages is built on. Merging the entries of
+    # each connection in connection order gives the order of read_messages, ties included, and tells their topic.
+    def iter_entries(connection) -> Iterator[tuple[str, tuple[int, int], float]]:
+        for entry in bag._get_entries([connection]):
+            yield connection.topic, (entry.chunk_pos, entry.offset), entry.time.to_sec()
+
+    entries = heapq.merge(
+        *[
+            iter_entries(connection)
+            for connection in bag._get_connections([imtopic, odomtopic])
+        ],
+        key=lambda x: x[2],
+    )
+    return list(
+        sync_latest(entries, imtopic, odomtopic, bag.get_start_time(), rate)
+    )
+
+
+def iter_synced_messages(
+    bag: rosbag.Bag,
+    imtopic: str,
+    odomtopic: str,
+    rate: float = 4.0,
+    selective_read: bool = True,
+) -> Iterator[tuple[Any, Any]]:
+    """
+    Yield the latest image and odom messages every 1 / rate seconds, without keeping the previous ones
+
+    Args:
+        bag (rosbag.Bag): bag file
+        imtopic (str): topic name for image data
+        odomtopic (str): topic name for odom data
+        rate (float, optional): rate to sample data. Defaults to 4.0.
+        selective_read (bool, optional): sync from the index of the bag first and only read and deserialize the
+            messages that are yielded, instead of every message of both topics. Only used for version 2.0 bags.
+            Defaults to True.
+    Returns:
+        Iterator of (image message, odom message)
+    """
+    # only the index entries of version 2.0 bags have the chunk position of their message, read older bags in full
+    if not selective_read or bag.version != 200:
+        messages = (
+            (topic, msg, t.to_sec())
+            for topic, msg, t in bag.read_messages(topics=[imtopic, odomtopic])
+        )
+        yield from sync_latest(
+            messages, imtopic, odomtopic, bag.get_start_time(), rate
+        )
+        return
+
+    # a message stays the latest one of its topic until a newer one comes, read it once
+    last_read = {}
+    for im_position, odom_position in get_synced_positions(
+        bag, imtopic, odomtopic, rate
+    ):
+        msgs = []
+        for topic, position in ((imtopic, im_position), (odomtopic, odom_position)):
+            if topic not in last_read or last_read[topic][0] != position:
+                last_read[topic] = (position, bag._read_message(position).message)
+            msgs.append(last_read[topic][1])
+        yield tuple(msgs)
+
+
+def iter_synced_frames(
+    bag: rosbag.Bag,
+    imtopic: str,
+    odomtopic: str,
+    odom_process_func: Any,
+    rate: float = 4.0,
+    ang_offset: float = 0.0,
+    selective_read: bool = True,
+) -> Iterator[tuple[Any, np.ndarray, float]]:
+    """
+    Yield the frames of iter_synced_messages with their odom processed like process_odom
+
+    Returns:
+        Iterator of (image message, position, yaw)
+    """
+    for imdata, odomdata in iter_synced_messages(
+        bag, imtopic, odomtopic, rate, selective_read
+    ):
+        xy, yaw = odom_process_func(odomdata, ang_offset)
+        yield imdata, np.asarray(xy), yaw
+
+
+def get_images_and_odom(
+    bag: rosbag.Bag,
+    imtopics: list[str] or str,
+    odomtopics: list[str] or str,
+    img_process_func: Any,
+    odom_process_func: Any,
+    rate: float = 4.0,
+    ang_offset: float = 0.0,
+    selective_read: bool = True,
+):
+    """
+    Get image and odom data from a bag file. This holds every image of the bag in memory, see
+    iter_synced_frames and filter_backwards_streaming to process a bag frame by frame instead.
+
+    Args:
+        bag (rosbag.Bag): bag file
+        imtopics (list[str] or str): topic name(s) for image data
+        odomtopics (list[str] or str): topic name(s) for odom data
+        img_process_func (Any): function to process image data
+        odom_process_func (Any): function to process odom data
+        rate (float, optional): rate to sample data. Defaults to 4.0.
+        ang_offset (float, optional): angle offset to add to odom data. Defaults to 0.0.
+        selective_read (bool, optional): only read the synced messages, see iter_synced_messages. Defaults to True.
+    Returns:
+        img_data (list): list of PIL images
+        traj_data (list): list of odom data
+    """
+    # check if bag has both topics
+    imtopic, odomtopic = get_bag_topics(bag, imtopics, odomtopics)
+    if not (imtopic and odomtopic):
+        # bag doesn't have both topics
+        return None, None
+
+    synced_imdata = []
+    synced_odomdata = []
+    for imdata, odomdata in iter_synced_messages(
+        bag, imtopic, odomtopic, rate, selective_read
+    ):
+        synced_imdata.append(imdata)
+        synced_odomdata.append(odomdata)
 
     img_data = process_images(synced_imdata, img_process_func)
     traj_data = process_odom(
@@ -239,6 +386,107 @@ def filter_backwards(
     return cut_trajs
 
 
+class SegmentWriter:
+    def __init__(self, output_dir: str, traj_name: str, img_process_func: Any) -> None:
+        """
+        Writes the forward segments found by filter_backwards_streaming into trajectory folders
+        {traj_name}_{i} of output_dir one frame at a time, in the same format as the cut trajectories of filter_backwards.
+        Only the poses of the open segment are kept in memory.
+
+        Args:
+            output_dir (str): path of the processed dataset
+            traj_name (str): name of the bag
+            img_process_func (Any): function converting the image messages of the written frames to PIL images
+        """
+        self.output_dir = output_dir
+        self.traj_name = traj_name
+        self.img_process_func = img_process_func
+        self.traj_names = []  # the segments written so far
+        self.traj_folder = None
+        self.poses = []
+
+    def start(self) -> None:
+        self.traj_folder = os.path.join(
+            self.output_dir, self.traj_name + f"_{len(self.traj_names)}"
+        )
+        # make a folder for the traj
+        if not os.path.exists(self.traj_folder):
+            os.makedirs(self.traj_folder)
+        self.poses = []
+
+    def add(self, img_msg: Any, pos: np.ndarray, yaw: float) -> None:
+        img = self.img_process_func(img_msg)
+        img.save(os.path.join(self.traj_folder, f"{len(self.poses)}.jpg"))
+        self.poses.append([*pos, yaw])
+
+    def end(self) -> None:
+        traj_data = np.array(self.poses)
+        with open(os.path.join(self.traj_folder, "traj_data.pkl"), "wb") as f:
+            pickle.dump({"position": traj_data[:, :2], "yaw": traj_data[:, 2]}, f)
+        self.traj_names.append(os.path.basename(self.traj_folder))
+        self.traj_folder = None
+
+    def discard(self) -> None:
+        # filter_backwards drops a segment that starts at the last frame it looks at
+        shutil.rmtree(self.traj_folder)
+        self.traj_folder = None
+
+
+def filter_backwards_streaming(
+    frames: Iterable[tuple[Any, np.ndarray, float]],
+    writer: SegmentWriter,
+    start_slack: int = 0,
+    end_slack: int = 0,
+) -> None:
+    """
+    Cut out non-positive velocity segments of a stream of frames, with the same cuts as filter_backwards, and
+    write the forward segments with writer as they are found. Only a window of end_slack + 3 frames is kept:
+    whether a frame ends the trajectory is only known once end_slack + 1 more frames have arrived.
+
+    Args:
+        frames (Iterable): (image message, position, yaw) of each synced frame
+        writer (SegmentWriter): writes the segments
+        start_slack (int): number of points to ignore at the start of the trajectory
+        end_slack (int): number of points to ignore at the end of the trajectory
+    """
+    window = deque()  # frames i - 1 to i + end_slack + 1 of the next step i to decide
+    i = max(start_slack, 1)
+    start = True
+
+    def process_step(is_last: bool) -> None:
+        nonlocal start
+        img_msg1, pos1, yaw1 = window[0]
+        _, pos2, _ = window[1]
+        if not is_backwards(pos1, yaw1, pos2):
+            if start:
+                writer.start()
+                writer.add(img_msg1, pos1, yaw1)
+                start = False
+            elif is_last:
+                writer.end()
+                start = True
+            else:
+                writer.add(img_msg1, pos1, yaw1)
+        elif not start:
+            writer.end()
+            start = True
+
+    num_frames = 0
+    for frame in frames:
+        num_frames += 1
+        if num_frames >= i:
+            window.append(frame)
+        # step i is not the last one once frame i + end_slack + 1 arrived
+        if num_frames == i + end_slack + 2:
+            process_step(is_last=False)
+            window.popleft()
+            i += 1
+    if i == num_frames - end_slack - 1:
+        process_step(is_last=True)
+    if not start:
+        writer.discard()
+
+
 def quat_to_yaw(
     x: np.ndarray,
     y: np.ndarray,
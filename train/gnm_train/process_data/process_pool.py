@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+from typing import Any, Callable, List, Sequence
+import tqdm
+
+# folder of the output dataset with a completion marker per processed input (bag or hdf5 file), it has no
+# traj_data.pkl so it isn't mistaken for a trajectory
+PROCESSED_MARKER_FOLDER = ".processed"
+
+
+def get_marker_path(output_dir: str, name: str) -> str:
+    return os.path.join(output_dir, PROCESSED_MARKER_FOLDER, f"{name}.done")
+
+
+def is_processed(output_dir: str, name: str) -> bool:
+    return os.path.exists(get_marker_path(output_dir, name))
+
+
+def mark_processed(output_dir: str, name: str, traj_names: Sequence[str]) -> None:
+    """
+    Write the completion marker of an input once all its trajectories are written, listing them
+
+    Args:
+        output_dir (str): path of the processed dataset
+        name (str): name of the input
+        traj_names (Sequence[str]): trajectories written from the input
+    """
+    marker_path = get_marker_path(output_dir, name)
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    with open(marker_path + ".tmp", "w") as f:
+        f.write("".join(f"{traj_name}\n" for traj_name in traj_names))
+    os.replace(marker_path + ".tmp", marker_path)
+
+
+def process_in_pool(
+    process_func: Callable[[Any], Any],
+    inputs: Sequence[Any],
+    num_workers: int,
+    desc: str,
+) -> List[Any]:
+    """
+    Run process_func on every input, in a pool of num_workers processes or in this process if num_workers is 0.
+    The inputs are independent, so the outputs are the same either way.
+
+    Args:
+        process_func (Callable): picklable function processing one input, such as a functools.partial of a module level function
+        inputs (Sequence): inputs to process
+        num_workers (int): number of processes (0 to process the inputs one at a time in this process)
+        desc (str): description of the progress bar
+    Returns:
+        List: results of process_func, in the order the inputs finished
+    """
+    if num_workers <= 0:
+        return [process_func(x) for x in tqdm.tqdm(inputs, desc=desc)]
+    with multiprocessing.Pool(num_workers) as pool:
+        # one input per task, a bag or an hdf5 file is already a lot of work
+        return list(
+            tqdm.tqdm(
+                pool.imap_unordered(process_func, inputs),
+                total=len(inputs),
+                desc=desc,
+            )
+        )
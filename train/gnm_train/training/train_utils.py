@@ -6,6 +6,9 @@ from typing import List, Optional, Dict
 from gnm_train.visualizing.action_utils import visualize_traj_pred
 from gnm_train.visualizing.distance_utils import visualize_dist_pred, visualize_dist_pairwise_pred
 from gnm_train.visualizing.visualize_utils import to_numpy
+from gnm_train.data.frame_loader import get_frame_caches, load_viz_images
+from gnm_train.data.joint_gnm_dataset import split_joint_batch
+from gnm_train.data.samplers import BlockShuffleSampler
 from gnm_train.training.logger import Logger
 
 import torch
@@ -15,6 +18,31 @@ from torch.utils.data import DataLoader
 from torch.optim import Adam
 
 
+def log_data_stats(loader_name: str, loader: DataLoader, use_wandb: bool) -> None:
+    """
+    Print (and log to wandb) the hit rate of the frame caches of the datasets of a loader over the last epoch, and the
+    locality of the order the loader's BlockShuffleSampler gave for the epoch (see BlockShuffleSampler.locality)
+
+    Args:
+        loader_name (str): name of the loader in the logs
+        loader (DataLoader): loader that was iterated over for the epoch (or a BatchTransformLoader)
+        use_wandb (bool): whether to log to wandb
+    """
+    sampler = getattr(getattr(loader, "loader", loader), "sampler", None)
+    if isinstance(sampler, BlockShuffleSampler) and sampler.last_locality is not None:
+        print(f"{loader_name} sampler locality: {sampler.last_locality:.3f}")
+        if use_wandb:
+            wandb.log({f"{loader_name}_sampler_locality": sampler.last_locality})
+    for dataset_name, frame_cache in get_frame_caches(loader.dataset).items():
+        # the counts are in shared memory, so they include the lookups of the workers
+        print(f"{loader_name} {dataset_name} {frame_cache}")
+        if use_wandb:
+            wandb.log(
+                {f"{loader_name}_{dataset_name}_frame_cache_hit_rate": frame_cache.hit_rate()}
+            )
+        frame_cache.reset_stats()
+
+
 def train_eval_loop(
     model: nn.Module,
     optimizer: Adam,
@@ -41,7 +69,7 @@ def train_eval_loop(
         model: model to train
         optimizer: optimizer to use
         train_dist_loader: dataloader for training distance predictions
-        train_action_loader: dataloader for training action predictions
+        train_action_loader: dataloader for training action predictions (None if train_dist_loader loads a JointGNM_Dataset)
         test_dataloaders: dict of dataloaders for testing
         epochs: number of epochs to train
         device: device to train on
@@ -79,6 +107,9 @@ def train_eval_loop(
             num_images_log,
             use_wandb,
         )
+        log_data_stats("train_dist", train_dist_loader, use_wandb)
+        if train_action_loader is not None:
+            log_data_stats("train_action", train_action_loader, use_wandb)
 
         eval_total_losses = []
         for dataset_type in test_dataloaders:
@@ -172,7 +203,7 @@ def train(
         model: model to train
         optimizer: optimizer to use
         train_dist_loader: dataloader for distance training
-        train_action_loader: dataloader for action training
+        train_action_loader: dataloader for action training (None if train_dist_loader loads a JointGNM_Dataset)
         device: device to use
         project_folder: folder to save images to
         epoch: current epoch
@@ -213,8 +244,15 @@ def train(
             [action_orien_cos_sim_logger, multi_action_orien_cos_sim_logger]
         )
 
-    num_batches = min(len(train_dist_loader), len(train_action_loader))
-    for i, val in enumerate(zip(train_dist_loader, train_action_loader)):
+    if train_action_loader is None:
+        # train_dist_loader loads a JointGNM_Dataset: each batch holds a distance and an action goal per observation
+        num_batches = len(train_dist_loader)
+        train_batches = (split_joint_batch(vals) for vals in train_dist_loader)
+        train_action_loader = train_dist_loader
+    else:
+        num_batches = min(len(train_dist_loader), len(train_action_loader))
+        train_batches = zip(train_dist_loader, train_action_loader)
+    for i, val in enumerate(train_batches):
         dist_vals, action_vals = val
         (
             dist_obs_image,
@@ -293,11 +331,23 @@ def train(
             print()
 
         if i % image_log_freq == 0:
+            dist_obs_image = load_viz_images(
+                train_dist_loader.dataset, dist_obs_image, num_images_log
+            )
+            dist_goal_image = load_viz_images(
+                train_dist_loader.dataset, dist_goal_image, num_images_log
+            )
+            action_obs_image = load_viz_images(
+                train_action_loader.dataset, action_obs_image, num_images_log
+            )
+            action_goal_image = load_viz_images(
+                train_action_loader.dataset, action_goal_image, num_images_log
+            )
             visualize_dist_pred(
                 to_numpy(dist_obs_image),
                 to_numpy(dist_goal_image),
-                to_numpy(dist_pred),
-                to_numpy(dist_label),
+                to_numpy(dist_pred[:num_images_log]),
+                to_numpy(dist_label[:num_images_log]),
                 "train",
                 project_folder,
                 epoch,
@@ -307,10 +357,10 @@ def train(
             visualize_traj_pred(
                 to_numpy(action_obs_image),
                 to_numpy(action_goal_image),
-                to_numpy(action_dataset_index),
-                to_numpy(action_goal_pos),
-                to_numpy(action_pred),
-                to_numpy(action_label),
+                to_numpy(action_dataset_index[:num_images_log]),
+                to_numpy(action_goal_pos[:num_images_log]),
+                to_numpy(action_pred[:num_images_log]),
+                to_numpy(action_label[:num_images_log]),
                 "train",
                 normalized,
                 project_folder,
@@ -460,11 +510,23 @@ def evaluate(
                 print()
 
             if i % image_log_freq == 0:
+                dist_obs_image = load_viz_images(
+                    eval_dist_loader.dataset, dist_obs_image, num_images_log
+                )
+                dist_goal_image = load_viz_images(
+                    eval_dist_loader.dataset, dist_goal_image, num_images_log
+                )
+                action_obs_image = load_viz_images(
+                    eval_action_loader.dataset, action_obs_image, num_images_log
+                )
+                action_goal_image = load_viz_images(
+                    eval_action_loader.dataset, action_goal_image, num_images_log
+                )
                 visualize_dist_pred(
                     to_numpy(dist_obs_image),
                     to_numpy(dist_goal_image),
-                    to_numpy(dist_pred),
-                    to_numpy(dist_label),
+                    to_numpy(dist_pred[:num_images_log]),
+                    to_numpy(dist_label[:num_images_log]),
                     eval_type,
                     project_folder,
                     epoch,
@@ -474,10 +536,10 @@ def evaluate(
                 visualize_traj_pred(
                     to_numpy(action_obs_image),
                     to_numpy(action_goal_image),
-                    to_numpy(action_dataset_index),
-                    to_numpy(action_goal_pos),
-                    to_numpy(action_pred),
-                    to_numpy(action_label),
+                    to_numpy(action_dataset_index[:num_images_log]),
+                    to_numpy(action_goal_pos[:num_images_log]),
+                    to_numpy(action_pred[:num_images_log]),
+                    to_numpy(action_label[:num_images_log]),
                     eval_type,
                     normalized,
                     project_folder,
@@ -560,14 +622,23 @@ def pairwise_acc(
                 print(f"({i}/{num_batches}) batch of points processed")
 
             if i % image_log_freq == 0:
+                obs_image = load_viz_images(
+                    eval_loader.dataset, obs_image, num_images_log
+                )
+                close_image = load_viz_images(
+                    eval_loader.dataset, close_image, num_images_log
+                )
+                far_image = load_viz_images(
+                    eval_loader.dataset, far_image, num_images_log
+                )
                 visualize_dist_pairwise_pred(
                     to_numpy(obs_image),
                     to_numpy(close_image),
                     to_numpy(far_image),
-                    to_numpy(close_pred),
-                    to_numpy(far_pred),
-                    to_numpy(close_dist_label),
-                    to_numpy(far_dist_label),
+                    to_numpy(close_pred[:num_images_log]),
+                    to_numpy(far_pred[:num_images_log]),
+                    to_numpy(close_dist_label[:num_images_log]),
+                    to_numpy(far_dist_label[:num_images_log]),
                     eval_type,
                     save_folder,
                     epoch,
@@ -0,0 +1,58 @@
+import argparse
+
+from gnm_train.data.image_shards import pack_images, get_packed_image_folder
+
+
+def main(args: argparse.Namespace):
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = get_packed_image_folder(args.data_dir, args.image_size)
+    traj_names = None
+    if args.traj_names_file is not None:
+        with open(args.traj_names_file, "r") as f:
+            traj_names = [line for line in f.read().split("\n") if line != ""]
+    aspect_ratio = args.image_size[0] / args.image_size[1]
+    num_trajs = pack_images(
+        args.data_dir, output_dir, args.image_size, aspect_ratio, traj_names
+    )
+    print(f"Packed {num_trajs} trajectories into {output_dir}")
+    print(f"Set packed_image_folder: {output_dir} in the dataset config to train on them")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack the frames of a processed dataset into pre-cropped, pre-resized uint8 arrays"
+    )
+    parser.add_argument(
+        "--data-dir",
+        "-i",
+        type=str,
+        help="path of the processed dataset (e.g. datasets/recon/)",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        default=None,
+        type=str,
+        help="path for the packed frames (default: {data-dir}/packed_{width}x{height})",
+    )
+    parser.add_argument(
+        "--image-size",
+        "-s",
+        default=[85, 64],
+        nargs=2,
+        type=int,
+        help="width and height of the packed frames, should match image_size in the training config (default: 85 64)",
+    )
+    parser.add_argument(
+        "--traj-names-file",
+        "-t",
+        default=None,
+        type=str,
+        help="only pack the trajectories listed in this file, e.g. a traj_names.txt (default: all)",
+    )
+    args = parser.parse_args()
+    print("STARTING PACKING IMAGES")
+    main(args)
+    print("FINISHED PACKING IMAGES")
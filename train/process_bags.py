@@ -1,3 +1,4 @@
+from functools import partial
 import h5py
 import os
 import pickle
@@ -7,9 +8,72 @@ import argparse
 import tqdm
 import yaml
 import rosbag
+from typing import Optional
 
 # utils
 from gnm_train.process_data.process_data_utils import *
+from gnm_train.process_data.process_pool import (
+    is_processed,
+    mark_processed,
+    process_in_pool,
+)
+
+
+def get_bag_traj_name(bag_path: str) -> str:
+    # name is that folders separated by _ and then the last part of the path
+    return "_".join(bag_path.split("/")[-2:])[:-4]
+
+
+def process_bag(
+    bag_path: str,
+    dataset_config: dict,
+    output_dir: str,
+    sample_rate: float,
+    selective_read: bool = True,
+) -> Optional[int]:
+    """
+    Process a bag into trajectory folders in output_dir and mark it as processed
+
+    Returns:
+        int: number of trajectories written (None if the bag couldn't be loaded)
+    """
+    try:
+        b = rosbag.Bag(bag_path)
+    except rosbag.ROSBagException as e:
+        print(e)
+        print(f"Error loading {bag_path}. Skipping...")
+        return None
+
+    traj_name = get_bag_traj_name(bag_path)
+
+    # check if bag has both topics
+    imtopic, odomtopic = get_bag_topics(
+        b, dataset_config["imtopics"], dataset_config["odomtopics"]
+    )
+    if not (imtopic and odomtopic):
+        print(
+            f"{bag_path} did not have the topics we were looking for. Skipping..."
+        )
+        mark_processed(output_dir, traj_name, [])
+        return 0
+    # read, sync, convert and write the frames one at a time, cutting out the backwards movement on the way
+    # (the same trajectories as get_images_and_odom and filter_backwards, without holding the bag in memory)
+    frames = iter_synced_frames(
+        b,
+        imtopic,
+        odomtopic,
+        eval(dataset_config["odom_process_func"]),
+        rate=sample_rate,
+        ang_offset=dataset_config["ang_offset"],
+        selective_read=selective_read,
+    )
+    writer = SegmentWriter(
+        output_dir, traj_name, eval(dataset_config["img_process_func"])
+    )
+    filter_backwards_streaming(frames, writer)
+    # the marker is written last, a bag interrupted before it is processed again from the start
+    mark_processed(output_dir, traj_name, writer.traj_names)
+    return len(writer.traj_names)
 
 
 def main(args: argparse.Namespace):
@@ -31,47 +95,33 @@ def main(args: argparse.Namespace):
     if args.num_trajs >= 0:
         bag_files = bag_files[: args.num_trajs]
 
+    # skip the bags that a previous run finished
+    num_bags = len(bag_files)
+    bag_files = [
+        bag_path
+        for bag_path in bag_files
+        if not is_processed(args.output_dir, get_bag_traj_name(bag_path))
+    ]
+    if len(bag_files) < num_bags:
+        print(f"Skipping {num_bags - len(bag_files)} bags that were already processed")
+
     # processing loop
-    for bag_path in tqdm.tqdm(bag_files, desc="Bags processed"):
-        try:
-            b = rosbag.Bag(bag_path)
-        except rosbag.ROSBagException as e:
-            print(e)
-            print(f"Error loading {bag_path}. Skipping...")
-            continue
-
-        # name is that folders separated by _ and then the last part of the path
-        traj_name = "_".join(bag_path.split("/")[-2:])[:-4]
-
-        # load the hdf5 file
-        bag_img_data, bag_traj_data = get_images_and_odom(
-            b,
-            config[args.dataset_name]["imtopics"],
-            config[args.dataset_name]["odomtopics"],
-            eval(config[args.dataset_name]["img_process_func"]),
-            eval(config[args.dataset_name]["odom_process_func"]),
-            rate=args.sample_rate,
-            ang_offset=config[args.dataset_name]["ang_offset"],
-        )
-        if bag_img_data is None or bag_traj_data is None:
-            print(
-                f"{bag_path} did not have the topics we were looking for. Skipping..."
-            )
-            continue
-        # remove backwards movement
-        cut_trajs = filter_backwards(bag_img_data, bag_traj_data)
-
-        for i, (img_data_i, traj_data_i) in enumerate(cut_trajs):
-            traj_name_i = traj_name + f"_{i}"
-            traj_folder_i = os.path.join(args.output_dir, traj_name_i)
-            # make a folder for the traj
-            if not os.path.exists(traj_folder_i):
-                os.makedirs(traj_folder_i)
-            with open(os.path.join(traj_folder_i, "traj_data.pkl"), "wb") as f:
-                pickle.dump(traj_data_i, f)
-            # save the image data to disk
-            for i, img in enumerate(img_data_i):
-                img.save(os.path.join(traj_folder_i, f"{i}.jpg"))
+    results = process_in_pool(
+        partial(
+            process_bag,
+            dataset_config=config[args.dataset_name],
+            output_dir=args.output_dir,
+            sample_rate=args.sample_rate,
+            selective_read=not args.read_all_messages,
+        ),
+        bag_files,
+        args.num_workers,
+        "Bags processed",
+    )
+    num_failed = sum(result is None for result in results)
+    print(
+        f"Processed {len(results) - num_failed} bags into {sum(result for result in results if result is not None)} trajectories ({num_failed} bags failed to load)"
+    )
 
 
 if __name__ == "__main__":
@@ -116,6 +166,19 @@ if __name__ == "__main__":
         type=float,
         help="sampling rate (default: 4.0 hz)",
     )
+    parser.add_argument(
+        "--num-workers",
+        "-w",
+        default=0,
+        type=int,
+        help="number of processes processing bags in parallel (default: 0, one bag at a time in this process)",
+    )
+    parser.add_argument(
+        "--read-all-messages",
+        "-a",
+        action="store_true",
+        help="read every image and odom message of the bags instead of syncing from the bag index and only reading the synced ones",
+    )
 
     args = parser.parse_args()
     # all caps for the dataset name
@@ -1,3 +1,4 @@
+from functools import partial
 import h5py
 import os
 import pickle
@@ -6,6 +7,77 @@ import io
 import argparse
 import tqdm
 
+from gnm_train.process_data.process_pool import (
+    is_processed,
+    mark_processed,
+    process_in_pool,
+)
+
+
+# rows of rgb_left read from the hdf5 file at once, rounded to whole chunks of the dataset
+IMAGE_READ_ROWS = 256
+# start of image marker of the jpeg format
+JPEG_SOI = b"\xff\xd8"
+
+
+def save_images(images: h5py.Dataset, traj_folder: str, reencode: bool = False) -> None:
+    """
+    Save the encoded images of an hdf5 dataset to traj_folder/{i}.jpg, reading the dataset a few chunks at a time.
+    Jpeg images are written as they are stored, without decoding and encoding them again.
+
+    Args:
+        images (h5py.Dataset): dataset of encoded images
+        traj_folder (str): trajectory folder to save the images in
+        reencode (bool, optional): decode every image and save it with PIL, even the jpeg ones. Defaults to False.
+    """
+    num_images = images.shape[0]
+    chunk_rows = images.chunks[0] if images.chunks is not None else 1
+    read_rows = max(IMAGE_READ_ROWS // chunk_rows, 1) * chunk_rows
+    for start in range(0, num_images, read_rows):
+        for i, blob in enumerate(images[start : start + read_rows], start=start):
+            blob = bytes(blob)
+            img_path = os.path.join(traj_folder, f"{i}.jpg")
+            if not reencode and blob[: len(JPEG_SOI)] == JPEG_SOI:
+                with open(img_path, "wb") as f:
+                    f.write(blob)
+            else:
+                img = Image.open(io.BytesIO(blob))
+                img.save(img_path)
+
+
+def process_traj(
+    filename: str, recon_dir: str, output_dir: str, reencode: bool = False
+) -> bool:
+    """
+    Process a recon hdf5 file into a trajectory folder in output_dir and mark it as processed
+
+    Returns:
+        bool: whether the file could be loaded
+    """
+    # extract the name without the extension
+    traj_name = filename.split(".")[0]
+    # load the hdf5 file
+    try:
+        h5_f = h5py.File(os.path.join(recon_dir, filename), "r")
+    except OSError:
+        print(f"Error loading {filename}. Skipping...")
+        return False
+    with h5_f:
+        # extract the position and yaw data
+        position_data = h5_f["jackal"]["position"][:, :2]
+        yaw_data = h5_f["jackal"]["yaw"][()]
+        # save the data to a dictionary
+        traj_data = {"position": position_data, "yaw": yaw_data}
+        traj_folder = os.path.join(output_dir, traj_name)
+        os.makedirs(traj_folder, exist_ok=True)
+        with open(os.path.join(traj_folder, "traj_data.pkl"), "wb") as f:
+            pickle.dump(traj_data, f)
+        # save the image data to disk
+        save_images(h5_f["images"]["rgb_left"], traj_folder, reencode)
+    # the marker is written last, a file interrupted before it is processed again from the start
+    mark_processed(output_dir, traj_name, [traj_name])
+    return True
+
 
 def main(args: argparse.Namespace):
     recon_dir = os.path.join(args.input_dir, "recon_release")
@@ -20,32 +92,33 @@ def main(args: argparse.Namespace):
     if args.num_trajs >= 0:
         filenames = filenames[: args.num_trajs]
 
+    # skip the files that a previous run finished
+    num_files = len(filenames)
+    filenames = [
+        filename
+        for filename in filenames
+        if not is_processed(output_dir, filename.split(".")[0])
+    ]
+    if len(filenames) < num_files:
+        print(
+            f"Skipping {num_files - len(filenames)} trajectories that were already processed"
+        )
+
     # processing loop
-    for filename in tqdm.tqdm(filenames, desc="Trajectories processed"):
-        # extract the name without the extension
-        traj_name = filename.split(".")[0]
-        # load the hdf5 file
-        try:
-            h5_f = h5py.File(os.path.join(recon_dir, filename), "r")
-        except OSError:
-            print(f"Error loading {filename}. Skipping...")
-            continue
-        # extract the position and yaw data
-        position_data = h5_f["jackal"]["position"][:, :2]
-        yaw_data = h5_f["jackal"]["yaw"][()]
-        # save the data to a dictionary
-        traj_data = {"position": position_data, "yaw": yaw_data}
-        traj_folder = os.path.join(output_dir, traj_name)
-        os.makedirs(traj_folder, exist_ok=True)
-        with open(os.path.join(traj_folder, "traj_data.pkl"), "wb") as f:
-            pickle.dump(traj_data, f)
-        # make a folder for the file
-        if not os.path.exists(traj_folder):
-            os.makedirs(traj_folder)
-        # save the image data to disk
-        for i in range(h5_f["images"]["rgb_left"].shape[0]):
-            img = Image.open(io.BytesIO(h5_f["images"]["rgb_left"][i]))
-            img.save(os.path.join(traj_folder, f"{i}.jpg"))
+    results = process_in_pool(
+        partial(
+            process_traj,
+            recon_dir=recon_dir,
+            output_dir=output_dir,
+            reencode=args.reencode,
+        ),
+        filenames,
+        args.num_workers,
+        "Trajectories processed",
+    )
+    print(
+        f"Processed {sum(results)} trajectories ({len(results) - sum(results)} failed to load)"
+    )
 
 
 if __name__ == "__main__":
@@ -73,6 +146,19 @@ if __name__ == "__main__":
         type=int,
         help="number of trajectories to process (default: -1, all)",
     )
+    parser.add_argument(
+        "--num-workers",
+        "-w",
+        default=0,
+        type=int,
+        help="number of processes processing hdf5 files in parallel (default: 0, one file at a time in this process)",
+    )
+    parser.add_argument(
+        "--reencode",
+        "-r",
+        action="store_true",
+        help="decode the images and save them with PIL instead of copying the stored jpeg bytes (default: copy)",
+    )
 
     args = parser.parse_args()
     print("STARTING PROCESSING RECON DATASET")
@@ -1,7 +1,7 @@
 import numpy as np
 import os
 from PIL import Image
-from typing import Any, Iterable
+from typing import Any, Iterable, Optional
 
 import torch
 from torchvision import transforms
@@ -20,38 +20,106 @@ class GeometricClassBalancer:
         # self.counts = {}
         # for c in classes:
         #     self.counts[c] = 0
-        self.classes = classes
+        self.classes = list(classes)
         self.discount = discount
+        # TODO (chongyiz): do we need to shift this geometric distribution one timestep into the future?
+        self.class_weights = self.discount ** np.asarray(self.classes, dtype=np.float64)
+
+    def sample_indices(
+        self, valid: np.ndarray, rng: Optional[np.random.RandomState] = None
+    ) -> np.ndarray:
+        """
+        Sample a class for each row of valid at once, with probabilities proportional to discount ** class among the valid classes of the row
+
+        Args:
+            valid (np.ndarray): bool array of shape [N, len(classes)], whether each sample can take each class
+            rng (np.random.RandomState, optional): Random state to sample with. Defaults to the global numpy random state.
+        Returns:
+            np.ndarray: int64 array of shape [N] with the index in classes of the class sampled for each row (-1 if the row has no valid class)
+        """
+        if rng is None:
+            rng = np.random
+        valid = np.asarray(valid, dtype=bool)
+        cdf = np.cumsum(valid * self.class_weights, axis=1)
+        total = cdf[:, -1] if cdf.shape[1] > 0 else np.zeros(len(valid))
+        thresholds = rng.random_sample(len(valid)) * total
+        choices = np.sum(cdf <= thresholds[:, None], axis=1).astype(np.int64)
+        choices[total <= 0] = -1  # no valid classes to sample
+        return choices
 
-    def sample(self, class_filter_func=None) -> Any:
+    def sample(
+        self, class_filter_func=None, rng: Optional[np.random.RandomState] = None
+    ) -> Any:
         """
         # Sample the softmax of the negative logits to prioritize classes that have been sampled less
 
         Args:
             class_filter_func (Callable, optional): A function that takes in a class and returns a boolean. Defaults to None.
+            rng (np.random.RandomState, optional): Random state to sample with. Defaults to the global numpy random state.
         """
         if class_filter_func is None:
-            valid_classes = self.classes
+            valid = np.ones(len(self.classes), dtype=bool)
         else:
             # keys = [k for k in self.counts.keys() if class_filter_func(k)]
-            valid_classes = [c for c in self.classes if class_filter_func(c)]
-        if len(valid_classes) == 0:
+            valid = np.array([bool(class_filter_func(c)) for c in self.classes])
+        class_index = self.sample_indices(valid[None], rng)[0]
+        if class_index < 0:
             return None  # no valid classes to sample
 
-        # TODO (chongyiz): do we need to shift this geometric distribution one timestep into the future?
-        probs = self.discount ** np.asarray(valid_classes)
-        probs = probs / np.sum(probs, keepdims=True)
-        class_choice = np.random.choice(valid_classes, p=probs)
-
         # values = [-(self.counts[k] - min(self.counts.values())) for k in keys]
         # p = F.softmax(torch.Tensor(values), dim=0).detach().cpu().numpy()
         # class_index = np.random.choice(list(range(len(keys))), p=p)
         # class_choice = keys[class_index]
         # self.counts[class_choice] += 1
-        return class_choice
+        return self.classes[class_index]
 
     def __str__(self) -> str:
         string = ""
         for c in self.counts:
             string += f"{c}: {self.counts[c]}\n"
         return string
+
+
+def compute_oracle_waypoints(
+    waypoints: torch.Tensor,
+    oracle_angles: float,
+    num_oracle_trajs: int,
+    learn_angle: bool,
+) -> torch.Tensor:
+    """
+    Construct oracle trajectories for a batch of action labels: straight lines with the path length of the
+    label, fanned out over headings spanning -oracle_angles to oracle_angles degrees
+
+    Args:
+        waypoints (torch.Tensor): action labels of shape [B, len_traj_pred, 2] or [B, len_traj_pred, 4] (if learning the angle)
+        oracle_angles (float): largest heading of the oracle trajectories in degrees
+        num_oracle_trajs (int): number of oracle trajectories per label
+        learn_angle (bool): whether the labels have the sin and cos of the yaw
+    Returns:
+        torch.Tensor: oracle waypoints of shape [B, num_oracle_trajs, len_traj_pred, 4] (cos and sin of the heading) or [B, num_oracle_trajs, len_traj_pred, 3] (heading)
+    """
+    len_traj_pred = waypoints.shape[1]
+    traj_len = torch.sum(
+        torch.linalg.norm(waypoints[:, 1:, :2] - waypoints[:, :-1, :2], dim=-1),
+        dim=-1,
+    )
+    angles = torch.linspace(
+        -np.deg2rad(oracle_angles), np.deg2rad(oracle_angles), num_oracle_trajs
+    ).to(waypoints.device)
+    headings = torch.stack([torch.cos(angles), torch.sin(angles)], dim=-1)
+    oracle_end_wpts = traj_len[:, None, None] * headings
+    oracle_waypoints = (
+        oracle_end_wpts[:, :, None]
+        * torch.linspace(0, 1, len_traj_pred).to(waypoints.device)[None, None, :, None]
+    )
+    first_waypoint_dist = torch.linalg.norm(waypoints[:, 0, :2], dim=-1)
+    oracle_waypoints += (first_waypoint_dist[:, None, None] * headings)[:, :, None]
+    if learn_angle:
+        angle_repr = headings[None, :, None].expand(
+            len(waypoints), num_oracle_trajs, len_traj_pred, 2
+        )
+    else:
+        angle_repr = angles[None, :, None, None].expand(
+            len(waypoints), num_oracle_trajs, len_traj_pred, 1
+        )
+    return torch.cat([oracle_waypoints, angle_repr], dim=-1)
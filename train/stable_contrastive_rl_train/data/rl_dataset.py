@@ -1,9 +1,9 @@
+from functools import partial
 import numpy as np
 import os
 import pickle
 import yaml
 from typing import Any, Dict, List, Optional, Tuple
-import tqdm
 
 import torch
 from torchvision import transforms
@@ -11,11 +11,28 @@ from torch.utils.data import Dataset
 import torchvision.transforms.functional as TF
 
 from gnm_train.data.data_utils import (
-    img_path_to_data,
-    calculate_sin_cos,
+    get_action_label_table,
+    get_dist_labels,
+    get_label_table_path,
+    load_label_table,
     RandomizedClassBalancer,
-    get_image_path,
-    to_local_coords,
+    split_action_labels,
+    TrajDataCache,
+)
+from gnm_train.data.frame_loader import FrameLoader
+from gnm_train.data.index_sampling import (
+    GOAL_INDEX_DTYPE,
+    OBS_INDEX_DTYPE,
+    convert_pickled_index_to_data,
+    gen_index_to_data,
+    get_index_to_data_path,
+    load_eval_subset,
+    load_index_to_data,
+    sample_online_goal,
+    sample_traj_goals,
+    sample_traj_obs,
+    save_index_to_data,
+    update_index_to_data,
 )
 
 from stable_contrastive_rl_train.data.data_utils import GeometricClassBalancer
@@ -37,13 +54,19 @@ class RLDataset(Dataset):
         discount: float,
         len_traj_pred: int,
         learn_angle: bool,
-        oracle_angles: float,
-        num_oracle_trajs: int,
         context_size: int,
         context_type: str = "temporal",
         end_slack: int = 0,
         goals_per_obs: int = 1,
         normalize: bool = True,
+        traj_cache_size: int = 64,
+        packed_image_folder: Optional[str] = None,
+        frame_cache_bytes: int = 0,
+        viz_images: bool = True,
+        decode_threads: int = 0,
+        jpeg_draft: bool = False,
+        index_workers: int = 0,
+        online_goals: bool = False,
     ):
         """
         Main GNM dataset class
@@ -64,6 +87,14 @@ class RLDataset(Dataset):
             end_slack (int): Number of timesteps to ignore at the end of the trajectory
             goals_per_obs (int): Number of goals to sample per observation
             normalize (bool): Whether to normalize the distances or actions
+            traj_cache_size (int): Number of trajectories whose traj_data.pkl is kept in memory by each worker
+            packed_image_folder (string): Directory with pre-cropped, pre-resized frames written by pack_images.py (optional)
+            frame_cache_bytes (int): Memory budget of the decoded frame cache of this dataset, shared by all the DataLoader workers (0 disables it)
+            viz_images (bool): Whether to load the visualization images. If False, samples hold [dataset_index, traj_index, time] frame keys in their place (see load_viz_images in frame_loader.py).
+            decode_threads (int): Number of threads each DataLoader worker uses to decode the frames of a sample concurrently (0 to decode them sequentially)
+            jpeg_draft (bool): Whether to decode the jpgs at a reduced 1/2, 1/4 or 1/8 scale that still covers the transformed image size
+            index_workers (int): Number of processes sampling the index of the dataset when it isn't cached yet (0 to sample it in this process)
+            online_goals (bool): Whether the index only holds observation slots and the goal of each sample is drawn when it is loaded, so every epoch sees new goals
         """
         self.data_folder = data_folder
         self.data_split_folder = data_split_folder
@@ -76,8 +107,22 @@ class RLDataset(Dataset):
         if "" in self.traj_names:
             self.traj_names.remove("")
 
+        self.traj_data_cache = TrajDataCache(data_folder, traj_cache_size)
+
         self.transform = transform
         self.aspect_ratio = aspect_ratio
+        self.viz_images = viz_images
+        self.frame_loader = FrameLoader(
+            data_folder,
+            transform,
+            aspect_ratio,
+            packed_image_folder,
+            self.traj_names,
+            frame_cache_bytes,
+            viz_images,
+            decode_threads,
+            jpeg_draft,
+        )
         self.waypoint_spacing = waypoint_spacing
         self.distance_categories = list(
             range(min_dist_cat, max_dist_cat + 1, self.waypoint_spacing)
@@ -90,8 +135,6 @@ class RLDataset(Dataset):
         self.discount = discount
         self.len_traj_pred = len_traj_pred
         self.learn_angle = learn_angle
-        self.oracle_angles = oracle_angles
-        self.num_oracle_trajs = num_oracle_trajs
 
         self.context_size = context_size
         assert context_type in {
@@ -117,30 +160,56 @@ class RLDataset(Dataset):
         # use this index to retrieve the dataset name from the data_config.yaml
         self.dataset_index = dataset_names.index(self.dataset_name)
         self.data_config = all_data_config[self.dataset_name]
-        self._gen_index_to_data()
+        self.index_workers = index_workers
 
-    def _gen_index_to_data(self) -> None:
-        """
-        Generates a list of tuples of (obs_traj_name, goal_traj_name, obs_time, goal_time) for each observation in the dataset
-        """
-
-        self.index_to_data = []
         # TODO (chongyiz): implementation geometric future relabeling here
         if self.discount >= 0:
             self.label_balancer = GeometricClassBalancer(self.distance_categories, self.discount)
         else:
             self.label_balancer = RandomizedClassBalancer(self.distance_categories)
+        self.online_goals = online_goals
+        if self.online_goals:
+            self._gen_obs_index()
+        else:
+            self._gen_index_to_data()
+            self._gen_label_table()
+
+    def _gen_index_to_data(self) -> None:
+        """
+        Generates a GOAL_INDEX_DTYPE array of (obs_traj, goal_traj, obs_time, goal_time) for each observation in the dataset, with trajectory ids into self.index_traj_names
+        """
 
         # dataset_type = "action" if self.is_action else "distance"
-        index_to_data_path = os.path.join(
+        index_to_data_path = get_index_to_data_path(
             self.data_split_folder,
-            f"rl_waypoint_spacing_{self.waypoint_spacing}_min_dist_cat_{self.min_dist_cat}_max_dist_cat_{self.max_dist_cat}_discount_{self.discount}_len_traj_pred_{self.len_traj_pred}_learn_angle_{self.learn_angle}_context_size_{self.context_size}_context_type_{self.context_type}_end_slack_{self.end_slack}_goals_per_obs_{self.goals_per_obs}.pkl",
+            f"rl_waypoint_spacing_{self.waypoint_spacing}_min_dist_cat_{self.min_dist_cat}_max_dist_cat_{self.max_dist_cat}_discount_{self.discount}_len_traj_pred_{self.len_traj_pred}_learn_angle_{self.learn_angle}_context_size_{self.context_size}_context_type_{self.context_type}_end_slack_{self.end_slack}_goals_per_obs_{self.goals_per_obs}",
+        )
+        self.index_to_data_path = index_to_data_path
+        sample_traj = partial(
+            sample_traj_goals,
+            label_balancer=self.label_balancer,
+            waypoint_spacing=self.waypoint_spacing,
+            max_dist_cat=self.max_dist_cat,
+            context_size=self.context_size,
+            end_slack=self.end_slack,
+            goals_per_obs=self.goals_per_obs,
         )
-        try:
-            # load the index_to_data if it already exists (to save time)
-            with open(index_to_data_path, "rb") as f1:
-                self.index_to_data = pickle.load(f1)
-        except:
+        desc = f"{self.dataset_name} rl"
+        if os.path.exists(index_to_data_path) or convert_pickled_index_to_data(
+            index_to_data_path, GOAL_INDEX_DTYPE
+        ):
+            # sample the trajectories added to the split since the index was saved and drop the removed ones
+            update_index_to_data(
+                index_to_data_path,
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                GOAL_INDEX_DTYPE,
+                "goal_traj",
+                self.index_workers,
+                desc,
+            )
+        else:
             # if the index_to_data file doesn't exist, create it
             print(
                 f"Sampling subgoals for each observation in the {self.dataset_name} rl dataset..."
@@ -148,61 +217,180 @@ class RLDataset(Dataset):
             print(
                 "This will take a while, but it will only be done once for each configuration per dataset."
             )
-            for i in tqdm.tqdm(range(len(self.traj_names))):
-                f_curr = self.traj_names[i]
-                with open(
-                    os.path.join(
-                        os.path.join(self.data_folder, f_curr), "traj_data.pkl"
-                    ),
-                    "rb",
-                ) as f3:
-                    traj_data = pickle.load(f3)
-                traj_len = len(traj_data["position"])
-                # start sampling a little bit into the trajectory to give enought time to generate context
-                for curr_time in range(
-                    self.context_size * self.waypoint_spacing,
-                    traj_len - self.end_slack,
-                ):
-                    max_len = min(
-                        int(self.max_dist_cat * self.waypoint_spacing),
-                        traj_len - curr_time - 1,
-                    )
-                    sampled_dists = []
-
-                    # sample self.goals_per_obs goals per observation
-                    for _ in range(self.goals_per_obs):
-                        # sample a distance from the distance categories as long as it is less than the trajectory length
-                        filter_func = (
-                            lambda dist: int(dist * self.waypoint_spacing) <= max_len
-                            and dist not in sampled_dists
-                        )
-                        len_to_goal = self.label_balancer.sample(filter_func)
-                        sampled_dists.append(len_to_goal)
-
-                        # break the loop if there are no more valid distances to sample
-                        if len_to_goal is None:
-                            break
-
-                        # if the length to the goal is negative, then we are using negative mining (sample an goal from another trajectory)
-                        if len_to_goal == -1:
-                            new = np.random.randint(1, len(self.traj_names))
-                            f_rand = self.traj_names[(i + new) % len(self.traj_names)]
-                            with open(
-                                os.path.join(self.data_folder, f_rand, "traj_data.pkl"),
-                                "rb",
-                            ) as f4:
-                                rand_traj_data = pickle.load(f4)
-                            rand_traj_len = len(rand_traj_data["position"])
-                            goal_time = np.random.randint(rand_traj_len)
-                            f_goal = f_rand
-                        else:
-                            goal_time = curr_time + int(
-                                len_to_goal * self.waypoint_spacing
-                            )
-                            f_goal = f_curr
-                        self.index_to_data += [(f_curr, f_goal, curr_time, goal_time)]
-            with open(index_to_data_path, "wb") as f2:
-                pickle.dump(self.index_to_data, f2)
+            index_to_data = gen_index_to_data(
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                GOAL_INDEX_DTYPE,
+                self.index_workers,
+                desc,
+            )
+            save_index_to_data(index_to_data_path, index_to_data, self.traj_names)
+        self.index_to_data, self.index_traj_names = load_index_to_data(
+            index_to_data_path
+        )
+
+    def _gen_obs_index(self) -> None:
+        """
+        Generates an OBS_INDEX_DTYPE array of (obs_traj, obs_time) observation slots for online_goals, with trajectory ids into self.index_traj_names
+        """
+        index_to_data_path = get_index_to_data_path(
+            self.data_split_folder,
+            f"rl_obs_waypoint_spacing_{self.waypoint_spacing}_min_dist_cat_{self.min_dist_cat}_max_dist_cat_{self.max_dist_cat}_context_size_{self.context_size}_end_slack_{self.end_slack}_goals_per_obs_{self.goals_per_obs}",
+        )
+        self.index_to_data_path = index_to_data_path
+        sample_traj = partial(
+            sample_traj_obs,
+            distance_categories=self.distance_categories,
+            waypoint_spacing=self.waypoint_spacing,
+            max_dist_cat=self.max_dist_cat,
+            context_size=self.context_size,
+            end_slack=self.end_slack,
+            goals_per_obs=self.goals_per_obs,
+        )
+        desc = f"{self.dataset_name} rl observation"
+        if os.path.exists(index_to_data_path):
+            update_index_to_data(
+                index_to_data_path,
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                OBS_INDEX_DTYPE,
+                None,
+                self.index_workers,
+                desc,
+            )
+        else:
+            # only the trajectory lengths are read, the goals are sampled in __getitem__
+            index_to_data = gen_index_to_data(
+                sample_traj,
+                self.data_folder,
+                self.traj_names,
+                OBS_INDEX_DTYPE,
+                self.index_workers,
+                desc,
+            )
+            save_index_to_data(index_to_data_path, index_to_data, self.traj_names)
+        self.index_to_data, self.index_traj_names = load_index_to_data(
+            index_to_data_path
+        )
+
+    def _sample_goal(self, curr_traj: int, curr_time: int) -> Tuple[int, int]:
+        """
+        Sample the goal of an observation slot for online_goals with the geometric or randomized label balancer (see sample_online_goal)
+
+        Returns:
+            Tuple[int, int]: trajectory id and time of the goal
+        """
+        return sample_online_goal(
+            self.label_balancer,
+            curr_traj,
+            curr_time,
+            self.traj_data_cache.get_traj_len(self.index_traj_names[curr_traj]),
+            len(self.index_traj_names),
+            lambda goal_traj: self.traj_data_cache.get_traj_len(
+                self.index_traj_names[goal_traj]
+            ),
+            self.waypoint_spacing,
+            self.max_dist_cat,
+        )
+
+    def _gen_label_table(self) -> None:
+        """
+        Loads the labels of every sample of index_to_data into self.label_table, computing them once per index
+        """
+        self.label_table = load_label_table(
+            get_label_table_path(self.index_to_data_path, self.normalize),
+            self.index_to_data_path,
+            self._compute_label_table,
+        )
+
+    def _compute_label_table(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float32 table with the goal and waypoint labels (see split_action_labels) followed by the distance label of each sample
+        """
+        return self._compute_labels(
+            self.index_to_data["curr_traj"],
+            self.index_to_data["goal_traj"],
+            self.index_to_data["curr_time"],
+            self.index_to_data["goal_time"],
+        )
+
+    def _compute_labels(
+        self,
+        curr_trajs: np.ndarray,
+        goal_trajs: np.ndarray,
+        curr_times: np.ndarray,
+        goal_times: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Args:
+            curr_trajs (np.ndarray): trajectory ids (into self.index_traj_names) of the observations
+            goal_trajs (np.ndarray): trajectory ids of the goals
+            curr_times (np.ndarray): times of the observations
+            goal_times (np.ndarray): times of the goals
+        Returns:
+            np.ndarray: float32 rows of the label table (see _compute_label_table) of the samples
+        """
+        # the rl index has no negative mining, the goals are on the trajectory of the observation
+        assert np.array_equal(curr_trajs, goal_trajs)
+        scale = 1.0
+        if self.normalize:
+            scale = self.data_config["metric_waypoint_spacing"] * self.waypoint_spacing
+        action_labels = get_action_label_table(
+            self.traj_data_cache,
+            self.index_traj_names,
+            curr_trajs,
+            curr_times,
+            goal_times,
+            self.len_traj_pred,
+            self.waypoint_spacing,
+            self.learn_angle,
+            scale,
+        )
+        dist_labels = get_dist_labels(
+            curr_trajs,
+            goal_trajs,
+            curr_times,
+            goal_times,
+            self.waypoint_spacing,
+            self.max_dist_cat,
+        )
+        return np.concatenate((action_labels, dist_labels[:, None]), axis=1)
+
+    def _get_viz_key(self, f: str, time: int) -> torch.Tensor:
+        return torch.LongTensor(
+            [self.dataset_index, self.frame_loader.traj_indices[f], time]
+        )
+
+    def get_eval_subset(self, subset_size: float, seed: int = 0) -> np.ndarray:
+        """
+        Get a fixed subset of the samples to evaluate on, stratified by the distance category of their goal
+        (-1 for goals on another trajectory) and cached next to the index (see load_eval_subset)
+
+        Args:
+            subset_size (float): number of samples of the subset, or fraction of the samples if it is less than 1
+            seed (int): seed of the subset
+        Returns:
+            np.ndarray: sorted indices of the samples of the subset
+        """
+        assert (
+            not self.online_goals
+        ), "The samples of a dataset with online goals have no fixed goal to evaluate on"
+        return load_eval_subset(
+            self.index_to_data_path,
+            lambda: get_dist_labels(
+                self.index_to_data["curr_traj"],
+                self.index_to_data["goal_traj"],
+                self.index_to_data["curr_time"],
+                self.index_to_data["goal_time"],
+                self.waypoint_spacing,
+                -1,
+            ),
+            subset_size,
+            seed,
+        )
 
     def __len__(self) -> int:
         return len(self.index_to_data)
@@ -213,53 +401,22 @@ class RLDataset(Dataset):
             i (int): index to ith datapoint
         Returns:
             Tuple of tensors containing the context, observation, goal, transformed context, transformed observation, transformed goal, distance label, and action label
-                obs_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the robot's observation for visualization
-                goal_image (torch.Tensor): tensor of shape [3, H, W] containing the subgoal image for visualization
+                obs_image (torch.Tensor): tensor of shape [3, H, W] containing the image of the robot's observation for visualization (or its frame key of shape (3,) if viz_images is False)
+                goal_image (torch.Tensor): tensor of shape [3, H, W] containing the subgoal image for visualization (or its frame key of shape (3,) if viz_images is False)
                 transf_obs_image (torch.Tensor): tensor of shape [(context_size + 1) * 3, H, W] containing the images of the context and the observation after transformation for training
                 transf_goal_image (torch.Tensor): tensor of shape [(context_size + 1) * 3, H, W] containing the images of the goals after transformation for training
                 dist_label (torch.Tensor): tensor of shape (1,) containing the distance labels from the observation to the goal
                 action_label (torch.Tensor): tensor of shape (5, 2) or (5, 4) (if training with angle) containing the action labels from the observation to the goal
                 dataset_index (torch.Tensor): index of the datapoint in the dataset [for identifying the dataset for visualization when using multiple datasets]
         """
-        f_curr, f_goal, curr_time, goal_time = self.index_to_data[i]
-        # f_curr, _, curr_time, _ = self.index_to_data[i]
-        # We need to resample goal for each data
-        with open(os.path.join(self.data_folder, f_curr, "traj_data.pkl"), "rb") as f:
-            curr_traj_data = pickle.load(f)
-        curr_traj_len = len(curr_traj_data["position"])
-        assert curr_time < curr_traj_len, f"{curr_time} and {curr_traj_len}"
-        #
-        # max_len = min(
-        #     int(self.max_dist_cat * self.waypoint_spacing),
-        #     curr_traj_len - curr_time - 1,
-        # )
-        #
-        # # sample a distance from the distance categories as long as it is less than the trajectory length
-        # filter_func = (
-        #     lambda dist: int(dist * self.waypoint_spacing) <= max_len
-        # )
-        # len_to_goal = self.label_balancer.sample(filter_func)
-        #
-        # # if the length to the goal is negative, then we are using negative mining (sample an goal from another trajectory)
-        # if len_to_goal == -1:
-        #     new = np.random.randint(1, len(self.traj_names))
-        #     f_rand = self.traj_names[(i + new) % len(self.traj_names)]
-        #     with open(
-        #             os.path.join(self.data_folder, f_rand, "traj_data.pkl"),
-        #             "rb",
-        #     ) as f4:
-        #         rand_traj_data = pickle.load(f4)
-        #     rand_traj_len = len(rand_traj_data["position"])
-        #     goal_time = np.random.randint(rand_traj_len)
-        #     f_goal = f_rand
-        # else:
-        #     goal_time = curr_time + int(
-        #         len_to_goal * self.waypoint_spacing
-        #     )
-        #     f_goal = f_curr
-
-        transf_obs_images = []
-        transf_next_obs_images = []
+        if self.online_goals:
+            curr_traj, curr_time = self.index_to_data[i].tolist()
+            goal_traj, goal_time = self._sample_goal(curr_traj, curr_time)
+        else:
+            curr_traj, goal_traj, curr_time, goal_time = self.index_to_data[i].tolist()
+        f_curr = self.index_traj_names[curr_traj]
+        f_goal = self.index_traj_names[goal_traj]
+
         if self.context_type == "randomized":
             # sample self.context_size random times from interval [0, curr_time) with no replacement
             context_times = np.random.choice(
@@ -270,9 +427,9 @@ class RLDataset(Dataset):
 
             # TODO (chongyiz): add next obs context
         elif self.context_type == "randomized_temporal":
-            f_rand_curr, _, rand_curr_time, _ = self.index_to_data[
-                np.random.randint(0, len(self))
-            ]
+            rand_data = self.index_to_data[np.random.randint(0, len(self))]
+            f_rand_curr = self.index_traj_names[rand_data["curr_traj"]]
+            rand_curr_time = int(rand_data["curr_time"])
             context_times = list(
                 range(
                     rand_curr_time + -self.context_size * self.waypoint_spacing,
@@ -297,37 +454,23 @@ class RLDataset(Dataset):
             next_context = [(f_curr, t + 1) for t in context_times]
         else:
             raise ValueError(f"Invalid type {self.context_type}")
-        for (f, t), (next_f, next_t) in zip(context, next_context):
-            obs_image_path = get_image_path(self.data_folder, f, t)
-            obs_image, transf_obs_image = img_path_to_data(
-                obs_image_path,
-                self.transform,
-                self.aspect_ratio,
-            )
-            transf_obs_images.append(transf_obs_image)
-
-            next_obs_image_path = get_image_path(self.data_folder, next_f, next_t)
-            next_obs_image, transf_next_obs_image = img_path_to_data(
-                next_obs_image_path,
-                self.transform,
-                self.aspect_ratio,
-            )
-            transf_next_obs_images.append(transf_next_obs_image)
+        # load the context, the next context and the goal together so frames of the same trajectory are read at once
+        # and the frames shared by the context and the next context are only decoded once
+        frame_data = self.frame_loader.load(context + next_context + [(f_goal, goal_time)])
+        goal_image, transf_goal_image = frame_data.pop()
+        obs_data, next_obs_data = frame_data[:len(context)], frame_data[len(context):]
+        obs_image = obs_data[-1][0]
+        next_obs_image = next_obs_data[-1][0]
+        if not self.viz_images:
+            obs_image = self._get_viz_key(*context[-1])
+            next_obs_image = self._get_viz_key(*next_context[-1])
+            goal_image = self._get_viz_key(f_goal, goal_time)
+        transf_obs_images = [transf_obs_image for _, transf_obs_image in obs_data]
+        transf_next_obs_images = [transf_next_obs_image for _, transf_next_obs_image in next_obs_data]
 
         transf_obs_image = torch.cat(transf_obs_images, dim=0)
         transf_next_obs_image = torch.cat(transf_next_obs_images, dim=0)
 
-        with open(os.path.join(self.data_folder, f_goal, "traj_data.pkl"), "rb") as f:
-            goal_traj_data = pickle.load(f)
-        goal_traj_len = len(goal_traj_data["position"])
-        assert goal_time < goal_traj_len, f"{goal_time} an {goal_traj_len}"
-        goal_image_path = get_image_path(self.data_folder, f_goal, goal_time)
-        goal_image, transf_goal_image = img_path_to_data(
-            goal_image_path,
-            self.transform,
-            self.aspect_ratio,
-        )
-
         data = [
             obs_image,
             next_obs_image,
@@ -337,53 +480,19 @@ class RLDataset(Dataset):
             transf_goal_image,
         ]
 
-        # waypoints
-        spacing = self.waypoint_spacing
-        traj_len = min(self.len_traj_pred, (goal_time - curr_time) // spacing)
-        pos_goal = goal_traj_data["position"][goal_time, :2]
-        pos_list = curr_traj_data["position"][
-            curr_time : curr_time + (traj_len + 1) * spacing : spacing,
-            :2,
-        ]
-        if self.learn_angle:
-            pos_goal = np.concatenate(
-                (
-                    pos_goal,
-                    np.array(goal_traj_data["yaw"][goal_time]).reshape(1),
-                ),
-                axis=0,
-            )
-            pos_list_angle = curr_traj_data["yaw"][
-                curr_time : curr_time + (traj_len + 1) * spacing : spacing
-            ]
-            pos_list = np.concatenate(
-                (pos_list, pos_list_angle.reshape(len(pos_list_angle), 1)),
-                axis=1,
-            )
-            param_dim = 3
+        if self.online_goals:
+            labels = self._compute_labels(
+                np.array([curr_traj]),
+                np.array([goal_traj]),
+                np.array([curr_time]),
+                np.array([goal_time]),
+            )[0]
         else:
-            param_dim = 2
-
-        goals_appendage = pos_goal * np.ones(
-            (self.len_traj_pred - traj_len, param_dim)
+            # the labels were computed for the whole index at once (see _compute_label_table)
+            labels = self.label_table[i]
+        goal, waypoints = split_action_labels(
+            labels[:-1], self.len_traj_pred, self.learn_angle
         )
-        pos_list = np.concatenate((pos_list, goals_appendage), axis=0)
-        pos_nplist = np.array(pos_list[1:])
-        yaw = curr_traj_data["yaw"][curr_time]
-        waypoints = to_local_coords(pos_nplist, pos_list[0], yaw)
-        waypoints = torch.Tensor(waypoints.astype(float))
-        goal = to_local_coords(pos_goal, pos_list[0], yaw)
-        goal = torch.Tensor(goal.astype(float))
-        if self.learn_angle:  # localize the waypoint angles
-            waypoints[1:, 2] -= waypoints[0, 2]
-            waypoints = calculate_sin_cos(waypoints)
-        if self.normalize:
-            waypoints[:, :2] /= (
-                self.data_config["metric_waypoint_spacing"] * self.waypoint_spacing
-            )  # only divide the dx and dy
-            goal[:2] /= (
-                self.data_config["metric_waypoint_spacing"] * self.waypoint_spacing
-            )
         data.extend(
             [
                 goal,
@@ -391,54 +500,8 @@ class RLDataset(Dataset):
             ]
         )
 
-        # TODO (chongyi): we get bugs here! Fix it.
-        # construct oracle actions spanning -oracle_angles to oracle_angles
-        traj_len = torch.sum(
-            torch.linalg.norm(waypoints[1:, :2] - waypoints[:-1, :2], dim=-1)
-        )
-        oracle_angles = torch.linspace(
-            -np.deg2rad(self.oracle_angles), np.deg2rad(self.oracle_angles),
-            self.num_oracle_trajs)
-        if traj_len > 0:
-            oracle_end_wpts = torch.stack([
-                traj_len * torch.cos(oracle_angles),
-                traj_len * torch.sin(oracle_angles),
-            ], dim=-1)
-        else:
-            oracle_end_wpts = torch.stack([
-                torch.zeros_like(oracle_angles),
-                torch.zeros_like(oracle_angles)
-            ], dim=-1)
-        oracle_waypoints = oracle_end_wpts[:, None] * \
-                           torch.linspace(0, 1, self.len_traj_pred)[None, :, None]
-        first_waypoint = waypoints[0]
-        first_waypoint_dist = torch.linalg.norm(first_waypoint[:2])
-        waypoint_offset = torch.stack([
-            first_waypoint_dist * torch.cos(oracle_angles),
-            first_waypoint_dist * torch.sin(oracle_angles),
-        ], dim=-1)
-        oracle_waypoints += waypoint_offset[:, None]
-        if self.learn_angle:
-            oracle_waypoints = torch.cat([
-                oracle_waypoints,
-                torch.cos(oracle_angles)[:, None, None].repeat_interleave(self.len_traj_pred, axis=1),
-                torch.sin(oracle_angles)[:, None, None].repeat_interleave(self.len_traj_pred, axis=1),
-            ], dim=-1)
-        else:
-            oracle_waypoints = torch.cat([
-                oracle_waypoints,
-                oracle_angles[:, None, None].repeat_interleave(self.len_traj_pred, dim=1),
-            ], dim=-1)
-        data.append(oracle_waypoints)
-
         # temporal distance
-        if f_curr == f_goal:
-            dist_label = torch.FloatTensor(
-                [(goal_time - curr_time) / self.waypoint_spacing]
-            )
-        else:  # negative mining
-            dist_label = torch.FloatTensor([self.max_dist_cat])
-        data.append(dist_label)
+        data.append(torch.from_numpy(np.array(labels[-1:])))
 
         data.append(torch.LongTensor([self.dataset_index]))
         return tuple(data)
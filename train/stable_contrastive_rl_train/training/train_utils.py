@@ -7,7 +7,10 @@ from gnm_train.visualizing.action_utils import visualize_traj_pred
 from gnm_train.visualizing.distance_utils import visualize_dist_pred, visualize_dist_pairwise_pred
 from gnm_train.visualizing.critic_utils import visualize_critic_pred
 from gnm_train.visualizing.visualize_utils import to_numpy
+from gnm_train.data.frame_loader import load_viz_images
 from gnm_train.training.logger import Logger
+from gnm_train.training.train_utils import log_data_stats
+from stable_contrastive_rl_train.data.data_utils import compute_oracle_waypoints
 
 import torch
 import torch.nn as nn
@@ -45,6 +48,8 @@ def train_eval_rl_loop(
     stop_grad_actor_img_encoder: bool = True,
     learn_angle: bool = True,
     use_wandb: bool = True,
+    oracle_angles: float = 45,
+    num_oracle_trajs: int = 10,
 ):
     """
     Train and evaluate the model for several epochs.
@@ -67,6 +72,8 @@ def train_eval_rl_loop(
         learn_angle: whether to learn the angle or not
         use_wandb: whether to log to wandb or not
         load_best: whether to load the best model or not
+        oracle_angles: largest heading of the oracle trajectories whose critic values are logged, in degrees
+        num_oracle_trajs: number of oracle trajectories per logged sample
     """
     assert 0 <= discount <= 1
     latest_path = os.path.join(project_folder, f"latest.pth")
@@ -94,7 +101,10 @@ def train_eval_rl_loop(
             image_log_freq,
             num_images_log,
             use_wandb,
+            oracle_angles,
+            num_oracle_trajs,
         )
+        log_data_stats("train_rl", train_rl_loader, use_wandb)
 
         # eval_total_losses = []
         eval_critic_losses, eval_actor_losses = [], []
@@ -120,6 +130,8 @@ def train_eval_rl_loop(
                 image_log_freq,
                 num_images_log,
                 use_wandb,
+                oracle_angles,
+                num_oracle_trajs,
             )
 
             # total_eval_loss = get_total_loss(test_dist_loss, test_action_loss, alpha)
@@ -192,6 +204,8 @@ def train(
     image_log_freq: int = 1000,
     num_images_log: int = 8,
     use_wandb: bool = True,
+    oracle_angles: float = 45,
+    num_oracle_trajs: int = 10,
 ):
     """
     Train the model for one epoch.
@@ -211,6 +225,8 @@ def train(
         image_log_freq: how often to log images
         num_images_log: number of images to log
         use_wandb: whether to use wandb
+        oracle_angles: largest heading of the oracle trajectories whose critic values are logged, in degrees
+        num_oracle_trajs: number of oracle trajectories per logged sample
     """
     model.train()
     critic_loss_logger = Logger("critic_loss", "train", window_size=print_log_freq)
@@ -275,7 +291,6 @@ def train(
             trans_goal_image,
             goal_pos,
             action_label,
-            oracle_action,
             dist_label,
             dataset_index,
         ) = vals
@@ -283,7 +298,6 @@ def train(
         next_obs_data = trans_next_obs_image.to(device)
         goal_data = trans_goal_image.to(device)
         action_label = action_label.to(device)
-        oracle_action = oracle_action[:num_images_log].to(device)
 
         dist_label = dist_label.to(device)
         action_data = torch.cat([
@@ -291,16 +305,6 @@ def train(
             dist_label
         ], dim=-1)
 
-        # save oracle data to cpu cause we use cpu to do inference here
-        oracle_obs_data = obs_data[:num_images_log, None].repeat_interleave(
-            oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-        oracle_goal_data = goal_data[:num_images_log, None].repeat_interleave(
-            oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-        oracle_action_data = torch.cat([
-            oracle_action.flatten(0, 1).flatten(-2, -1).cpu(),
-            dist_label[:num_images_log, None].repeat_interleave(oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-        ], dim=-1)
-
         # DEBUG: try to plot the distribution of waypoints and distances
         # import matplotlib.pyplot as plt
         #
@@ -471,11 +475,17 @@ def train(
             print()
 
         if i % image_log_freq == 0:
+            obs_image = load_viz_images(
+                train_rl_loader.dataset, obs_image, num_images_log
+            )
+            goal_image = load_viz_images(
+                train_rl_loader.dataset, goal_image, num_images_log
+            )
             visualize_dist_pred(
                 to_numpy(obs_image),
                 to_numpy(goal_image),
-                to_numpy(dist_pred),
-                to_numpy(dist_label),
+                to_numpy(dist_pred[:num_images_log]),
+                to_numpy(dist_label[:num_images_log]),
                 "train",
                 project_folder,
                 epoch,
@@ -498,7 +508,19 @@ def train(
             # )
 
             # TODO (chongyiz): move this code block above
-            # critic prediction for oracle actions
+            # critic prediction for oracle actions, only built for the logged samples
+            oracle_action = compute_oracle_waypoints(
+                action_label[:num_images_log], oracle_angles, num_oracle_trajs, learn_angle
+            )
+            # save oracle data to cpu cause we use cpu to do inference here
+            oracle_obs_data = obs_data[:num_images_log, None].repeat_interleave(
+                oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+            oracle_goal_data = goal_data[:num_images_log, None].repeat_interleave(
+                oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+            oracle_action_data = torch.cat([
+                oracle_action.flatten(0, 1).flatten(-2, -1).cpu(),
+                dist_label[:num_images_log, None].repeat_interleave(oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+            ], dim=-1)
             # we do inference on cpu cause the batch size is too large
             model.cpu()
             obs_a_repr, g_repr = model.q_network(
@@ -513,12 +535,12 @@ def train(
             visualize_critic_pred(
                 to_numpy(obs_image),
                 to_numpy(goal_image),
-                to_numpy(dataset_index),
-                to_numpy(goal_pos),
-                to_numpy(oracle_action),
-                to_numpy(oracle_critic),
-                to_numpy(action_pred),
-                to_numpy(action_label),
+                to_numpy(dataset_index[:num_images_log]),
+                to_numpy(goal_pos[:num_images_log]),
+                to_numpy(oracle_action[:num_images_log]),
+                to_numpy(oracle_critic[:num_images_log]),
+                to_numpy(action_pred[:num_images_log]),
+                to_numpy(action_label[:num_images_log]),
                 "train",
                 normalized,
                 project_folder,
@@ -546,6 +568,8 @@ def evaluate(
     image_log_freq: int = 1000,
     num_images_log: int = 8,
     use_wandb: bool = True,
+    oracle_angles: float = 45,
+    num_oracle_trajs: int = 10,
 ):
     """
     Evaluate the model on the given evaluation dataset.
@@ -564,6 +588,8 @@ def evaluate(
         image_log_freq (int): frequency of logging images
         num_images_log (int): number of images to log
         use_wandb (bool): whether to use wandb for logging
+        oracle_angles (float): largest heading of the oracle trajectories whose critic values are logged, in degrees
+        num_oracle_trajs (int): number of oracle trajectories per logged sample
     """
     model.eval()
     critic_loss_logger = Logger("critic_loss", eval_type, window_size=print_log_freq)
@@ -630,7 +656,6 @@ def evaluate(
                 trans_goal_image,
                 goal_pos,
                 action_label,
-                oracle_action,
                 dist_label,
                 dataset_index,
             ) = vals
@@ -638,7 +663,6 @@ def evaluate(
             next_obs_data = trans_next_obs_image.to(device)
             goal_data = trans_goal_image.to(device)
             action_label = action_label.to(device)
-            oracle_action = oracle_action[:num_images_log].to(device)
             dist_label = dist_label.to(device)
             action_data = torch.cat([
                 action_label.reshape([action_label.shape[0], -1]),
@@ -646,16 +670,6 @@ def evaluate(
                 dim=-1
             )
 
-            # save oracle data to cpu cause we use cpu to do inference here
-            oracle_obs_data = obs_data[:num_images_log, None].repeat_interleave(
-                oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-            oracle_goal_data = goal_data[:num_images_log, None].repeat_interleave(
-                oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-            oracle_action_data = torch.cat([
-                oracle_action.flatten(0, 1).flatten(-2, -1).cpu(),
-                dist_label[:num_images_log, None].repeat_interleave(oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
-            ], dim=-1)
-
             # dist_pred, _ = model(dist_obs_data, dist_goal_data)
             # dist_loss = F.mse_loss(dist_pred, dist_label)
             #
@@ -743,11 +757,17 @@ def evaluate(
                 print()
 
             if i % image_log_freq == 0:
+                obs_image = load_viz_images(
+                    eval_rl_loader.dataset, obs_image, num_images_log
+                )
+                goal_image = load_viz_images(
+                    eval_rl_loader.dataset, goal_image, num_images_log
+                )
                 visualize_dist_pred(
                     to_numpy(obs_image),
                     to_numpy(goal_image),
-                    to_numpy(dist_pred),
-                    to_numpy(dist_label),
+                    to_numpy(dist_pred[:num_images_log]),
+                    to_numpy(dist_label[:num_images_log]),
                     eval_type,
                     project_folder,
                     epoch,
@@ -769,7 +789,19 @@ def evaluate(
                 #     use_wandb=use_wandb,
                 # )
 
-                # critic prediction for oracle actions
+                # critic prediction for oracle actions, only built for the logged samples
+                oracle_action = compute_oracle_waypoints(
+                    action_label[:num_images_log], oracle_angles, num_oracle_trajs, learn_angle
+                )
+                # save oracle data to cpu cause we use cpu to do inference here
+                oracle_obs_data = obs_data[:num_images_log, None].repeat_interleave(
+                    oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+                oracle_goal_data = goal_data[:num_images_log, None].repeat_interleave(
+                    oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+                oracle_action_data = torch.cat([
+                    oracle_action.flatten(0, 1).flatten(-2, -1).cpu(),
+                    dist_label[:num_images_log, None].repeat_interleave(oracle_action.shape[1], dim=1).flatten(0, 1).cpu()
+                ], dim=-1)
                 # we do inference on cpu cause the batch size is too large
                 model.cpu()
                 obs_a_repr, g_repr = model.q_network(
@@ -785,12 +817,12 @@ def evaluate(
                 visualize_critic_pred(
                     to_numpy(obs_image),
                     to_numpy(goal_image),
-                    to_numpy(dataset_index),
-                    to_numpy(goal_pos),
-                    to_numpy(oracle_action),
-                    to_numpy(oracle_critic),
-                    to_numpy(action_pred),
-                    to_numpy(action_label),
+                    to_numpy(dataset_index[:num_images_log]),
+                    to_numpy(goal_pos[:num_images_log]),
+                    to_numpy(oracle_action[:num_images_log]),
+                    to_numpy(oracle_critic[:num_images_log]),
+                    to_numpy(action_pred[:num_images_log]),
+                    to_numpy(action_label[:num_images_log]),
                     eval_type,
                     normalized,
                     project_folder,
@@ -883,14 +915,23 @@ def pairwise_acc(
                 print(f"({i}/{num_batches}) batch of points processed")
 
             if i % image_log_freq == 0:
+                obs_image = load_viz_images(
+                    eval_loader.dataset, obs_image, num_images_log
+                )
+                close_image = load_viz_images(
+                    eval_loader.dataset, close_image, num_images_log
+                )
+                far_image = load_viz_images(
+                    eval_loader.dataset, far_image, num_images_log
+                )
                 visualize_dist_pairwise_pred(
                     to_numpy(obs_image),
                     to_numpy(close_image),
                     to_numpy(far_image),
-                    to_numpy(close_dist_pred),
-                    to_numpy(far_dist_pred),
-                    to_numpy(close_dist_label),
-                    to_numpy(far_dist_label),
+                    to_numpy(close_dist_pred[:num_images_log]),
+                    to_numpy(far_dist_pred[:num_images_log]),
+                    to_numpy(close_dist_label[:num_images_log]),
+                    to_numpy(far_dist_label[:num_images_log]),
                     eval_type,
                     save_folder,
                     epoch,
@@ -0,0 +1,40 @@
+import argparse
+import os
+import shutil
+
+import pytest
+
+import gen_synthetic_dataset
+
+NUM_TRAJS = 10
+
+
+@pytest.fixture(scope="session")
+def synthetic_data_folder(tmp_path_factory) -> str:
+    # a small synthetic dataset, generated once for the whole session
+    output_dir = str(tmp_path_factory.mktemp("synthetic"))
+    gen_synthetic_dataset.main(
+        argparse.Namespace(
+            output_dir=output_dir,
+            splits_dir=None,
+            num_trajs=NUM_TRAJS,
+            min_traj_len=30,
+            max_traj_len=40,
+            image_size=[32, 24],
+            jpeg_quality=75,
+            spacing=0.25,
+            split=1.0,
+            seed=0,
+        )
+    )
+    return output_dir
+
+
+@pytest.fixture
+def split_folder(synthetic_data_folder, tmp_path) -> str:
+    # a fresh copy of the train split for every test, the datasets write their indices next to traj_names.txt
+    split_folder = str(tmp_path / "train")
+    shutil.copytree(
+        os.path.join(synthetic_data_folder, "data_splits", "train"), split_folder
+    )
+    return split_folder
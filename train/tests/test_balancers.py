@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+
+from gnm_train.data.data_utils import RandomizedClassBalancer
+
+NUM_CLASSES = 22
+NEVER_VALID = 20
+
+
+def make_valid(num_rows: int, seed: int) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    valid = rng.random_sample((num_rows, NUM_CLASSES)) < 0.7
+    valid[:, NEVER_VALID] = False
+    valid[::97] = False  # some rows without any valid class
+    return valid
+
+
+def softmax_choices(valid: np.ndarray, seed: int) -> np.ndarray:
+    # the per-sample balancer before sample_indices: softmax of the negative counts over the valid classes,
+    # drawn like np.random.choice from the same uniforms
+    uniforms = np.random.RandomState(seed).random_sample(len(valid))
+    counts = np.zeros(NUM_CLASSES, dtype=np.int64)
+    choices = np.full(len(valid), -1, dtype=np.int64)
+    for i, row in enumerate(valid):
+        valid_classes = np.flatnonzero(row)
+        if len(valid_classes) == 0:
+            continue
+        logits = torch.tensor(-(counts[valid_classes] - counts.min()), dtype=torch.float64)
+        cdf = np.cumsum(torch.softmax(logits, dim=0).numpy())
+        cdf /= cdf[-1]
+        choices[i] = valid_classes[np.searchsorted(cdf, uniforms[i], side="right")]
+        counts[choices[i]] += 1
+    return choices
+
+
+def test_sample_indices_matches_softmax_with_never_valid_class():
+    valid = make_valid(30000, seed=0)
+    balancer = RandomizedClassBalancer(range(NUM_CLASSES))
+    choices = balancer.sample_indices(valid, np.random.RandomState(1))
+    expected = softmax_choices(valid, seed=1)
+    assert np.all(choices[~valid.any(axis=1)] == -1)
+    assert np.all(valid[choices >= 0, choices[choices >= 0]])
+    assert np.mean(choices == expected) > 0.999
+    assert np.array_equal(balancer.counts, np.bincount(choices[choices >= 0], minlength=NUM_CLASSES))
+    assert balancer.counts[NEVER_VALID] == 0
+
+
+def test_sample_indices_matches_sequential_sample():
+    valid = make_valid(2000, seed=2)
+    bulk = RandomizedClassBalancer(range(NUM_CLASSES))
+    choices = bulk.sample_indices(valid, np.random.RandomState(3))
+    sequential = RandomizedClassBalancer(range(NUM_CLASSES))
+    rng = np.random.RandomState(3)
+    for row, class_index in zip(valid, choices):
+        sampled = sequential.sample(lambda c: row[c], rng)
+        assert sampled == (None if class_index < 0 else class_index)
+    assert np.array_equal(bulk.counts, sequential.counts)
@@ -0,0 +1,84 @@
+import torch
+
+from gnm_train.data.frame_cache import SharedFrameCache
+
+
+def frame(value: float):
+    return torch.full((3, 2, 2), value), torch.full((3, 2, 2), value)
+
+
+def test_get_returns_put_frame():
+    cache = SharedFrameCache(2**16, (3, 2, 2), torch.float32, viz_shape=(3, 2, 2))
+    assert cache.get(1, 5) is None
+    cache.put(1, 5, *frame(1.0))
+    viz_img, transf_img = cache.get(1, 5)
+    assert (viz_img == 1.0).all() and (transf_img == 1.0).all()
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.reset_stats()
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+class RewriteOnRead:
+    # stands in for the transformed images of the cache: reading a slot first writes another frame to it and then
+    # the same key again with new values, as two workers re-inserting a hot frame while the reader is copying it
+    def __init__(self, cache: SharedFrameCache, key: tuple, other_key: tuple) -> None:
+        self.cache = cache
+        self.images = cache.transf_images
+        self.keys = [key, other_key]
+
+    def __getitem__(self, slot):
+        self.cache.transf_images = self.images
+        key, other_key = self.keys
+        self.cache.put(*other_key, *frame(2.0))
+        self.cache.put(*key, *frame(3.0))
+        return self.images[slot]
+
+
+def test_get_misses_a_slot_rewritten_with_the_same_key():
+    cache = SharedFrameCache(2**16, (3, 2, 2), torch.float32, viz_shape=(3, 2, 2))
+    key = (1, 5)
+    # a different key in the same slot
+    other_key = next(
+        (traj_index, 5)
+        for traj_index in range(2, 10**6)
+        if cache._slot(traj_index, 5)[1] == cache._slot(*key)[1]
+    )
+    cache.put(*key, *frame(1.0))
+    cache.transf_images = RewriteOnRead(cache, key, other_key)
+    # the visualization image is copied before the rewrite and the transformed one after it
+    assert cache.get(*key) is None
+    viz_img, transf_img = cache.get(*key)
+    assert (viz_img == 3.0).all() and (transf_img == 3.0).all()
+
+
+def test_log_data_stats_counts_worker_lookups(synthetic_data_folder, split_folder, capsys):
+    from torch.utils.data import DataLoader, Subset
+    from torchvision import transforms
+
+    from gnm_train.data.gnm_dataset import GNM_Dataset
+    from gnm_train.training.train_utils import log_data_stats
+
+    dataset = GNM_Dataset(
+        data_folder=synthetic_data_folder,
+        data_split_folder=split_folder,
+        dataset_name="recon",  # the synthetic trajectories have recon's waypoint spacing
+        is_action=False,
+        transform=transforms.Compose([transforms.ToTensor(), transforms.Resize((24, 32))]),
+        aspect_ratio=4 / 3,
+        waypoint_spacing=1,
+        min_dist_cat=0,
+        max_dist_cat=10,
+        negative_mining=True,
+        len_traj_pred=5,
+        learn_angle=True,
+        context_size=2,
+        frame_cache_bytes=2**22,
+    )
+    frame_cache = dataset.frame_loader.frame_cache
+    loader = DataLoader(Subset(dataset, range(16)), batch_size=4, num_workers=2)
+    for _ in loader:
+        pass
+    assert frame_cache.hits + frame_cache.misses > 0
+    log_data_stats("train_dist", loader, use_wandb=False)
+    assert "train_dist recon SharedFrameCache" in capsys.readouterr().out
+    assert frame_cache.hits + frame_cache.misses == 0
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gnm_train.data.image_shards import PackedImages, pack_images
+
+IMAGE_SIZE = (16, 12)
+
+
+@pytest.fixture
+def packed_image_folder(synthetic_data_folder, tmp_path) -> str:
+    packed_image_folder = str(tmp_path / "packed")
+    pack_images(synthetic_data_folder, packed_image_folder, IMAGE_SIZE, 4 / 3)
+    return packed_image_folder
+
+
+def num_open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_packed_images_bounds_open_arrays(packed_image_folder):
+    packed_images = PackedImages(packed_image_folder, max_open_arrays=3)
+    traj_names = sorted(packed_images.num_frames)
+    num_fds = num_open_fds()
+    for _ in range(2):
+        for traj_name in traj_names:
+            frames = packed_images.get_frames(traj_name, [0, 2])
+            expected = np.load(os.path.join(packed_image_folder, f"{traj_name}.npy"))
+            assert (frames == expected[[0, 2]]).all()
+            assert num_open_fds() <= num_fds + 3
+    assert len(packed_images.arrays) == 3
+
+
+def test_pack_images_resumes_without_frame_index(
+    synthetic_data_folder, packed_image_folder, monkeypatch
+):
+    index_path = os.path.join(packed_image_folder, "frame_index.pkl")
+    packed_images = PackedImages(packed_image_folder)
+    # an interrupted run has its arrays written but not the frame index
+    os.remove(index_path)
+    os.remove(os.path.join(packed_image_folder, "synthetic_4.npy"))
+
+    packed = []
+    monkeypatch.setattr(
+        "gnm_train.data.image_shards.crop_and_resize",
+        lambda img, *args: packed.append(1) or img.resize(IMAGE_SIZE),
+    )
+    pack_images(synthetic_data_folder, packed_image_folder, IMAGE_SIZE, 4 / 3)
+    assert len(packed) == packed_images.num_frames["synthetic_4"]
+    assert PackedImages(packed_image_folder).num_frames == packed_images.num_frames
+
+
+def test_packed_images_skip_rewritten_jpgs(synthetic_data_folder, tmp_path):
+    data_folder = str(tmp_path / "data")
+    shutil.copytree(synthetic_data_folder, data_folder)
+    packed_image_folder = str(tmp_path / "packed")
+    pack_images(data_folder, packed_image_folder, IMAGE_SIZE, 4 / 3)
+    # a frame is rewritten after the trajectory was packed
+    img_path = os.path.join(data_folder, "synthetic_4", "2.jpg")
+    Image.new("RGB", (32, 24), (255, 0, 0)).save(img_path)
+    stat = os.stat(img_path)
+    os.utime(img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    packed_images = PackedImages(packed_image_folder, data_folder=data_folder)
+    assert "synthetic_4" not in packed_images
+    assert "synthetic_3" in packed_images
+    assert "synthetic_4" in PackedImages(packed_image_folder)
+
+    pack_images(data_folder, packed_image_folder, IMAGE_SIZE, 4 / 3)
+    packed_images = PackedImages(packed_image_folder, data_folder=data_folder)
+    assert "synthetic_4" in packed_images
+    frame = packed_images.get_frames("synthetic_4", [2])[0]
+    assert (frame[..., 0] > 200).all() and (frame[..., 1:] < 50).all()
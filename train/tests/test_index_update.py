@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+from torchvision import transforms
+
+from gnm_train.data.gnm_dataset import GNM_Dataset
+from stable_contrastive_rl_train.data.rl_dataset import RLDataset
+
+
+def make_dataset(dataset_class, data_folder: str, split_folder: str, **kwargs):
+    kwargs.update(
+        data_folder=data_folder,
+        data_split_folder=split_folder,
+        dataset_name="recon",  # the synthetic trajectories have recon's waypoint spacing
+        transform=transforms.ToTensor(),
+        aspect_ratio=4 / 3,
+        waypoint_spacing=1,
+        min_dist_cat=0,
+        max_dist_cat=10,
+        len_traj_pred=5,
+        learn_angle=True,
+        context_size=2,
+        end_slack=1,  # the rl samples load the frame after the observation
+        online_goals=True,
+    )
+    if dataset_class is GNM_Dataset:
+        kwargs.update(is_action=False, negative_mining=True)
+    else:
+        kwargs.update(discount=0.99)
+    return dataset_class(**kwargs)
+
+
+def index_samples(dataset) -> set:
+    return {
+        (dataset.traj_names[sample["curr_traj"]], int(sample["curr_time"]))
+        for sample in np.asarray(dataset.index_to_data)
+    }
+
+
+@pytest.mark.parametrize("dataset_class", [GNM_Dataset, RLDataset])
+def test_update_online_goals_index(
+    dataset_class, synthetic_data_folder, split_folder, tmp_path
+):
+    make_dataset(dataset_class, synthetic_data_folder, split_folder)
+    traj_names_file = os.path.join(split_folder, "traj_names.txt")
+    with open(traj_names_file, "r") as f:
+        traj_names = [line for line in f.read().split("\n") if line != ""]
+    # drop a trajectory from the middle of the split so the trajectory ids of the later ones change
+    with open(traj_names_file, "w") as f:
+        f.write("".join(f"{traj_name}\n" for traj_name in traj_names if traj_name != traj_names[3]))
+
+    updated = make_dataset(dataset_class, synthetic_data_folder, split_folder)
+    fresh_split_folder = str(tmp_path / "fresh")
+    os.makedirs(fresh_split_folder)
+    with open(traj_names_file, "r") as src, open(
+        os.path.join(fresh_split_folder, "traj_names.txt"), "w"
+    ) as dst:
+        dst.write(src.read())
+    fresh = make_dataset(dataset_class, synthetic_data_folder, fresh_split_folder)
+
+    assert traj_names[3] not in updated.traj_names
+    assert index_samples(updated) == index_samples(fresh)
+    updated[len(updated) - 1]
@@ -0,0 +1,52 @@
+import numpy as np
+from torchvision import transforms
+
+from gnm_train.data.gnm_dataset import GNM_Dataset
+from gnm_train.data.joint_gnm_dataset import JointGNM_Dataset
+
+DATASET_KWARGS = dict(
+    dataset_name="recon",  # the synthetic trajectories have recon's waypoint spacing
+    transform=transforms.ToTensor(),
+    aspect_ratio=4 / 3,
+    waypoint_spacing=1,
+    negative_mining=True,
+    len_traj_pred=5,
+    learn_angle=True,
+    context_size=2,
+    goals_per_obs=8,
+)
+
+
+def dist_histogram(index_to_data: np.ndarray, max_dist_cat: int) -> np.ndarray:
+    index_to_data = np.asarray(index_to_data)
+    dists = index_to_data["goal_time"] - index_to_data["curr_time"]
+    dists[index_to_data["goal_traj"] != index_to_data["curr_traj"]] = -1
+    return np.bincount(dists + 1, minlength=max_dist_cat + 2)
+
+
+def test_joint_distance_goals_match_gnm_dataset(synthetic_data_folder, split_folder):
+    # fewer action than distance categories, the observations run out of action goals first
+    joint = JointGNM_Dataset(
+        data_folder=synthetic_data_folder,
+        data_split_folder=split_folder,
+        dist_min_dist_cat=0,
+        dist_max_dist_cat=10,
+        action_min_dist_cat=0,
+        action_max_dist_cat=3,
+        **DATASET_KWARGS,
+    )
+    gnm = GNM_Dataset(
+        data_folder=synthetic_data_folder,
+        data_split_folder=split_folder,
+        is_action=False,
+        min_dist_cat=0,
+        max_dist_cat=10,
+        **DATASET_KWARGS,
+    )
+    joint_hist = dist_histogram(joint.index_to_data, 10)
+    gnm_hist = dist_histogram(gnm.index_to_data, 10)
+    assert joint_hist.sum() == gnm_hist.sum()
+    # the balancers draw in a different order, the histograms only match up to the sampling noise
+    assert np.abs(joint_hist - gnm_hist).max() <= 0.02 * gnm_hist.sum()
+    action_dists = joint.index_to_data["action_goal_time"] - joint.index_to_data["curr_time"]
+    assert action_dists.min() >= 0 and action_dists.max() <= 3
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import torch
+from torchvision import transforms
+
+from gnm_train.data.data_utils import (
+    calculate_sin_cos,
+    split_action_labels,
+    to_local_coords,
+)
+from gnm_train.data.gnm_dataset import GNM_Dataset
+
+LEN_TRAJ_PRED = 5
+WAYPOINT_SPACING = 2
+
+
+def per_sample_action_labels(
+    traj_data, curr_time: int, goal_time: int, learn_angle: bool, scale: float
+):
+    # the labels GNM_Dataset computed in __getitem__ before the label table
+    spacing = WAYPOINT_SPACING
+    traj_len = min(LEN_TRAJ_PRED, (goal_time - curr_time) // spacing)
+    pos_goal = traj_data["position"][goal_time, :2]
+    pos_list = traj_data["position"][
+        curr_time : curr_time + (traj_len + 1) * spacing : spacing, :2
+    ]
+    if learn_angle:
+        pos_goal = np.concatenate(
+            (pos_goal, np.array(traj_data["yaw"][goal_time]).reshape(1)), axis=0
+        )
+        pos_list_angle = traj_data["yaw"][
+            curr_time : curr_time + (traj_len + 1) * spacing : spacing
+        ]
+        pos_list = np.concatenate(
+            (pos_list, pos_list_angle.reshape(len(pos_list_angle), 1)), axis=1
+        )
+        param_dim = 3
+    else:
+        param_dim = 2
+    goals_appendage = pos_goal * np.ones((LEN_TRAJ_PRED - traj_len, param_dim))
+    pos_list = np.concatenate((pos_list, goals_appendage), axis=0)
+    pos_nplist = np.array(pos_list[1:])
+    yaw = traj_data["yaw"][curr_time]
+    waypoints = torch.Tensor(to_local_coords(pos_nplist, pos_list[0], yaw).astype(float))
+    goal = torch.Tensor(to_local_coords(pos_goal, pos_list[0], yaw).astype(float))
+    if learn_angle:
+        waypoints[1:, 2] -= waypoints[0, 2]
+        waypoints = calculate_sin_cos(waypoints)
+    waypoints[:, :2] /= scale
+    goal[:2] /= scale
+    return goal, waypoints
+
+
+@pytest.mark.parametrize("learn_angle", [True, False])
+@pytest.mark.parametrize("normalize", [True, False])
+def test_label_table_matches_per_sample_labels(
+    learn_angle, normalize, synthetic_data_folder, split_folder
+):
+    dataset = GNM_Dataset(
+        data_folder=synthetic_data_folder,
+        data_split_folder=split_folder,
+        dataset_name="recon",  # the synthetic trajectories have recon's waypoint spacing
+        is_action=True,
+        transform=transforms.ToTensor(),
+        aspect_ratio=4 / 3,
+        waypoint_spacing=WAYPOINT_SPACING,
+        min_dist_cat=0,
+        max_dist_cat=10,
+        negative_mining=False,
+        len_traj_pred=LEN_TRAJ_PRED,
+        learn_angle=learn_angle,
+        context_size=2,
+        normalize=normalize,
+    )
+    scale = dataset._get_label_scale()
+    assert len(dataset.index_to_data) > 0
+    for sample, labels in zip(dataset.index_to_data, dataset.label_table):
+        traj_data = dataset.traj_data_cache.get(
+            dataset.index_traj_names[sample["curr_traj"]]
+        )
+        goal, waypoints = split_action_labels(labels, LEN_TRAJ_PRED, learn_angle)
+        expected_goal, expected_waypoints = per_sample_action_labels(
+            traj_data,
+            int(sample["curr_time"]),
+            int(sample["goal_time"]),
+            learn_angle,
+            scale,
+        )
+        assert torch.allclose(goal, expected_goal, atol=1e-5)
+        assert torch.allclose(waypoints, expected_waypoints, atol=1e-5)
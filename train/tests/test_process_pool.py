@@ -0,0 +1,54 @@
+import os
+import pickle
+from functools import partial
+from typing import List
+
+import numpy as np
+
+from gnm_train.process_data.process_pool import (
+    is_processed,
+    mark_processed,
+    process_in_pool,
+)
+
+NUM_INPUTS = 6
+
+
+def process_input(output_dir: str, seed: int) -> List[str]:
+    # stands in for processing a bag: writes a couple of trajectories and the marker of the input
+    rng = np.random.default_rng(seed)
+    traj_names = [f"input_{seed}_{j}" for j in range(2)]
+    for traj_name in traj_names:
+        os.makedirs(os.path.join(output_dir, traj_name))
+        traj_data = {"position": rng.random((10, 2)), "yaw": rng.random(10)}
+        with open(os.path.join(output_dir, traj_name, "traj_data.pkl"), "wb") as f:
+            pickle.dump(traj_data, f)
+    mark_processed(output_dir, f"input_{seed}", traj_names)
+    return traj_names
+
+
+def read_tree(folder: str) -> dict:
+    contents = {}
+    for root, _, files in os.walk(folder):
+        for file in files:
+            path = os.path.join(root, file)
+            with open(path, "rb") as f:
+                contents[os.path.relpath(path, folder)] = f.read()
+    return contents
+
+
+def test_process_in_pool_matches_serial(tmp_path):
+    outputs = {}
+    for num_workers in [0, 2]:
+        output_dir = str(tmp_path / f"workers_{num_workers}")
+        results = process_in_pool(
+            partial(process_input, output_dir),
+            list(range(NUM_INPUTS)),
+            num_workers,
+            "Inputs processed",
+        )
+        assert all(is_processed(output_dir, f"input_{seed}") for seed in range(NUM_INPUTS))
+        # the pool returns the results in the order the inputs finished
+        outputs[num_workers] = sorted(results), read_tree(output_dir)
+    assert len(outputs[0][1]) == NUM_INPUTS * 3
+    assert outputs[0] == outputs[2]
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import numpy as np
+from torch.utils.data import ConcatDataset, DataLoader
+
+from gnm_train.data.samplers import BlockShuffleSampler
+from gnm_train.training.train_utils import log_data_stats
+
+
+class TrajDataset:
+    # stands in for a dataset with an index: 10 trajectories of 20 observations
+    def __init__(self) -> None:
+        self.index_to_data = np.zeros(200, dtype=[("curr_traj", np.int32)])
+        self.index_to_data["curr_traj"] = np.arange(200) // 20
+        self.index_traj_names = [f"traj_{j}" for j in range(10)]
+        self.frame_loader = SimpleNamespace(frame_cache=None)
+
+    def __len__(self) -> int:
+        return len(self.index_to_data)
+
+    def __getitem__(self, i: int) -> int:
+        return i
+
+
+def test_log_data_stats_logs_each_epoch_locality(capsys):
+    dataset = ConcatDataset([TrajDataset()])
+    sampler = BlockShuffleSampler(dataset, block_size=5, seed=0)
+    loader = DataLoader(dataset, batch_size=10, sampler=sampler)
+    localities = []
+    for epoch in range(2):
+        order = np.concatenate([batch.numpy() for batch in loader])
+        log_data_stats("train_dist", loader, use_wandb=False)
+        localities.append(sampler.locality(order))
+        assert f"train_dist sampler locality: {localities[-1]:.3f}" in capsys.readouterr().out
+    assert localities[0] != localities[1]
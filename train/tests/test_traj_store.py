@@ -0,0 +1,40 @@
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from gnm_train.data.data_utils import TrajDataCache, get_traj_data_path
+from gnm_train.data.traj_store import build_traj_store
+
+
+def touch_later(path: str) -> None:
+    # as if the file was written again a second later, the clock may not tick between two writes of a test
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_traj_data_cache_reads_changed_trajectories_from_pkl(
+    synthetic_data_folder, tmp_path
+):
+    data_folder = str(tmp_path / "data")
+    shutil.copytree(synthetic_data_folder, data_folder)
+    build_traj_store(data_folder)
+    # the trajectory is processed again after the store was built
+    traj_data_path = get_traj_data_path(data_folder, "synthetic_4")
+    with open(traj_data_path, "rb") as f:
+        traj_data = pickle.load(f)
+    traj_data["position"] = traj_data["position"] + 1
+    with open(traj_data_path, "wb") as f:
+        pickle.dump(traj_data, f)
+    touch_later(traj_data_path)
+
+    cache = TrajDataCache(data_folder)
+    assert "synthetic_4" not in cache.traj_store
+    assert "synthetic_3" in cache.traj_store
+    assert np.array_equal(cache.get("synthetic_4")["position"], traj_data["position"])
+
+    build_traj_store(data_folder)
+    cache = TrajDataCache(data_folder)
+    assert "synthetic_4" in cache.traj_store
+    assert np.array_equal(cache.get("synthetic_4")["position"], traj_data["position"])
@@ -9,7 +9,7 @@ from itertools import chain
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, ConcatDataset
+from torch.utils.data import DataLoader, ConcatDataset, Subset
 from torch.optim import Adam, AdamW
 from torchvision import transforms
 import torch.backends.cudnn as cudnn
@@ -19,6 +19,14 @@ from gnm_train.models.siamese import SiameseModel
 from gnm_train.models.stacked import StackedModel
 from gnm_train.data.gnm_dataset import GNM_Dataset
 from gnm_train.data.pairwise_distance_dataset import PairwiseDistanceDataset
+from gnm_train.data.joint_gnm_dataset import JointGNM_Dataset
+from gnm_train.data.samplers import BlockShuffleSampler
+from gnm_train.data.sample_shards import load_sharded_dataset
+from gnm_train.data.batch_transform import (
+    BatchTransform,
+    BatchTransformLoader,
+    get_uint8_transform,
+)
 from gnm_train.training.train_utils import (
     train_eval_loop,
     load_model,
@@ -59,14 +67,21 @@ def main(config):
         cudnn.deterministic = True
 
     cudnn.benchmark = True  # good if input sizes don't vary
-    transform = [
-        transforms.ToTensor(),
-        transforms.Resize(
-            (config["image_size"][1], config["image_size"][0])
-        ),  # torch does (h, w)
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-    transform = transforms.Compose(transform)
+    if "batch_transform" not in config:
+        config["batch_transform"] = False
+    if config["batch_transform"]:
+        # the datasets emit uint8 images, they are converted and normalized once per batch
+        transform = get_uint8_transform(config["image_size"])
+        batch_transform = BatchTransform(config["image_size"])
+    else:
+        transform = [
+            transforms.ToTensor(),
+            transforms.Resize(
+                (config["image_size"][1], config["image_size"][0])
+            ),  # torch does (h, w)
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+        transform = transforms.Compose(transform)
     aspect_ratio = config["image_size"][0] / config["image_size"][1]
 
     # Load the data
@@ -78,6 +93,38 @@ def main(config):
 
     if "context_type" not in config:
         config["context_type"] = "temporal"
+    if "traj_cache_size" not in config:
+        config["traj_cache_size"] = 64
+    if "frame_cache_mb" not in config:
+        config["frame_cache_mb"] = 0
+    if "decode_threads" not in config:
+        config["decode_threads"] = 0
+    if "jpeg_draft" not in config:
+        config["jpeg_draft"] = False
+    if "index_workers" not in config:
+        config["index_workers"] = 0
+    if "eval_subset_size" not in config:
+        config["eval_subset_size"] = 0
+    if "eval_subset_seed" not in config:
+        config["eval_subset_seed"] = 0
+    if "online_goals" not in config:
+        config["online_goals"] = False
+    if "viz_images" not in config:
+        config["viz_images"] = True
+    if "shuffle_block_size" not in config:
+        config["shuffle_block_size"] = 0
+    if "joint_dataset" not in config:
+        config["joint_dataset"] = False
+    if "sample_shards" not in config:
+        config["sample_shards"] = False
+    if "samples_per_shard" not in config:
+        config["samples_per_shard"] = 500
+    if "shuffle_buffer_size" not in config:
+        config["shuffle_buffer_size"] = 5000
+    # the joint datasets and the sample shards hold fixed goals
+    assert not config["online_goals"] or not (
+        config["joint_dataset"] or config["sample_shards"]
+    ), "online_goals can't be used with joint_dataset or sample_shards"
 
     if config["model_type"] == "stable_contrastive_rl":
         output_types = ["rl", "pairwise"]
@@ -94,10 +141,20 @@ def main(config):
             data_config["end_slack"] = 0
         if "waypoint_spacing" not in data_config:
             data_config["waypoint_spacing"] = 1
+        if "packed_image_folder" not in data_config:
+            data_config["packed_image_folder"] = None
             
         for data_split_type in ["train", "test"]:
             if data_split_type in data_config:
-                for output_type in output_types:
+                split_output_types = output_types
+                if config["joint_dataset"] and data_split_type == "train":
+                    # train on one dataset with both a distance and an action goal per observation
+                    split_output_types = [
+                        output_type
+                        for output_type in output_types
+                        if output_type not in ["action", "distance"]
+                    ] + ["joint"]
+                for output_type in split_output_types:
                     
                     if output_type == "pairwise":
                         dataset = PairwiseDistanceDataset(
@@ -114,6 +171,13 @@ def main(config):
                             context_size=config["context_size"],
                             context_type=config["context_type"],
                             end_slack=data_config["end_slack"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            viz_images=config["viz_images"],
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
                         )
                     elif output_type == "rl":
                         dataset = RLDataset(
@@ -130,13 +194,48 @@ def main(config):
                             discount=data_config["discount"],
                             len_traj_pred=config["len_traj_pred"],
                             learn_angle=config["learn_angle"],
-                            oracle_angles=config[output_type]["oracle_angles"],
-                            num_oracle_trajs=config[output_type]["num_oracle_trajs"],
                             context_size=config["context_size"],
                             context_type=config["context_type"],
                             end_slack=data_config["end_slack"],
                             goals_per_obs=data_config["goals_per_obs"],
                             normalize=config["normalize"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            viz_images=config["viz_images"],
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
+                            online_goals=config["online_goals"]
+                            and data_split_type == "train",
+                        )
+                    elif output_type == "joint":
+                        dataset = JointGNM_Dataset(
+                            data_folder=data_config["data_folder"],
+                            data_split_folder=data_config[data_split_type],
+                            dataset_name=dataset_name,
+                            transform=transform,
+                            aspect_ratio=aspect_ratio,
+                            waypoint_spacing=data_config["waypoint_spacing"],
+                            dist_min_dist_cat=config["distance"]["min_dist_cat"],
+                            dist_max_dist_cat=config["distance"]["max_dist_cat"],
+                            action_min_dist_cat=config["action"]["min_dist_cat"],
+                            action_max_dist_cat=config["action"]["max_dist_cat"],
+                            negative_mining=data_config["negative_mining"],
+                            len_traj_pred=config["len_traj_pred"],
+                            learn_angle=config["learn_angle"],
+                            context_size=config["context_size"],
+                            context_type=config["context_type"],
+                            end_slack=data_config["end_slack"],
+                            goals_per_obs=data_config["goals_per_obs"],
+                            normalize=config["normalize"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            viz_images=config["viz_images"],
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
                         )
                     else:
                         dataset = GNM_Dataset(
@@ -157,9 +256,19 @@ def main(config):
                             end_slack=data_config["end_slack"],
                             goals_per_obs=data_config["goals_per_obs"],
                             normalize=config["normalize"],
+                            traj_cache_size=config["traj_cache_size"],
+                            packed_image_folder=data_config["packed_image_folder"],
+                            frame_cache_bytes=int(config["frame_cache_mb"] * 2**20),
+                            viz_images=config["viz_images"],
+                            decode_threads=config["decode_threads"],
+                            jpeg_draft=config["jpeg_draft"],
+                            index_workers=config["index_workers"],
+                            online_goals=config["online_goals"]
+                            and data_split_type == "train",
                         )
                     if data_split_type == "train":
-                        if output_type == "distance":
+                        if output_type in ["distance", "joint"]:
+                            # the joint datasets are loaded by train_dist_loader alone
                             train_dist_dataset.append(dataset)
                         elif output_type == "action":
                             train_action_dataset.append(dataset)
@@ -178,45 +287,124 @@ def main(config):
     train_dist_loader = train_action_loader = train_rl_loader = None
 
     if len(train_dist_dataset) > 0:
-        train_dist_dataset = ConcatDataset(train_dist_dataset)
+        train_dist_sampler = None
+        if config["sample_shards"]:
+            # stream the samples from sequential shards, shuffled in a buffer instead of by the DataLoader
+            train_dist_dataset = load_sharded_dataset(
+                train_dist_dataset,
+                config["samples_per_shard"],
+                config["shuffle_buffer_size"],
+            )
+        else:
+            train_dist_dataset = ConcatDataset(train_dist_dataset)
+        if config["shuffle_block_size"] > 0 and not config["sample_shards"]:
+            train_dist_sampler = BlockShuffleSampler(
+                train_dist_dataset,
+                config["shuffle_block_size"],
+                config.get("seed", 0),
+            )
+            print(f"Shuffling the distance training data with {train_dist_sampler}")
         train_dist_loader = DataLoader(
             train_dist_dataset,
             batch_size=config["batch_size"],
-            shuffle=True,
+            shuffle=train_dist_sampler is None and not config["sample_shards"],
+            sampler=train_dist_sampler,
             num_workers=config["num_workers"],
             drop_last=True,
         )
+        if config["batch_transform"]:
+            train_dist_loader = BatchTransformLoader(
+                train_dist_loader, batch_transform, device
+            )
     if len(train_action_dataset) > 0:
-        train_action_dataset = ConcatDataset(train_action_dataset)
+        train_action_sampler = None
+        if config["sample_shards"]:
+            # stream the samples from sequential shards, shuffled in a buffer instead of by the DataLoader
+            train_action_dataset = load_sharded_dataset(
+                train_action_dataset,
+                config["samples_per_shard"],
+                config["shuffle_buffer_size"],
+            )
+        else:
+            train_action_dataset = ConcatDataset(train_action_dataset)
+        if config["shuffle_block_size"] > 0 and not config["sample_shards"]:
+            train_action_sampler = BlockShuffleSampler(
+                train_action_dataset,
+                config["shuffle_block_size"],
+                config.get("seed", 0),
+            )
+            print(f"Shuffling the action training data with {train_action_sampler}")
         train_action_loader = DataLoader(
             train_action_dataset,
             batch_size=config["batch_size"],
-            shuffle=True,
+            shuffle=train_action_sampler is None and not config["sample_shards"],
+            sampler=train_action_sampler,
             num_workers=config["num_workers"],
             drop_last=True,
         )
+        if config["batch_transform"]:
+            train_action_loader = BatchTransformLoader(
+                train_action_loader, batch_transform, device
+            )
     if len(train_rl_dataset) > 0:
-        train_rl_dataset = ConcatDataset(train_rl_dataset)
+        train_rl_sampler = None
+        if config["sample_shards"]:
+            # stream the samples from sequential shards, shuffled in a buffer instead of by the DataLoader
+            train_rl_dataset = load_sharded_dataset(
+                train_rl_dataset,
+                config["samples_per_shard"],
+                config["shuffle_buffer_size"],
+            )
+        else:
+            train_rl_dataset = ConcatDataset(train_rl_dataset)
+        if config["shuffle_block_size"] > 0 and not config["sample_shards"]:
+            train_rl_sampler = BlockShuffleSampler(
+                train_rl_dataset,
+                config["shuffle_block_size"],
+                config.get("seed", 0),
+            )
+            print(f"Shuffling the rl training data with {train_rl_sampler}")
         train_rl_loader = DataLoader(
             train_rl_dataset,
             batch_size=config["batch_size"],
-            shuffle=True,
+            shuffle=train_rl_sampler is None and not config["sample_shards"],
+            sampler=train_rl_sampler,
             num_workers=config["num_workers"],
             drop_last=True,
         )
+        if config["batch_transform"]:
+            train_rl_loader = BatchTransformLoader(
+                train_rl_loader, batch_transform, device
+            )
 
     if "eval_batch_size" not in config:
         config["eval_batch_size"] = config["batch_size"]
 
     for dataset_type in test_dataloaders:
         for loader_type in test_dataloaders[dataset_type]:
+            dataset = test_dataloaders[dataset_type][loader_type]
+            if config["eval_subset_size"] > 0:
+                # evaluate on the same stratified subset every time, so evaluating doesn't get slower as the dataset grows
+                eval_subset = dataset.get_eval_subset(
+                    config["eval_subset_size"], config["eval_subset_seed"]
+                )
+                print(
+                    f"Evaluating on {len(eval_subset)} of the {len(dataset)} {dataset_type} {loader_type} points"
+                )
+                dataset = Subset(dataset, eval_subset)
+            # a subset is evaluated whole and in order, so every evaluation sees exactly the same points
+            use_subset = config["eval_subset_size"] > 0
             test_dataloaders[dataset_type][loader_type] = DataLoader(
-                test_dataloaders[dataset_type][loader_type],
+                dataset,
                 batch_size=config["eval_batch_size"],
-                shuffle=True,
+                shuffle=not use_subset,
                 num_workers=config["num_workers"],
-                drop_last=True,
+                drop_last=not use_subset,
             )
+            if config["batch_transform"]:
+                test_dataloaders[dataset_type][loader_type] = BatchTransformLoader(
+                    test_dataloaders[dataset_type][loader_type], batch_transform, device
+                )
 
     # Create the model
     if config["model_type"] == "gnm":
@@ -318,7 +506,7 @@ def main(config):
             assert type(model.module) != StableContrastiveRL
 
         assert train_dist_loader is not None
-        assert train_action_loader is not None
+        assert train_action_loader is not None or config["joint_dataset"]
 
         train_eval_loop(
             model=model,
@@ -372,6 +560,8 @@ def main(config):
             mle_gcbc_loss=config["mle_gcbc_loss"],
             stop_grad_actor_img_encoder=config["stop_grad_actor_img_encoder"],
             use_wandb=config["use_wandb"],
+            oracle_angles=config["rl"]["oracle_angles"],
+            num_oracle_trajs=config["rl"]["num_oracle_trajs"],
         )
     else:
         raise ValueError(f"Training type {config['train']} not supported")
@@ -0,0 +1,141 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+from gnm_train.data.data_utils import get_draft_size, img_path_to_data
+
+NUM_WARMUP_FRAMES = 5
+
+
+def get_draft_scale(path: str, aspect_ratio: float, draft_size) -> int:
+    # the inverse of the scale the jpg decoder picks for draft_size (1 if draft doesn't reduce the frame)
+    with Image.open(path) as img:
+        full_width = img.width
+        img.draft("RGB", get_draft_size(img.size, aspect_ratio, [draft_size]))
+        return full_width // img.width
+
+
+def main(args: argparse.Namespace):
+    # the training transform without the normalization, so the errors are in [0, 1] pixel units
+    transform = transforms.Compose(
+        [
+            transforms.ToTensor(),
+            transforms.Resize((args.image_size[1], args.image_size[0])),
+        ]
+    )
+    aspect_ratio = args.image_size[0] / args.image_size[1]
+    draft_size = (args.image_size[1], args.image_size[0])
+
+    traj_names = sorted(
+        f
+        for f in os.listdir(args.data_dir)
+        if os.path.isfile(os.path.join(args.data_dir, f, "traj_data.pkl"))
+    )
+    rng = np.random.default_rng(args.seed)
+    paths = []
+    for traj_name in rng.permutation(traj_names):
+        traj_folder = os.path.join(args.data_dir, traj_name)
+        num_frames = len([f for f in os.listdir(traj_folder) if f.endswith(".jpg")])
+        if num_frames > 0:
+            paths.append(
+                os.path.join(traj_folder, f"{rng.integers(num_frames)}.jpg")
+            )
+        if len(paths) >= args.num_frames:
+            break
+
+    def decode(path, use_draft):
+        start = time.perf_counter()
+        _, img = img_path_to_data(
+            path,
+            transform,
+            aspect_ratio,
+            load_viz=False,
+            draft_size=draft_size if use_draft else None,
+        )
+        return img, time.perf_counter() - start
+
+    # the first decodes pay for the imports, allocations and cold file cache, keep them out of the timings
+    for path in paths[:NUM_WARMUP_FRAMES]:
+        decode(path, False)
+        decode(path, True)
+
+    abs_errors = []
+    sq_errors = []
+    max_errors = []
+    draft_scales = []
+    full_time = draft_time = 0.0
+    for path in paths:
+        # decode in a random order, so neither decode always reads the file from disk for the other
+        if rng.random() < 0.5:
+            full_img, full_elapsed = decode(path, False)
+            draft_img, draft_elapsed = decode(path, True)
+        else:
+            draft_img, draft_elapsed = decode(path, True)
+            full_img, full_elapsed = decode(path, False)
+        full_time += full_elapsed
+        draft_time += draft_elapsed
+        draft_scales.append(get_draft_scale(path, aspect_ratio, draft_size))
+        error = (full_img - draft_img).abs()
+        abs_errors.append(error.mean().item())
+        sq_errors.append(error.square().mean().item())
+        max_errors.append(error.max().item())
+
+    if len(paths) == 0:
+        print(f"No frames found in {args.data_dir}")
+        return
+    mse = np.mean(sq_errors)
+    print(f"Compared {len(paths)} frames at image size {args.image_size[0]}x{args.image_size[1]}")
+    print(f"Mean absolute pixel error: {np.mean(abs_errors):.4f} (in [0, 1] units)")
+    print(f"95th percentile of the per frame mean error: {np.percentile(abs_errors, 95):.4f}")
+    print(f"Max pixel error: {np.max(max_errors):.4f}")
+    print(f"PSNR: {10 * np.log10(1 / max(mse, 1e-12)):.1f} dB")
+    scales, counts = np.unique(draft_scales, return_counts=True)
+    print(
+        "Draft decode scale: "
+        + ", ".join(f"1/{scale} for {count} frames" for scale, count in zip(scales, counts))
+    )
+    print(
+        f"Decode time per frame: {1000 * full_time / len(paths):.2f}ms full, {1000 * draft_time / len(paths):.2f}ms draft ({full_time / max(draft_time, 1e-12):.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare frames decoded with jpeg_draft against the full resolution decode"
+    )
+    parser.add_argument(
+        "--data-dir",
+        "-i",
+        type=str,
+        help="path of the processed dataset (e.g. datasets/recon/)",
+        required=True,
+    )
+    parser.add_argument(
+        "--image-size",
+        "-s",
+        default=[85, 64],
+        nargs=2,
+        type=int,
+        help="width and height of the transformed images, should match image_size in the training config (default: 85 64)",
+    )
+    parser.add_argument(
+        "--num-frames",
+        "-n",
+        default=200,
+        type=int,
+        help="number of frames to compare, at most one per trajectory (default: 200)",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="random seed (default: 0)",
+    )
+    args = parser.parse_args()
+    print("STARTING VALIDATING JPEG DRAFT DECODING")
+    main(args)
+    print("FINISHED VALIDATING JPEG DRAFT DECODING")